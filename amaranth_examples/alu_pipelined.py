@@ -0,0 +1,261 @@
+"""
+A width-parametric, pipelined version of the ALU from comb_test.py.
+
+At wider widths the combinatorial ALU's carry chain is the critical path of
+whatever design it sits in. PipelinedALU splits the operands into `stages`
+chunks and adds one chunk per pipeline stage, registering the carry out of
+each chunk along with the operand bits still to be added and the sum bits
+already done. It accepts a new operation every cycle, and a `valid` bit
+travels through the pipeline alongside each one, so `y_valid` marks which
+outputs are results, `stages` cycles after their inputs.
+
+With `stages=0` there are no registers and it behaves exactly like the
+combinatorial ALU.
+
+Running this module directly builds the ALU with each stage count for the
+iCE40 board from custom_board.py and the ECP5 ULX3S from pll_ecp5.py, and
+prints the maximum frequency nextpnr reports for each (see reports.py):
+
+    python -m amaranth_examples.alu_pipelined --width 32 --stages 0 1 2 4
+"""
+
+import argparse
+import random
+import sys
+
+from amaranth import Module, Signal, Elaboratable, Cat, Mux
+from amaranth.sim import Simulator, Settle, Tick
+
+
+class PipelinedALU(Elaboratable):
+    """
+    Adds (`op=1`) or subtracts (`op=0`) `a` and `b` with the same result as
+    comb_test.ALU, with `stages` register stages (at most `width`).
+    """
+    def __init__(self, width=8, stages=1):
+        assert 0 <= stages <= width
+        self.width = width
+        self.stages = stages
+        self.op = Signal()
+        self.a = Signal(width)
+        self.b = Signal(width)
+        self.valid = Signal()
+        self.y = Signal(width + 1)
+        self.y_valid = Signal()
+
+    def chunks(self):
+        """The width of the chunk added in each stage, lowest first."""
+        n = max(self.stages, 1)
+        return [self.width // n + (i < self.width % n) for i in range(n)]
+
+    def elaborate(self, platform):
+        m = Module()
+
+        # Subtraction is a + ~b + 1, so invert b and use a carry in of 1.
+        op = self.op
+        valid = self.valid
+        a = self.a
+        b = Mux(op, self.b, ~self.b)
+        carry = ~op
+        done = []
+
+        def reg(value, name):
+            r = Signal(len(value), name=name)
+            m.d.sync += r.eq(value)
+            return r
+
+        for stage, size in enumerate(self.chunks()):
+            total = a[:size] + b[:size] + carry
+            done.append(total[:size])
+            carry = total[size]
+            a = a[size:]
+            b = b[size:]
+            if stage < self.stages:
+                # Register everything the later stages need.
+                op = reg(op, f"s{stage}_op")
+                valid = reg(valid, f"s{stage}_valid")
+                carry = reg(carry, f"s{stage}_carry")
+                done = [reg(Cat(*done), f"s{stage}_done")]
+                if len(a):
+                    a = reg(a, f"s{stage}_a")
+                    b = reg(b, f"s{stage}_b")
+
+        # A subtraction borrows when there is no carry out.
+        m.d.comb += [
+            self.y.eq(Cat(*done, carry ^ ~op)),
+            self.y_valid.eq(valid),
+        ]
+
+        return m
+
+
+def alu_result(width, op, a, b):
+    return a + b if op else (a - b) % 2**(width + 1)
+
+
+def check_pipeline(width, stages, cycles=500, seed=0):
+    """
+    Feed `cycles` random operations into a PipelinedALU, one per cycle but
+    leaving gaps at random, and return (sent, received): lists of
+    (cycle, result) for the expected results and for the results that
+    came out, where a result's cycle is the one its inputs were given in.
+    """
+    rng = random.Random(seed)
+    dut = PipelinedALU(width, stages)
+    top = 2**width - 1
+    edges = [0, 1, top - 1, top]
+    sent = []
+    received = []
+
+    def operand(cycle, every):
+        # Mix in the extreme values regularly, as they exercise every carry.
+        if cycle % every == 0:
+            return rng.choice(edges)
+        return rng.randint(0, top)
+
+    def testbench():
+        for cycle in range(cycles + stages):
+            valid = cycle < cycles and rng.random() < 0.8
+            op = rng.getrandbits(1)
+            a = operand(cycle, 7)
+            b = operand(cycle, 5)
+            yield dut.valid.eq(valid)
+            yield dut.op.eq(op)
+            yield dut.a.eq(a)
+            yield dut.b.eq(b)
+            if valid:
+                sent.append((cycle, alu_result(width, op, a, b)))
+            if stages == 0:
+                # Without any stages there is no clock, so just settle.
+                yield Settle()
+                latency = 0
+            else:
+                # These inputs are captured by the edge we wait for here, so
+                # their result comes out `stages` edges later, at the end of
+                # iteration `cycle + stages - 1`. Outputs changed by an edge
+                # are only visible to a sync process after settling.
+                yield Tick()
+                yield Settle()
+                latency = stages - 1
+            if (yield dut.y_valid):
+                received.append((cycle - latency, (yield dut.y)))
+
+    sim = Simulator(dut)
+    if stages:
+        sim.add_clock(1/10e6)
+        sim.add_sync_process(testbench)
+    else:
+        sim.add_process(testbench)
+    sim.run()
+    return sent, received
+
+
+class FmaxTop(Elaboratable):
+    """
+    A PipelinedALU between registers, for measuring its maximum frequency.
+
+    There aren't enough pins for the ALU's ports, so its inputs come from
+    an LFSR and its outputs are folded into a signature register which
+    drives one LED; that way synthesis can't optimise any of it away, and
+    every path into and out of the ALU is register to register.
+    """
+    def __init__(self, width=32, stages=1):
+        self.alu = PipelinedALU(width, stages)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.alu = alu = self.alu
+
+        inputs = Cat(alu.a, alu.b, alu.op, alu.valid)
+        lfsr = Signal(len(inputs), reset=1)
+        m.d.sync += lfsr.eq(Cat(lfsr[-1] ^ lfsr[-2] ^ lfsr[0], lfsr[:-1]))
+        m.d.comb += inputs.eq(lfsr)
+
+        outputs = Cat(alu.y, alu.y_valid)
+        signature = Signal(len(outputs))
+        m.d.sync += signature.eq(Cat(signature[1:], signature[0]) ^ outputs)
+        m.d.comb += platform.request("led", 0).o.eq(signature[0])
+
+        return m
+
+
+PLATFORMS = {
+    "ice40": "custom_ice40",
+    "ecp5": "ulx3s_12f",
+}
+
+
+def fmax_jobs(width, stage_counts, platforms=PLATFORMS):
+    from amaranth_examples.build_runner import BuildJob
+
+    return [BuildJob(f"alu_{name}_w{width}_s{stages}",
+                     "amaranth_examples.alu_pipelined:FmaxTop", platform,
+                     top_kwargs={"width": width, "stages": stages})
+            for name, platform in platforms.items()
+            for stages in stage_counts]
+
+
+def measure_fmax(width, stage_counts, root="build", workers=None,
+                 cache=None):
+    """
+    Build the ALU with each stage count on each platform, returning a dict
+    of {(platform, stages): Fmax in MHz}.
+    """
+    from amaranth_examples.build_runner import run_builds, tail
+
+    jobs = fmax_jobs(width, stage_counts)
+    results = run_builds(jobs, root, workers, cache)
+    fmax = {}
+    for job, result in zip(jobs, results):
+        assert result.ok, f"{job.name} failed:\n{tail(result.log)}"
+        name = job.name.split("_")[1]
+        stages = job.top_kwargs["stages"]
+        # FmaxTop has just the one clock.
+        [clock] = result.metrics["clocks"].values()
+        fmax[name, stages] = clock["achieved_mhz"]
+    return fmax
+
+
+def format_fmax(fmax):
+    platforms = sorted({platform for platform, _ in fmax})
+    stage_counts = sorted({stages for _, stages in fmax})
+    lines = ["stages " + "".join(f"{p:>10}" for p in platforms)]
+    for stages in stage_counts:
+        lines.append(f"{stages:>6} " + "".join(
+            f"{fmax[p, stages]:>6.1f} MHz" for p in platforms))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--width", type=int, default=32,
+                        help="ALU width in bits")
+    parser.add_argument("--stages", type=int, nargs="+", default=[0, 1, 2, 4],
+                        help="stage counts to build")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of parallel builds (default: CPUs)")
+    parser.add_argument("--build-dir", default="build",
+                        help="root directory for per-build dirs")
+    args = parser.parse_args(argv)
+    fmax = measure_fmax(args.width, args.stages, args.build_dir, args.jobs)
+    print(format_fmax(fmax))
+    return 0
+
+
+def test_pipelined_alu():
+    for width in (8, 13, 32):
+        for stages in range(5):
+            sent, received = check_pipeline(width, stages)
+            assert received == sent, f"width={width} stages={stages}"
+
+
+def test_pipelined_alu_fmax_toolchain():
+    fmax = measure_fmax(32, [0, 2])
+    print(format_fmax(fmax))
+    # Splitting the carry chain in half should make it noticeably faster.
+    for platform in PLATFORMS:
+        assert fmax[platform, 2] > fmax[platform, 0]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
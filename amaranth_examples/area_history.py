@@ -0,0 +1,352 @@
+"""
+Keep a history of every build's resource use and timing, by git revision.
+
+A change which makes a design 30% bigger doesn't fail anything until the
+design stops fitting or meeting timing. So that growth shows up early,
+build_runner.py appends a record of each build's metrics (see reports.py)
+to `build/history.jsonl`, one JSON object per line:
+
+    {"design": "custom_board", "params": {}, "revision": "3a00b37...",
+     "time": 1700000000.0, "resources": {"lut": 41, "ff": 24, ...},
+     "cells": {"ICESTORM_LC": 50, ...},
+     "fmax_mhz": {"cd_sync_clk_0__i": 98.3},
+     "clock_domains": {"cd_sync_clk_0__i": "sync"}}
+
+`revision` is the commit checked out when the design was built, with
+"+dirty" added if tracked files had been changed. Fmax is recorded for
+each clock net, as nextpnr names them, since more than one net can belong
+to the same domain (or to none we can tell), and `clock_domains` gives
+the Amaranth domain of each net that has one. Parametric designs
+built with `top_kwargs`, such as the ALU at each pipeline depth in
+alu_pipelined.py, record their parameters, and each set of parameters is
+tracked as a separate design, so the area of a core can be followed as a
+function of its parameters as well as over time.
+
+To compare the latest build of each design at two revisions, cell type by
+cell type, flagging anything which grew by more than a threshold (or any
+clock whose Fmax fell by more than it), and exiting with an error if
+anything was flagged:
+
+    python -m amaranth_examples.area_history diff HEAD~3 HEAD --threshold 10
+    python -m amaranth_examples.area_history diff HEAD HEAD+dirty
+
+and to list a design's history:
+
+    python -m amaranth_examples.area_history log custom_board
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+DEFAULT_HISTORY = "build/history.jsonl"
+
+
+def _git(*args):
+    return subprocess.run(["git", *args], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def git_revision():
+    """
+    The commit hash of the checkout this package is in, with "+dirty" if
+    any tracked files have changed, or "unknown" outside a git checkout.
+    """
+    head = _git("rev-parse", "HEAD")
+    if head.returncode != 0:
+        return "unknown"
+    status = _git("status", "--porcelain", "--untracked-files=no")
+    return head.stdout.strip() + ("+dirty" if status.stdout.strip() else "")
+
+
+def resolve(spec):
+    """
+    Turn a revision `spec` such as "HEAD~1", a hash prefix, or either with
+    "+dirty" into the revision string recorded for builds of it, if git
+    knows it, or otherwise return it unchanged to match as a prefix.
+    """
+    base, dirty, _ = spec.partition("+dirty")
+    proc = _git("rev-parse", "--verify", "--quiet", f"{base}^{{commit}}")
+    if proc.returncode != 0:
+        return spec
+    return proc.stdout.strip() + ("+dirty" if dirty else "")
+
+
+def design_key(design, params):
+    """A name for `design` built with `params`, such as "alu[stages=2]"."""
+    if not params:
+        return design
+    args = ",".join(f"{name}={value}" for name, value in sorted(
+        params.items()))
+    return f"{design}[{args}]"
+
+
+def history_record(metrics, params=None, revision=None):
+    """The history record of a build with `metrics` from reports.py."""
+    return {
+        "design": metrics["design"],
+        "params": params or {},
+        "revision": revision or git_revision(),
+        "time": time.time(),
+        "resources": metrics["resources"],
+        "cells": {cell: used["used"]
+                  for cell, used in metrics["utilization"].items()},
+        "fmax_mhz": {net: clock["achieved_mhz"]
+                     for net, clock in metrics["clocks"].items()},
+        "clock_domains": {net: clock["domain"]
+                          for net, clock in metrics["clocks"].items()
+                          if clock["domain"]},
+    }
+
+
+def clock_name(record, net):
+    """`net`, with its clock domain in `record` if known: "clk (sync)"."""
+    domain = record.get("clock_domains", {}).get(net)
+    return f"{net} ({domain})" if domain else net
+
+
+def append_record(path, record):
+    """
+    Append `record` to the history at `path`. Each record is written with
+    a single call in append mode, so parallel builds can share a file.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def read_history(path):
+    records = []
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    return records
+
+
+def latest(records, revision):
+    """
+    The most recent record of each design (by `design_key`) built at
+    `revision`, which is matched exactly, or failing that as a prefix of
+    the commit hash. Builds with local changes only match a `revision`
+    ending in "+dirty", and vice versa.
+    """
+    matches = [r for r in records if r["revision"] == revision]
+    if not matches:
+        base, dirty, _ = revision.partition("+dirty")
+        for record in records:
+            commit, changed, _ = record["revision"].partition("+dirty")
+            if commit.startswith(base) and changed == dirty:
+                matches.append(record)
+    found = {}
+    for record in sorted(matches, key=lambda r: r["time"]):
+        found[design_key(record["design"], record["params"])] = record
+    return found
+
+
+def _growth(old, new):
+    if old == new:
+        return 0.0
+    if old == 0:
+        return float("inf")
+    return (new - old) / old * 100
+
+
+def diff(old, new, threshold=10.0):
+    """
+    Compare the records in `old` and `new`, dicts of design to record as
+    from `latest()`, for the designs in both. Returns a list of rows of
+    (design, quantity, old value, new value, percentage change, flagged).
+    Cell counts are flagged if they grew by more than `threshold` percent
+    and Fmax if it fell by more than that.
+    """
+    rows = []
+    for design in sorted(old.keys() & new.keys()):
+        a, b = old[design], new[design]
+        for group in ("resources", "cells"):
+            for cell in sorted(a[group].keys() | b[group].keys()):
+                before = a[group].get(cell, 0)
+                after = b[group].get(cell, 0)
+                if before or after:
+                    change = _growth(before, after)
+                    rows.append((design, cell, before, after, change,
+                                 change > threshold))
+        for net in sorted(a["fmax_mhz"].keys() & b["fmax_mhz"].keys()):
+            before = a["fmax_mhz"][net]
+            after = b["fmax_mhz"][net]
+            change = _growth(before, after)
+            rows.append((design, f"fmax {clock_name(b, net)}", before,
+                         after, change, change < -threshold))
+    return rows
+
+
+def format_diff(rows, changed_only=True):
+    lines = []
+    for design, quantity, before, after, change, flagged in rows:
+        if changed_only and before == after:
+            continue
+        mark = "  <-- grew" if flagged else ""
+        if quantity.startswith("fmax"):
+            before, after = f"{before:.1f}", f"{after:.1f}"
+            mark = "  <-- slower" if flagged else ""
+        lines.append(f"  {design:<24} {quantity:<16} {before:>8} -> "
+                     f"{after:<8} {change:+7.1f}%{mark}")
+    return "\n".join(lines) or "  No changes"
+
+
+def format_log(records):
+    lines = []
+    for record in records:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(record["time"]))
+        used = record["resources"]
+        fmax = ", ".join(f"{clock_name(record, net)} {mhz:.1f} MHz"
+                         for net, mhz in record["fmax_mhz"].items())
+        commit, dirty, _ = record["revision"].partition("+dirty")
+        revision = commit[:12] + dirty
+        lines.append(f"  {when}  {revision:<18} "
+                     f"{used.get('lut', 0):>6} LUT {used.get('ff', 0):>6} FF "
+                     f"{used.get('bram', 0):>3} BRAM  {fmax}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--history", default=DEFAULT_HISTORY,
+                        help=f"history file (default: {DEFAULT_HISTORY})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    diff_parser = commands.add_parser(
+        "diff", help="compare each design's use at two revisions")
+    diff_parser.add_argument("old")
+    diff_parser.add_argument("new")
+    diff_parser.add_argument("--threshold", type=float, default=10.0,
+                             help="percentage growth to flag (default: 10)")
+    diff_parser.add_argument("--all", action="store_true",
+                             help="also show unchanged quantities")
+    log_parser = commands.add_parser("log", help="list a design's builds")
+    log_parser.add_argument("design", nargs="?")
+    args = parser.parse_args(argv)
+
+    records = read_history(args.history)
+    if args.command == "log":
+        for key in sorted({design_key(r["design"], r["params"])
+                           for r in records}):
+            if args.design in (None, key, key.split("[")[0]):
+                print(key)
+                print(format_log([
+                    r for r in records
+                    if design_key(r["design"], r["params"]) == key]))
+        return 0
+
+    old = latest(records, resolve(args.old))
+    new = latest(records, resolve(args.new))
+    for spec, found in ((args.old, old), (args.new, new)):
+        if not found:
+            parser.error(f"no builds of {spec} in {args.history}")
+    rows = diff(old, new, args.threshold)
+    print(format_diff(rows, changed_only=not args.all))
+    for design in sorted(old.keys() ^ new.keys()):
+        side = args.old if design in old else args.new
+        print(f"  {design} was only built at {side}")
+    flagged = [row for row in rows if row[-1]]
+    if flagged:
+        print(f"{len(flagged)} changes beyond {args.threshold}%")
+    return 1 if flagged else 0
+
+
+def test_area_history():
+    import tempfile
+
+    def metrics(lut, ff, mhz):
+        return {
+            "design": "counter",
+            # Two nets in one domain, and one we can't place in any.
+            "clocks": {"clk": {"domain": "sync", "achieved_mhz": mhz},
+                       "clk_buf": {"domain": "sync", "achieved_mhz": 150},
+                       "pll_out": {"domain": None, "achieved_mhz": 300}},
+            "resources": {"lut": lut, "ff": ff, "bram": 0},
+            "utilization": {"ICESTORM_LC": {"used": max(lut, ff),
+                                            "available": 5280}},
+        }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "history.jsonl")
+        append_record(path, history_record(metrics(100, 50, 80), {},
+                                           "aaaa1111"))
+        append_record(path, history_record(metrics(105, 50, 79), {},
+                                           "bbbb2222"))
+        append_record(path, history_record(metrics(20, 10, 200),
+                                           {"limit": 1000}, "bbbb2222"))
+        # A later build at the same revision replaces the earlier one.
+        append_record(path, history_record(metrics(130, 50, 60), {},
+                                           "bbbb2222+dirty"))
+        append_record(path, history_record(metrics(125, 50, 70), {},
+                                           "bbbb2222+dirty"))
+        records = read_history(path)
+
+    assert len(records) == 5
+    assert records[0]["fmax_mhz"] == \
+        {"clk": 80, "clk_buf": 150, "pll_out": 300}
+    assert records[0]["clock_domains"] == {"clk": "sync", "clk_buf": "sync"}
+    assert design_key("counter", {"limit": 1000}) == "counter[limit=1000]"
+    old = latest(records, "aaaa")
+    new = latest(records, "bbbb2222")
+    assert set(new) == {"counter", "counter[limit=1000]"}
+    # Clean and dirty builds are kept apart, even by prefix.
+    assert latest(records, "bbbb")["counter"]["resources"]["lut"] == 105
+    assert latest(records, "bbbb+dirty")["counter"]["resources"]["lut"] \
+        == 125
+    assert latest(records, "aaaa+dirty") == {}
+
+    # 5% more LUTs is under the threshold.
+    rows = {row[1]: row for row in diff(old, new, threshold=10)}
+    assert rows["lut"][2:4] == (100, 105) and not rows["lut"][5]
+    assert "bram" not in rows
+    assert not any(row[5] for row in rows.values())
+
+    # 25% more LUTs, and a drop in Fmax, are flagged.
+    dirty = latest(records, "bbbb2222+dirty")
+    assert dirty["counter"]["resources"]["lut"] == 125
+    rows = {row[1]: row for row in diff(old, dirty, threshold=10)}
+    assert rows["lut"][4] == 25 and rows["lut"][5]
+    assert rows["ICESTORM_LC"][5] and not rows["ff"][5]
+    assert rows["fmax clk (sync)"][4] == -12.5
+    assert rows["fmax clk (sync)"][5]
+    assert rows["fmax clk_buf (sync)"][4] == 0
+    assert rows["fmax pll_out"][2:4] == (300, 300)
+    assert "<-- grew" in format_diff(diff(old, dirty))
+    assert "clk (sync) 60.0 MHz, clk_buf (sync) 150.0 MHz, pll_out 300.0" \
+        in format_log([records[3]])
+
+    # Real revisions resolve to full hashes.
+    head = resolve("HEAD")
+    if head != "HEAD":
+        assert len(head) == 40
+        assert resolve("HEAD+dirty") == head + "+dirty"
+        assert git_revision().removesuffix("+dirty") == head
+
+
+def test_build_history_toolchain():
+    import shutil
+    from amaranth_examples.build_runner import EXAMPLES, run_builds
+
+    root = "build/history"
+    shutil.rmtree(root, ignore_errors=True)
+    job = next(job for job in EXAMPLES if job.name == "custom_board")
+    [result] = run_builds([job], root=root)
+    assert result.ok, open(result.log).read()
+    [record] = read_history(os.path.join(root, "history.jsonl"))
+    assert record["design"] == "custom_board"
+    assert record["revision"] == git_revision()
+    assert record["resources"] == result.metrics["resources"]
+    assert record["cells"]["ICESTORM_LC"] > 0
+    assert record["fmax_mhz"].keys() == result.metrics["clocks"].keys()
+    assert "sync" in record["clock_domains"].values()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
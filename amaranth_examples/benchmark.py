@@ -0,0 +1,284 @@
+"""
+Simulation throughput benchmarks, with a regression gate.
+
+Runs testbenches for the Counter, SPIPeriph and ALU examples for a given
+number of cycles at a given width, and records how many simulated cycles
+per second each achieves and the peak memory use of the process running it
+(where the `resource` module can report it, so not on Windows).
+The counter is run twice, once with plain clocked steps and once with a
+`yield Settle()` after each step, to show the overhead of settling.
+
+Each benchmark runs in a fresh process, so that peak memory is its own and
+earlier benchmarks can't warm anything up for later ones, and the best of
+several repeats is kept to reduce noise.
+
+Results are written as JSON. If a baseline from an earlier run exists, each
+benchmark is compared against it, and the run fails if any is more than
+`--max-slowdown` percent slower:
+
+    python -m amaranth_examples.benchmark --save-baseline
+    # ...change the design or upgrade Amaranth...
+    python -m amaranth_examples.benchmark --max-slowdown 10
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import amaranth
+from amaranth.sim import Simulator, Settle
+
+from amaranth_examples.comb_test import ALU
+from amaranth_examples.counter import Counter
+from amaranth_examples.spi_oversampled import SPIPeriph
+
+
+def bench_counter(cycles, width):
+    counter = Counter(limit=2**width - 3)
+
+    def testbench():
+        for _ in range(cycles):
+            yield
+
+    sim = Simulator(counter)
+    sim.add_clock(1/10e6)
+    sim.add_sync_process(testbench)
+    return sim
+
+
+def bench_counter_settle(cycles, width):
+    counter = Counter(limit=2**width - 3)
+
+    def testbench():
+        for _ in range(cycles):
+            yield
+            yield Settle()
+
+    sim = Simulator(counter)
+    sim.add_clock(1/10e6)
+    sim.add_sync_process(testbench)
+    return sim
+
+
+def bench_spi(cycles, width):
+    # SCK runs continuously at 1/4 of the sync frequency with CS asserted.
+    spi = SPIPeriph(width)
+
+    def testbench():
+        yield spi.csn.eq(0)
+        for cycle in range(cycles // 4):
+            yield spi.sdi.eq(cycle & 1)
+            yield spi.sck.eq(1)
+            yield
+            yield
+            yield spi.sck.eq(0)
+            yield
+            yield
+
+    sim = Simulator(spi)
+    sim.add_clock(1/10e6)
+    sim.add_sync_process(testbench)
+    return sim
+
+
+def bench_alu(cycles, width):
+    # The ALU is purely combinatorial, so each "cycle" is one evaluation:
+    # new operands followed by a Settle.
+    alu = ALU(width)
+    mask = 2**width - 1
+
+    def testbench():
+        for i in range(cycles):
+            yield alu.a.eq((i * 0x9E3779B1) & mask)
+            yield alu.b.eq((i * 0x85EBCA77) & mask)
+            yield alu.op.eq(i & 1)
+            yield Settle()
+
+    sim = Simulator(alu)
+    sim.add_process(testbench)
+    return sim
+
+
+BENCHMARKS = {
+    "counter": bench_counter,
+    "counter_settle": bench_counter_settle,
+    "spi": bench_spi,
+    "alu": bench_alu,
+}
+
+
+def peak_rss_kib():
+    """
+    The peak resident memory of this process in KiB, or None where the
+    `resource` module isn't available, as on Windows.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in KiB on Linux (but bytes on macOS).
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024
+    return peak
+
+
+def run_benchmark(name, cycles, width, repeats=3):
+    """
+    Run one benchmark `repeats` times in this process, returning a dict of
+    its results from the fastest run.
+    """
+    best = None
+    for _ in range(repeats):
+        sim = BENCHMARKS[name](cycles, width)
+        start = time.perf_counter()
+        sim.run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        "cycles": cycles,
+        "width": width,
+        "seconds": best,
+        "cycles_per_second": cycles / best,
+        "peak_rss_kib": peak_rss_kib(),
+    }
+
+
+def run_suite(names, cycles, width, repeats=3):
+    """Run each named benchmark in its own fresh process."""
+    results = {}
+    for name in names:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results[name] = pool.submit(run_benchmark, name, cycles, width,
+                                        repeats).result()
+    report = {
+        "python": platform.python_version(),
+        "amaranth": amaranth.__version__,
+        "benchmarks": results,
+    }
+    if "counter" in results and "counter_settle" in results:
+        report["settle_overhead"] = (
+            results["counter_settle"]["seconds"] /
+            results["counter"]["seconds"])
+    return report
+
+
+def compare(report, baseline, max_slowdown):
+    """
+    Compare a report against a baseline report. Returns a list of
+    (name, baseline cycles/s, current cycles/s, slowdown percentage, ok)
+    for each benchmark in both.
+    """
+    rows = []
+    for name, result in report["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        before = baseline["benchmarks"][name]["cycles_per_second"]
+        after = result["cycles_per_second"]
+        slowdown = (before - after) / before * 100
+        rows.append((name, before, after, slowdown, slowdown <= max_slowdown))
+    return rows
+
+
+def format_report(report, rows=()):
+    lines = []
+    for name, result in report["benchmarks"].items():
+        peak = result["peak_rss_kib"]
+        memory = "    n/a" if peak is None else f"{peak / 1024:7.1f}"
+        lines.append(f"  {name:<15} {result['cycles_per_second']:10.0f} "
+                     f"cycles/s  {memory} MiB")
+    if "settle_overhead" in report:
+        lines.append(f"Settle() after every step makes the counter "
+                     f"{report['settle_overhead']:.2f}x slower")
+    for name, before, after, slowdown, ok in rows:
+        status = "ok" if ok else "REGRESSION"
+        lines.append(f"  {name:<15} {before:10.0f} -> {after:10.0f} "
+                     f"cycles/s ({slowdown:+.1f}% slower) {status}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("benchmarks", nargs="*", metavar="BENCHMARK",
+                        help=f"any of: {', '.join(BENCHMARKS)} "
+                             f"(default: all)")
+    parser.add_argument("--cycles", type=int, default=20000,
+                        help="cycles to simulate per benchmark")
+    parser.add_argument("--width", type=int, default=8,
+                        help="counter, SPI and ALU width in bits")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="keep the best of this many runs")
+    parser.add_argument("-o", "--output", default="build/benchmark.json",
+                        help="where to write results")
+    parser.add_argument("--baseline", default="build/benchmark-baseline.json",
+                        help="baseline results to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store these results as the new baseline")
+    parser.add_argument("--max-slowdown", type=float, default=10.0,
+                        help="fail if any benchmark is this percent slower")
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name!r}")
+
+    report = run_suite(args.benchmarks or list(BENCHMARKS), args.cycles,
+                       args.width, args.repeats)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    rows = []
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            rows = compare(report, json.load(f), args.max_slowdown)
+
+    print(format_report(report, rows))
+    return 0 if all(ok for *_, ok in rows) else 1
+
+
+def test_benchmarks():
+    # Just check every benchmark runs; real measurements need many more
+    # cycles than this.
+    for name in BENCHMARKS:
+        result = run_benchmark(name, cycles=200, width=8, repeats=1)
+        assert result["cycles_per_second"] > 0
+
+
+def test_peak_memory_without_resource():
+    # Windows has no resource module, so the peak is left out.
+    saved = sys.modules.get("resource")
+    sys.modules["resource"] = None
+    try:
+        assert peak_rss_kib() is None
+    finally:
+        if saved is None:
+            del sys.modules["resource"]
+        else:
+            sys.modules["resource"] = saved
+    assert peak_rss_kib() > 0
+    result = {"cycles_per_second": 1000, "peak_rss_kib": None}
+    assert "n/a MiB" in format_report({"benchmarks": {"counter": result}})
+
+
+def test_benchmark_gate():
+    def report(**cycles_per_second):
+        return {"benchmarks": {name: {"cycles_per_second": cps}
+                               for name, cps in cycles_per_second.items()}}
+
+    baseline = report(counter=1000, spi=1000)
+    current = report(counter=950, spi=800, alu=500)
+    rows = {name: (slowdown, ok)
+            for name, _, _, slowdown, ok in compare(current, baseline, 10)}
+    assert rows == {"counter": (5.0, True), "spi": (20.0, False)}
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+A content-addressed cache for toolchain builds.
+
+Most builds in CI re-synthesise designs that haven't changed at all. Before
+running the toolchain we hash everything that can affect its output: every
+file in the BuildPlan (the generated RTLIL/Verilog, constraint files, build
+scripts and any `platform.add_file()` payloads) plus the version of each
+tool the platform runs. If a previous build with the same hash is in the
+cache, its bitstream and reports are copied into the build directory and
+the toolchain isn't run at all.
+
+The hash includes the `src` attributes in the RTLIL, which only record the
+line of Python each cell came from. Moving a line means a rebuild, but the
+restored reports and netlists never point at lines which have since moved.
+
+The cache lives in `~/.cache/amaranth-examples` (or wherever
+`$AMARANTH_EXAMPLES_CACHE` points) and is trimmed back to `max_size` bytes
+after each store, evicting the least recently used builds first.
+
+Use it via the build runner:
+
+    python -m amaranth_examples.build_runner --cache
+"""
+
+import functools
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from amaranth._toolchain import tool_env_var
+
+
+def default_cache_dir():
+    if "AMARANTH_EXAMPLES_CACHE" in os.environ:
+        return os.environ["AMARANTH_EXAMPLES_CACHE"]
+    cache_home = os.environ.get("XDG_CACHE_HOME",
+                                os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "amaranth-examples")
+
+
+@functools.lru_cache(maxsize=None)
+def tool_version(tool):
+    """
+    Return a string identifying the version of `tool`, which is looked up
+    the same way as in the generated build scripts: from its environment
+    variable (such as `$NEXTPNR_ICE40`), falling back to the tool name.
+    """
+    command = os.environ.get(tool_env_var(tool), tool)
+    try:
+        output = subprocess.run([command, "--version"], capture_output=True,
+                                text=True, timeout=60).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        output = ""
+    for line in output.splitlines():
+        if "version" in line.lower() or re.search(r"\d+\.\d+", line):
+            return line.strip()
+    # Some tools (such as icepack) have no version flag, so fall back to
+    # identifying the executable itself.
+    path = shutil.which(command)
+    if path is None:
+        return f"{command} (not found)"
+    stat = os.stat(path)
+    return f"{path} {stat.st_size} {stat.st_mtime_ns}"
+
+
+class BuildCache:
+    """
+    An on-disk store of build products, keyed by a hash of the build inputs.
+
+    Each entry is a directory named by its key, containing the files the
+    toolchain produced and a `meta.json` recording how long the original
+    build took. Entries' modification times are refreshed on every hit so
+    that eviction can drop the least recently used first.
+    """
+    def __init__(self, root=None, max_size=1 << 30):
+        self.root = root or default_cache_dir()
+        self.max_size = max_size
+
+    def key(self, plan, platform):
+        hasher = hashlib.blake2b(digest_size=20)
+        for filename in sorted(plan.files):
+            content = plan.files[filename]
+            if isinstance(content, str):
+                content = content.encode("utf-8")
+            hasher.update(filename.encode("utf-8") + b"\0")
+            hasher.update(hashlib.blake2b(content).digest())
+        for tool in platform.required_tools:
+            hasher.update(f"{tool}={tool_version(tool)}\0".encode("utf-8"))
+        return hasher.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.root, key)
+
+    def restore(self, key, build_dir):
+        """
+        Copy the products for `key` into `build_dir`. Returns the original
+        build time in seconds on a hit, or None on a miss.
+        """
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        for filename in meta["files"]:
+            dest = os.path.join(build_dir, filename)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(os.path.join(entry, "files", filename), dest)
+        os.utime(entry)
+        return meta["elapsed"]
+
+    def store(self, key, build_dir, plan, elapsed):
+        """
+        Store every file in `build_dir` that the toolchain created (that is,
+        everything that wasn't one of the plan's own input files, other than
+        the runner's own `build.log`).
+        """
+        products = []
+        for dirpath, _, filenames in os.walk(build_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                relpath = os.path.relpath(path, build_dir)
+                relpath = relpath.replace(os.sep, "/")
+                if relpath not in plan.files and relpath != "build.log":
+                    products.append(relpath)
+
+        # Build the entry in a temporary directory and rename it into place,
+        # so that concurrent builds never see a half-written entry.
+        os.makedirs(self.root, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self.root, prefix=".tmp-")
+        size = 0
+        for relpath in products:
+            dest = os.path.join(staging, "files", relpath)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(os.path.join(build_dir, relpath), dest)
+            size += os.path.getsize(dest)
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump({"files": products, "elapsed": elapsed, "size": size,
+                       "created": time.time()}, f)
+        try:
+            os.rename(staging, self._entry(key))
+        except OSError:
+            # Another build stored the same key first.
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """Return (mtime, size, path) for every complete entry."""
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                with open(os.path.join(path, "meta.json")) as f:
+                    size = json.load(f)["size"]
+                entries.append((os.path.getmtime(path), size, path))
+            except (OSError, ValueError, KeyError):
+                continue
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until under `max_size`."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        while entries and total > self.max_size:
+            _, size, path = entries.pop(0)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def format_stats(results):
+    """Summarise cache hits and misses for a list of BuildResults."""
+    hits = [r for r in results if r.cached]
+    misses = [r for r in results if r.cached is False]
+    saved = sum(r.saved for r in hits)
+    return (f"cache: {len(hits)} hits, {len(misses)} misses, "
+            f"saved {saved:.2f}s of toolchain time")
+
+
+def test_cache_key():
+    from types import SimpleNamespace
+
+    def key(rtlil):
+        plan = SimpleNamespace(files={"top.il": rtlil, "top.pcf": b""})
+        return BuildCache().key(plan, SimpleNamespace(required_tools=[]))
+
+    rtlil = "module \\top\n  attribute \\src \"top.py:%d\"\n  wire \\a\nend\n"
+    assert key(rtlil % 10) == key(rtlil % 10)
+    # A cell's source moving changes the key, so the reports restored from
+    # the cache always point at the current source.
+    assert key(rtlil % 10) != key(rtlil % 11)
+
+
+def test_build_cache_toolchain():
+    from .build_runner import EXAMPLES, run_builds
+
+    # Each build runs in a fresh worker process, as in the build runner:
+    # the iCE40 platform consumes the GLOBAL attribute of the class-level
+    # clock resource, so a second build in the same process would really
+    # be a different design.
+    job = next(job for job in EXAMPLES if job.name == "custom_board")
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = BuildCache(os.path.join(tmp, "cache"))
+        first, = run_builds([job], os.path.join(tmp, "a"), cache=cache)
+        second, = run_builds([job], os.path.join(tmp, "b"), cache=cache)
+        assert first.ok and second.ok
+        assert first.cached is False and second.cached is True
+        assert second.saved > 0
+
+        # The restored bitstream must be exactly the one that was built.
+        bitstreams = []
+        for result in (first, second):
+            with open(os.path.join(result.build_dir, "top.bin"), "rb") as f:
+                bitstreams.append(f.read())
+        assert bitstreams[0] == bitstreams[1]
+        print(format_stats([first, second]))
+
+        # Shrinking the cache below the size of one entry evicts it.
+        BuildCache(cache.root, max_size=0).evict()
+        assert cache.entries() == []
@@ -0,0 +1,341 @@
+"""
+Profile each stage of a toolchain run, streaming its output as it goes.
+
+When a build takes minutes, the single wall-clock time from build_runner.py
+doesn't say whether synthesis, placement, routing or bitstream packing is
+to blame. Here the build script is split into its Yosys, nextpnr and
+packer stages (as in multi_seed.py) and each runs on its own, recording:
+
+* its wall-clock time, and the user and system CPU time it used,
+* its peak resident memory, from `os.wait4()`, which covers the tool
+  itself as well as the shell running it,
+* its exit status,
+* phases within it, found from the tool's output as it arrives: each
+  top-level Yosys pass and the passes directly inside it, and nextpnr's
+  packing, placement and routing.
+
+Each line of output is written to the build log as soon as the tool prints
+it, and can also be echoed to the console. The quiet flags Amaranth passes
+to Yosys and nextpnr are dropped so there's something to stream (and to
+find phases in); their own log files are written just the same.
+
+The stages are saved as a Chrome trace, which chrome://tracing or
+https://ui.perfetto.dev can show as a timeline, with one row per design.
+build_runner.py profiles builds when given `--profile`, writing
+`build/<name>/trace.json` for each design and `build/trace.json` for the
+whole run, and also echoes every tool's output with `--stream`:
+
+    python -m amaranth_examples.build_runner --profile --stream \\
+        custom_board ddr instance pll_ice40 pll_ecp5
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+from amaranth_examples.multi_seed import split_script
+
+
+# Flags which stop each tool printing its log to the console.
+QUIET_FLAGS = r" (-q|--quiet)(?= )"
+
+# nextpnr's phases, in order, with the first line of output that each one
+# prints. Packing can place a few cells (such as PLLs) too, so placement
+# starts when the constrained cells are placed.
+NEXTPNR_PHASES = [
+    ("packing", r"^Info: Packing"),
+    ("placement", r"^Info: Placed \d+ cells based on constraints"),
+    ("routing", r"^Info: Routing"),
+]
+
+
+def yosys_phase(line, current):
+    """
+    If `line` starts a Yosys pass at the top level or directly inside one,
+    return (depth, name) of the pass, such as (2, "techmap").
+    """
+    match = re.match(r"^(\d+)(\.\d+)?\. Executing (\S+)", line)
+    if match is None:
+        return None
+    depth = 2 if match.group(2) else 1
+    return depth, match.group(3).lower()
+
+
+def nextpnr_phase(line, current):
+    """
+    If `line` starts a nextpnr phase later than the `current` one (the
+    name of the innermost open phase, or None), return (1, its name).
+    """
+    names = [name for name, _ in NEXTPNR_PHASES]
+    for name, pattern in NEXTPNR_PHASES:
+        if re.match(pattern, line) and (
+                current is None or names.index(name) > names.index(current)):
+            return 1, name
+    return None
+
+
+PHASE_PARSERS = {
+    "synth": yosys_phase,
+    "pnr": nextpnr_phase,
+}
+
+
+class Stage:
+    """
+    One stage of a build: its `name` ("synth", "pnr" or "pack"), when it
+    started (`start`, seconds since the epoch, so stages run in different
+    processes line up), and once it has run, its wall-clock `elapsed` time,
+    `user` and `system` CPU time in seconds, `peak_rss` in bytes, exit
+    `status` (negative if killed by a signal), and a list of `phases` as
+    (depth, name, start, end) in seconds from the start of the stage.
+    """
+    def __init__(self, name, command):
+        self.name = name
+        self.command = command
+        self.start = None
+        self.elapsed = None
+        self.user = None
+        self.system = None
+        self.peak_rss = None
+        self.status = None
+        self.phases = []
+
+    @property
+    def ok(self):
+        return self.status == 0
+
+    def summary(self):
+        return {
+            "stage": self.name,
+            "status": self.status,
+            "elapsed": self.elapsed,
+            "user": self.user,
+            "system": self.system,
+            "peak_rss_mib": self.peak_rss / 2**20,
+            "phases": {name: end - start
+                       for depth, name, start, end in self.phases
+                       if depth == 1},
+        }
+
+
+def _max_rss(rusage):
+    # Linux reports ru_maxrss in KiB, macOS in bytes.
+    return rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def profile_stage(directory, prelude, stage, script, log, echo=None):
+    """
+    Run `stage` in `directory` from a script file called `script`, writing
+    its output to `log` line by line and calling `echo(stage.name, line)`
+    for each line if given, then fill in the stage's timings, memory and
+    exit status.
+    """
+    command = re.sub(QUIET_FLAGS, "", stage.command)
+    with open(os.path.join(directory, script), "w") as f:
+        f.write(f"{prelude}\n{command}\n")
+    parse = PHASE_PARSERS.get(stage.name)
+    open_phases = []
+    stage.start = time.time()
+    start = time.perf_counter()
+    proc = subprocess.Popen(["sh", script], cwd=directory, text=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    for line in proc.stdout:
+        log.write(line)
+        log.flush()
+        if echo is not None:
+            echo(stage.name, line)
+        if parse is None:
+            continue
+        now = time.perf_counter() - start
+        phase = parse(line, open_phases[-1][1] if open_phases else None)
+        if phase is None:
+            continue
+        depth, name = phase
+        while open_phases and open_phases[-1][0] >= depth:
+            stage.phases.append((*open_phases.pop(), now))
+        open_phases.append((depth, name, now))
+    proc.stdout.close()
+    # Reap the process ourselves to get its resource usage.
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    stage.elapsed = time.perf_counter() - start
+    while open_phases:
+        stage.phases.append((*open_phases.pop(), stage.elapsed))
+    stage.phases.sort(key=lambda phase: (phase[2], phase[0]))
+    stage.user = rusage.ru_utime
+    stage.system = rusage.ru_stime
+    stage.peak_rss = _max_rss(rusage)
+    stage.status = proc.returncode
+    log.write(f"Stage {stage.name} exited with status {stage.status} after "
+              f"{stage.elapsed:.2f}s, peak RSS "
+              f"{stage.peak_rss / 2**20:.1f} MiB\n")
+    log.flush()
+
+
+def profile_build(build_dir, plan, log, echo=None):
+    """
+    Build `plan`, already written to `build_dir`, one stage at a time,
+    returning the list of Stages which ran. A failed stage is the last in
+    the list; check them with `check_stages()`.
+    """
+    with open(os.path.join(build_dir, f"{plan.script}.sh")) as f:
+        prelude, commands = split_script(f.read())
+    stages = []
+    for name in ("synth", "pnr", "pack"):
+        stage = Stage(name, commands[name])
+        stages.append(stage)
+        profile_stage(build_dir, prelude, stage, f"{plan.script}_{name}.sh",
+                      log, echo)
+        if not stage.ok:
+            break
+    return stages
+
+
+def check_stages(stages):
+    """Raise CalledProcessError if any of `stages` failed."""
+    for stage in stages:
+        if not stage.ok:
+            raise subprocess.CalledProcessError(stage.status, stage.command)
+
+
+def chrome_trace(designs):
+    """
+    A Chrome trace of `designs`, a list of (design name, list of Stages),
+    with each design as a process and its stages and their phases as
+    nested complete ("X") events, in microseconds from the earliest stage.
+    """
+    origin = min((stage.start for _, stages in designs for stage in stages),
+                 default=0)
+    events = []
+    for pid, (design, stages) in enumerate(designs):
+        events.append({"name": "process_name", "ph": "M", "pid": pid,
+                       "tid": 0, "args": {"name": design}})
+        for stage in stages:
+            ts = (stage.start - origin) * 1e6
+            events.append({
+                "name": stage.name, "cat": "stage", "ph": "X",
+                "ts": round(ts, 3), "dur": round(stage.elapsed * 1e6, 3),
+                "pid": pid, "tid": 0,
+                "args": {"status": stage.status,
+                         "peak_rss_mib": round(stage.peak_rss / 2**20, 1),
+                         "user_s": round(stage.user, 3),
+                         "system_s": round(stage.system, 3)},
+            })
+            for depth, name, start, end in stage.phases:
+                events.append({
+                    "name": name, "cat": "phase", "ph": "X",
+                    "ts": round(ts + start * 1e6, 3),
+                    "dur": round((end - start) * 1e6, 3),
+                    "pid": pid, "tid": 0,
+                })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_trace(path, designs):
+    """Write the Chrome trace of `designs` to `path`."""
+    with open(path, "w") as f:
+        json.dump(chrome_trace(designs), f)
+
+
+def format_stages(stages):
+    """A one-line summary of `stages`' times and peak memory."""
+    parts = []
+    for stage in stages:
+        status = "" if stage.ok else f" (exit {stage.status})"
+        parts.append(f"{stage.name} {stage.elapsed:.2f}s "
+                     f"{stage.peak_rss / 2**20:.0f}MiB{status}")
+    return ", ".join(parts)
+
+
+def test_phases():
+    import tempfile
+    import pytest
+
+    class FakeLog:
+        def __init__(self):
+            self.lines = []
+
+        def write(self, text):
+            self.lines.append(text)
+
+        def flush(self):
+            pass
+
+    # A stand-in for Yosys which prints some nested passes.
+    output = ["1. Executing RTLIL frontend.", "2. Executing SYNTH pass.",
+              "2.1. Executing HIERARCHY pass.", "2.1.1. Executing X pass.",
+              "2.2. Executing ABC pass.", "3. Executing JSON backend."]
+    command = "; ".join(f"echo '{line}'; sleep 0.01" for line in output)
+    with tempfile.TemporaryDirectory() as tmp:
+        log = FakeLog()
+        echoed = []
+        stage = Stage("synth", command + " -q ; exit 3")
+        profile_stage(tmp, "set -e", stage, "synth.sh", log,
+                      lambda name, line: echoed.append(line))
+        with open(os.path.join(tmp, "synth.sh")) as f:
+            assert " -q" not in f.read()
+    assert echoed == [line + "\n" for line in output]
+    assert log.lines[:len(output)] == echoed
+    assert stage.status == 3 and not stage.ok
+    assert stage.peak_rss > 0 and stage.elapsed > 0.06
+    names = [(depth, name) for depth, name, _, _ in stage.phases]
+    assert names == [(1, "rtlil"), (1, "synth"), (2, "hierarchy"),
+                     (2, "abc"), (1, "json")]
+    for depth, name, start, end in stage.phases:
+        assert 0 <= start < end <= stage.elapsed
+    [synth] = [p for p in stage.phases if p[1] == "synth"]
+    [abc] = [p for p in stage.phases if p[1] == "abc"]
+    assert synth[2] < abc[2] < abc[3] == synth[3]
+
+    # nextpnr only ever moves on to a later phase.
+    current = None
+    seen = []
+    for line in ["Info: Packing IOs..", "Info: Placing PLLs..",
+                 "Info: Packing PLLs..", "Info: Placed 5 cells based on "
+                 "constraints.", "Info: Packing again", "Info: Routing..",
+                 "Info: Routing complete."]:
+        phase = nextpnr_phase(line, current)
+        if phase is not None:
+            current = phase[1]
+            seen.append(current)
+    assert seen == ["packing", "placement", "routing"]
+
+    trace = chrome_trace([("design", [stage])])
+    events = trace["traceEvents"]
+    assert events[0]["args"] == {"name": "design"}
+    assert [e["name"] for e in events[1:]] == [
+        "synth", "rtlil", "synth", "hierarchy", "abc", "json"]
+    assert events[1]["ts"] == 0 and events[1]["args"]["status"] == 3
+    with pytest.raises(subprocess.CalledProcessError):
+        check_stages([stage])
+
+
+def test_build_profile_toolchain():
+    from amaranth_examples.build_runner import EXAMPLES, run_builds
+
+    job = next(job for job in EXAMPLES if job.name == "custom_board")
+    [result] = run_builds([job], root="build/profile", profile=True)
+    assert result.ok, open(result.log).read()
+    print(format_stages(result.stages))
+    assert [stage.name for stage in result.stages] == \
+        ["synth", "pnr", "pack"]
+    for stage in result.stages:
+        assert stage.ok and stage.elapsed > 0 and stage.peak_rss > 2**20
+    synth, pnr, _ = result.stages
+    assert "synth_ice40" in [name for _, name, _, _ in synth.phases]
+    assert [name for _, name, _, _ in pnr.phases] == \
+        ["packing", "placement", "routing"]
+    assert result.metrics["stages"][1]["phases"].keys() == \
+        {"packing", "placement", "routing"}
+    with open(os.path.join(result.build_dir, "trace.json")) as f:
+        trace = json.load(f)
+    names = {event["name"] for event in trace["traceEvents"]}
+    assert {"synth", "pnr", "pack", "routing", "synth_ice40"} <= names
+    # The quiet flags were only dropped from our copies of the script.
+    with open(os.path.join(result.build_dir, "build_top_pnr.sh")) as f:
+        assert "--quiet" not in f.read()
+    with open(os.path.join(result.build_dir, "build_top.sh")) as f:
+        assert "--quiet" in f.read()
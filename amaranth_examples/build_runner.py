@@ -0,0 +1,478 @@
+"""
+Build several example designs at once, each in its own build directory.
+
+Each example's Top/Platform pair is sent to a process pool. Every job gets
+its own build directory (`build/<name>/`) so the toolchains can't clobber
+each other's files, and everything the toolchain prints is captured into
+`build/<name>/build.log` instead of being interleaved on the console.
+At the end we print how long each job took, so with enough cores all the
+examples finish in roughly the time of the slowest one.
+
+Run it from the command line, optionally naming the examples to build:
+
+    python -m amaranth_examples.build_runner -j 4 custom_board ddr
+
+Pass `--cache` to skip the toolchain for designs that haven't changed since
+a previous build; see build_cache.py.
+
+After each build, nextpnr's timing and utilization reports are collected
+into `build/<name>/metrics.json` (see reports.py), and a build whose
+achieved Fmax is below its clock constraint counts as failed. The metrics
+are also appended to `build/history.jsonl` with the git revision, so
+resource use can be compared between revisions (see area_history.py).
+
+Pass `--elaborate` to only elaborate each design against its platform and
+write out its RTLIL (and Verilog, with `--verilog`) without running the
+toolchain, which checks every example in a few seconds. The tests do the
+same, while the full builds only run with `pytest --toolchain`.
+
+Pass `--profile` to run each toolchain stage separately, recording its
+time, peak memory and exit status into a Chrome trace (see
+build_profile.py), and `--stream` to also see each tool's output live.
+Elaboration and RTLIL generation are profiled too, into
+`build/<name>/elaboration.json` (see elab_profile.py).
+
+Pass `--warm` to run the YoWASP tools from a server which keeps them
+loaded for the whole run, rather than starting each one cold (see
+warm_toolchain.py).
+"""
+
+import argparse
+import contextlib
+import copy
+import json
+import os
+import subprocess
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from .area_history import append_record, history_record
+from .build_cache import BuildCache, format_stats
+from .build_profile import (profile_build, check_stages, write_trace,
+                            format_stages)
+from .multi_seed import run_seeds, seed_summary
+from .registry import load, platform
+from .reports import (report_overrides, collect_metrics, timing_failures,
+                      format_metrics)
+from .warm_toolchain import running_server, tool_environ
+
+
+class BuildJob:
+    """
+    One example design to build.
+
+    `top` is a "module:attribute" string and `platform` a name from
+    registry.PLATFORMS (or another "module:attribute" string) rather than
+    the classes themselves, so jobs are cheap to send to worker processes
+    and the example module and board are only imported inside the worker
+    that builds them.
+    `top_kwargs` are passed to the top-level class when creating it, for
+    parametric designs, and any `kwargs` are passed through to
+    `platform.build()`.
+    """
+    def __init__(self, name, top, platform, top_kwargs=None, **kwargs):
+        self.name = name
+        self.top = top
+        self.platform = platform
+        self.top_kwargs = top_kwargs or {}
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return f"BuildJob({self.name!r})"
+
+
+class BuildResult:
+    """
+    The outcome of running one BuildJob.
+
+    `cached` is None when no cache was used, otherwise whether the products
+    were restored from the cache, in which case `saved` is how long the
+    original toolchain run took. `metrics` is the record from
+    reports.collect_metrics, or None if the build produced no reports.
+    `stages` is the list of build_profile.Stages of a profiled build.
+    """
+    def __init__(self, name, build_dir, log, ok, elapsed,
+                 cached=None, saved=0.0, metrics=None, stages=None):
+        self.name = name
+        self.build_dir = build_dir
+        self.log = log
+        self.ok = ok
+        self.elapsed = elapsed
+        self.cached = cached
+        self.saved = saved
+        self.metrics = metrics
+        self.stages = stages
+
+
+EXAMPLES = [
+    BuildJob("custom_board", "amaranth_examples.custom_board:Top",
+             "custom_ice40"),
+    BuildJob("ddr", "amaranth_examples.ddr:Top", "custom_ecp5"),
+    BuildJob("gearbox", "amaranth_examples.gearbox:Top", "gearbox_ecp5"),
+    BuildJob("instance", "amaranth_examples.instance:Top", "icebreaker"),
+    BuildJob("connectors", "amaranth_examples.connectors:Top", "icebreaker"),
+    BuildJob("pll_ice40", "amaranth_examples.pll_ice40:Top", "icebreaker"),
+    BuildJob("pll_ecp5", "amaranth_examples.pll_ecp5:Top", "ulx3s_12f",
+             program=False),
+    BuildJob("spi_regfile", "amaranth_examples.spi_regfile:Top",
+             "icebreaker"),
+]
+
+
+def check_options(cache=None, seeds=None, until_pass=False,
+                  elaborate_only=False, profile=False, stream=False):
+    """
+    Raise ValueError if run_build() can't honour these options together.
+
+    A multi-seed build runs place and route itself for each seed, so it
+    can't be cached, profiled or streamed, and an elaboration-only build
+    runs no toolchain to cache, seed or stream (though its elaboration can
+    still be profiled).
+    """
+    if until_pass and seeds is None:
+        raise ValueError("until_pass needs seeds")
+    if seeds is not None and (cache is not None or profile or stream):
+        raise ValueError("multi-seed builds can't be cached, profiled or "
+                         "streamed")
+    if elaborate_only and (cache is not None or seeds is not None or stream):
+        raise ValueError("elaboration-only builds can't be cached, seeded "
+                         "or streamed")
+
+
+def run_build(job, root="build", cache=None, seeds=None, until_pass=False,
+              elaborate_only=False, profile=False, stream=False):
+    """
+    Build a single job in `root/<job.name>`, returning a BuildResult.
+
+    Rather than calling `platform.build()` directly (which would run the
+    toolchain with our stdout), we ask it for the BuildPlan, write the plan's
+    files out, and run the build script ourselves with its output going to
+    a log file. Any exception, including errors during elaboration, is also
+    written to the log so that a failed job never takes the runner down.
+
+    The metrics of every build which produces them are appended, with the
+    job's parameters and the git revision, to `root/history.jsonl`.
+
+    If `cache` is a BuildCache, the toolchain is skipped whenever it already
+    holds the products of an identical build.
+
+    If `seeds` is given, place and route runs once for each seed and the
+    best result is kept (see multi_seed.py), with the sweep recorded under
+    "seeds" in the metrics. With `until_pass`, it stops at the first seed
+    which meets timing.
+
+    If `elaborate_only` is set, the design is only elaborated and the
+    plan's files (RTLIL, plus Verilog if the job asks for `debug_verilog`)
+    are written out, without running the toolchain at all. This catches
+    errors such as bad resource requests or undriven clock domains in
+    seconds rather than after a full place and route.
+
+    If `profile` is set, each toolchain stage runs on its own with its
+    time, peak memory and exit status recorded (see build_profile.py),
+    under "stages" in the metrics and as a Chrome trace in
+    `root/<job.name>/trace.json`. With `stream`, which implies `profile`,
+    every line the tools print is also echoed to stdout as it arrives,
+    prefixed with the job and stage names. Elaboration is profiled as well,
+    into `root/<job.name>/elaboration.json` (see elab_profile.py).
+
+    Combinations of these which can't work together, as listed in
+    check_options(), raise ValueError.
+    """
+    check_options(cache, seeds, until_pass, elaborate_only, profile, stream)
+    build_dir = os.path.join(root, job.name)
+    os.makedirs(build_dir, exist_ok=True)
+    log_path = os.path.join(build_dir, "build.log")
+    start = time.perf_counter()
+    cached = None
+    saved = 0.0
+    metrics = None
+    stages = None
+    with open(log_path, "w") as log:
+        try:
+            plat, plan = _plan(job, build_dir, profile or stream)
+            if elaborate_only:
+                log.write(f"Elaborated only, wrote {', '.join(plan.files)}\n")
+                ok = True
+            else:
+                if seeds is not None:
+                    sweep = _execute_seeds(job, build_dir, plan, log, seeds,
+                                           until_pass)
+                else:
+                    sweep = None
+                    cached, saved, stages = _execute(
+                        job, build_dir, plat, plan, log, cache,
+                        profile or stream, stream)
+                metrics, ok = _record(job, root, build_dir, log, sweep,
+                                      stages)
+        except Exception:
+            log.write(traceback.format_exc())
+            ok = False
+    elapsed = time.perf_counter() - start
+    return BuildResult(job.name, build_dir, log_path, ok, elapsed,
+                       cached, saved, metrics, stages)
+
+
+def _plan(job, build_dir, profile):
+    """
+    Elaborate `job` and write its plan's files into `build_dir`, returning
+    the platform and the BuildPlan. With `profile`, elaboration is profiled
+    into `build_dir/elaboration.json`.
+    """
+    plat = platform(job.platform)()
+    # Building for the iCE40 deletes the GLOBAL attribute from the Resource
+    # objects shared by every instance of the platform class, so a second
+    # build of the same platform in a worker would lose its global clock
+    # buffer. Build from private copies.
+    plat.resources = copy.deepcopy(plat.resources)
+    top = load(job.top)(**job.top_kwargs)
+    with contextlib.ExitStack() as stack:
+        if profile:
+            # Only imported here, as it patches Amaranth internals.
+            from .elab_profile import profiling, write_report
+            elaboration = stack.enter_context(profiling())
+        plan = plat.build(top, build_dir=build_dir, do_build=False,
+                          **report_overrides(job.kwargs))
+    if profile:
+        write_report(os.path.join(build_dir, "elaboration.json"),
+                     elaboration)
+    plan.execute_local(build_dir, run_script=False)
+    return plat, plan
+
+
+def _execute(job, build_dir, plat, plan, log, cache, profile, stream):
+    """
+    Run the toolchain for `plan` once, unless `cache` holds its products,
+    returning (cached, seconds saved, profiled stages). With `profile`, the
+    stages run one at a time, echoing their output if `stream` is set.
+    """
+    if cache is not None:
+        key = cache.key(plan, plat)
+        saved = cache.restore(key, build_dir)
+        if saved is not None:
+            log.write(f"Restored from cache entry {key}\n")
+            return True, saved, None
+    tool_start = time.perf_counter()
+    stages = None
+    if profile:
+        stages = profile_build(build_dir, plan, log,
+                               echo=_echo(job.name) if stream else None)
+        write_trace(os.path.join(build_dir, "trace.json"),
+                    [(job.name, stages)])
+        check_stages(stages)
+    else:
+        subprocess.run(["sh", f"{plan.script}.sh"], cwd=build_dir,
+                       stdout=log, stderr=subprocess.STDOUT, check=True)
+    if cache is None:
+        return None, 0.0, stages
+    cache.store(key, build_dir, plan, time.perf_counter() - tool_start)
+    return False, 0.0, stages
+
+
+def _execute_seeds(job, build_dir, plan, log, seeds, until_pass):
+    """
+    Place and route `plan` with each of `seeds`, keeping the best, and
+    return the summary of the sweep.
+    """
+    best, runs = run_seeds(build_dir, plan, seeds, log=log,
+                           until_pass=until_pass, design=job.name)
+    return seed_summary(best, runs)
+
+
+def _record(job, root, build_dir, log, sweep, stages):
+    """
+    Collect the metrics of a finished build, add the seed `sweep` and the
+    profiled `stages` if any, and write them to `build_dir/metrics.json`
+    and the history. Returns (metrics, whether the build met timing).
+    """
+    metrics = collect_metrics(build_dir, job.name)
+    if metrics is None:
+        return None, True
+    if sweep is not None:
+        metrics["seeds"] = sweep
+    if stages is not None:
+        metrics["stages"] = [stage.summary() for stage in stages]
+    with open(os.path.join(build_dir, "metrics.json"), "w") as f:
+        json.dump(metrics, f, indent=2)
+    append_record(os.path.join(root, "history.jsonl"),
+                  history_record(metrics, job.top_kwargs))
+    failures = timing_failures(metrics)
+    for failure in failures:
+        log.write(f"Timing failure: {failure}\n")
+    return metrics, not failures
+
+
+def _echo(name):
+    def echo(stage, line):
+        print(f"[{name} {stage}] {line}", end="", flush=True)
+    return echo
+
+
+def run_builds(jobs, root="build", workers=None, cache=None, seeds=None,
+               until_pass=False, elaborate_only=False, profile=False,
+               stream=False):
+    """
+    Build all `jobs` concurrently using a pool of `workers` processes
+    (by default, one per CPU). Returns the BuildResults in the same order
+    as `jobs`. Raises ValueError before starting any builds if the options
+    can't be used together (see check_options()).
+    """
+    check_options(cache, seeds, until_pass, elaborate_only, profile, stream)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_build, job, root, cache, seeds, until_pass,
+                               elaborate_only, profile, stream)
+                   for job in jobs]
+        return [f.result() for f in futures]
+
+
+def format_summary(results, wall_time):
+    """Format a per-job timing table for a list of BuildResults."""
+    width = max(len(r.name) for r in results)
+    lines = []
+    for r in sorted(results, key=lambda r: r.elapsed, reverse=True):
+        status = "ok" if r.ok else "FAILED"
+        cached = " (cached)" if r.cached else ""
+        metrics = f"  {format_metrics(r.metrics)}" if r.metrics else ""
+        lines.append(f"  {r.name:<{width}}  {status:<6}  {r.elapsed:7.2f}s"
+                     f"{cached}{metrics}")
+        if r.stages:
+            lines.append(f"  {'':<{width}}  {format_stages(r.stages)}")
+    serial = sum(r.elapsed for r in results)
+    lines.append(f"{len(results)} builds in {wall_time:.2f}s wall clock "
+                 f"({serial:.2f}s if run one after another)")
+    if any(r.cached is not None for r in results):
+        lines.append(format_stats(results))
+    return "\n".join(lines)
+
+
+def tail(path, lines=20):
+    with open(path) as f:
+        return "".join(f.readlines()[-lines:])
+
+
+def main(argv=None):
+    names = [job.name for job in EXAMPLES]
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("examples", nargs="*", metavar="EXAMPLE",
+                        help=f"any of: {', '.join(names)} (default: all)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of parallel builds (default: CPUs)")
+    parser.add_argument("--build-dir", default="build",
+                        help="root directory for per-example build dirs")
+    parser.add_argument("--cache", action="store_true",
+                        help="reuse products of identical earlier builds")
+    parser.add_argument("--cache-dir", default=None,
+                        help="cache location (default: ~/.cache/...)")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="maximum cache size in MiB (default: 1024)")
+    parser.add_argument("--seeds", type=int, default=None,
+                        help="place and route with this many seeds, keeping "
+                             "the best")
+    parser.add_argument("--until-pass", action="store_true",
+                        help="with --seeds, stop at the first seed meeting "
+                             "timing")
+    parser.add_argument("--elaborate", action="store_true",
+                        help="only elaborate and write RTLIL, without "
+                             "running the toolchain")
+    parser.add_argument("--verilog", action="store_true",
+                        help="also write Verilog (needs Yosys)")
+    parser.add_argument("--profile", action="store_true",
+                        help="record each toolchain stage's time and memory "
+                             "into Chrome traces, and profile elaboration")
+    parser.add_argument("--stream", action="store_true",
+                        help="echo the toolchain's output as it runs "
+                             "(implies --profile)")
+    parser.add_argument("--warm", action="store_true",
+                        help="run the YoWASP tools from a server which "
+                             "keeps them loaded")
+    args = parser.parse_args(argv)
+    for name in args.examples:
+        if name not in names:
+            parser.error(f"unknown example {name!r}")
+    cache = None
+    if args.cache:
+        cache = BuildCache(args.cache_dir, args.cache_size << 20)
+    seeds = range(1, args.seeds + 1) if args.seeds else None
+    try:
+        check_options(cache, seeds, args.until_pass, args.elaborate,
+                      args.profile, args.stream)
+    except ValueError as e:
+        parser.error(str(e))
+
+    jobs = [job for job in EXAMPLES
+            if not args.examples or job.name in args.examples]
+    if args.verilog:
+        jobs = [BuildJob(job.name, job.top, job.platform, job.top_kwargs,
+                         **job.kwargs, debug_verilog=True) for job in jobs]
+    start = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        if args.warm:
+            # Set before the worker processes start, so they inherit it.
+            stack.enter_context(tool_environ(stack.enter_context(
+                running_server(workers=args.jobs))))
+        results = run_builds(jobs, args.build_dir, args.jobs, cache, seeds,
+                             args.until_pass, args.elaborate, args.profile,
+                             args.stream)
+    print(format_summary(results, time.perf_counter() - start))
+    profiled = [(r.name, r.stages) for r in results if r.stages]
+    if profiled:
+        path = os.path.join(args.build_dir, "trace.json")
+        write_trace(path, profiled)
+        print(f"Wrote a Chrome trace of every stage to {path}")
+
+    failed = [r for r in results if not r.ok]
+    for r in failed:
+        print(f"\n{r.name} failed, end of {r.log}:\n{tail(r.log)}")
+    return 1 if failed else 0
+
+
+def test_elaborate_examples():
+    start = time.perf_counter()
+    results = run_builds(EXAMPLES, "build/elaborate", elaborate_only=True)
+    print(format_summary(results, time.perf_counter() - start))
+    for r in results:
+        assert r.ok, f"{r.name} failed, end of {r.log}:\n{tail(r.log)}"
+        assert os.path.exists(os.path.join(r.build_dir, "top.il"))
+        assert r.metrics is None
+
+
+def test_build_options():
+    import tempfile
+    import pytest
+
+    # Elaboration can be profiled without running the toolchain.
+    [job] = [job for job in EXAMPLES if job.name == "instance"]
+    with tempfile.TemporaryDirectory() as tmp:
+        [r] = run_builds([job], tmp, elaborate_only=True, profile=True)
+        assert r.ok, tail(r.log)
+        assert os.path.exists(os.path.join(r.build_dir, "elaboration.json"))
+        assert not os.path.exists(os.path.join(r.build_dir, "trace.json"))
+        assert r.metrics is None and r.stages is None
+
+        # Other combinations are refused before anything is built.
+        cache = BuildCache(os.path.join(tmp, "cache"))
+        for options in [dict(cache=cache, seeds=range(2)),
+                        dict(seeds=range(2), profile=True),
+                        dict(seeds=range(2), stream=True),
+                        dict(elaborate_only=True, cache=cache),
+                        dict(elaborate_only=True, stream=True),
+                        dict(until_pass=True)]:
+            with pytest.raises(ValueError):
+                run_builds([job], os.path.join(tmp, "refused"), **options)
+        assert not os.path.exists(os.path.join(tmp, "refused"))
+    with pytest.raises(SystemExit):
+        main(["--seeds", "2", "--stream", "instance"])
+
+
+def test_build_runner_toolchain():
+    start = time.perf_counter()
+    results = run_builds(EXAMPLES)
+    print(format_summary(results, time.perf_counter() - start))
+    for r in results:
+        assert r.ok, f"{r.name} failed, end of {r.log}:\n{tail(r.log)}"
+        assert r.metrics["clocks"], f"{r.name} has no timing report"
+
+
+if __name__ == "__main__":
+    sys.exit(main())
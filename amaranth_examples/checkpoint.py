@@ -0,0 +1,252 @@
+"""
+Checkpoint and restore simulation state, to skip long stretches of cycles.
+
+Checking that a 24-bit counter like the one in custom_board.py rolls over
+means stepping a testbench through 2^24 cycles, one `yield` at a time.
+Instead, a testbench can start the design in the state it's interested in:
+
+* `preset(sim, counter.counter.eq(limit - 3))` sets registers directly in
+  a Simulator which hasn't started running yet.
+* `Checkpoint.capture(sim)` takes a snapshot of every signal in a
+  simulation which has run for a while (for example with
+  `sim.run_until(t, run_passive=True)`), `checkpoint.save(path)` writes it to a
+  compact binary file, and `Checkpoint.load(path).restore(sim)` puts it
+  into a fresh Simulator of the same design, so several tests can share
+  one pre-roll.
+
+Signals are matched by their hierarchical name (as in tracing.py), so the
+fresh Simulator can be of a new instance of the design. Clock signals
+aren't saved, since their clock processes drive them from scratch, and the
+restored simulation starts again from time zero; the checkpoint's `time`
+records when it was taken.
+
+This reaches into the Python simulator's internal state, so only works
+with Amaranth's pysim engine.
+"""
+
+import struct
+import zlib
+
+from amaranth import Const, Signal
+from amaranth.hdl.ast import Assign
+from amaranth.sim.pysim import PySimEngine
+
+from amaranth_examples.tracing import signal_names
+
+
+MAGIC = b"AMCKPT\x01"
+
+
+def _slot(sim, signal):
+    if not isinstance(sim._engine, PySimEngine):
+        raise TypeError("Checkpoints only work with the pysim engine")
+    state = sim._engine._state
+    return state.slots[state.get_signal(signal)]
+
+
+def _clocks(sim):
+    return {id(domain.clk) for domain in sim._fragment.domains.values()}
+
+
+def _check(signal, value):
+    width = len(signal)
+    if signal.shape().signed:
+        lo, hi = -1 << (width - 1), 1 << (width - 1)
+    else:
+        lo, hi = 0, 1 << width
+    if not lo <= value < hi:
+        raise ValueError(f"Value {value} does not fit in {signal.name}, "
+                         f"which is {signal.shape()}")
+
+
+def _set(sim, signal, value):
+    _check(signal, value)
+    slot = _slot(sim, signal)
+    slot.curr = slot.next = value
+
+
+def preset(sim, *assignments):
+    """
+    Start `sim`, which must not have started running yet, with signals set
+    by `assignments` such as `counter.eq(5)`, as if they were their reset
+    values. Each must assign a constant to a whole Signal.
+    """
+    for stmt in assignments:
+        if not isinstance(stmt, Assign) or \
+                not isinstance(stmt.lhs, Signal):
+            raise TypeError(f"Can only preset whole signals, not {stmt!r}")
+        _set(sim, stmt.lhs, Const.cast(stmt.rhs).value)
+
+
+class Checkpoint:
+    """
+    The width and value of each signal in a simulation, by hierarchical
+    name, and the simulation `time` in picoseconds when it was captured.
+    Values are stored as unsigned integers, as two's complement for signed
+    signals.
+    """
+    def __init__(self, values, time=0):
+        self.values = values
+        self.time = time
+
+    @classmethod
+    def capture(cls, sim):
+        """Snapshot every signal in `sim` apart from its clocks."""
+        clocks = _clocks(sim)
+        values = {}
+        for name, signal in signal_names(sim).items():
+            if id(signal) not in clocks:
+                width = len(signal)
+                values[name] = (width, _slot(sim, signal).curr % (1 << width))
+        return cls(values, sim._engine.now)
+
+    def restore(self, sim, strict=True):
+        """
+        Load this checkpoint into `sim`, which must not have started running
+        yet. Unless `strict` is False, every signal in the checkpoint must
+        exist in `sim` with the same width.
+        """
+        names = signal_names(sim)
+        for name, (width, value) in self.values.items():
+            signal = names.get(name)
+            if signal is None or len(signal) != width:
+                if strict:
+                    raise ValueError(f"Checkpointed signal {name} ({width} "
+                                     f"bits) is not in the design")
+                continue
+            if signal.shape().signed and value >> (width - 1):
+                value -= 1 << width
+            _set(sim, signal, value)
+
+    def save(self, path):
+        """
+        Write this checkpoint to `path`: after a header, a zlib-compressed
+        list of (name, width, value) with each value as a little-endian
+        two's complement integer of just enough bytes for its width.
+        """
+        body = [struct.pack("<QI", self.time, len(self.values))]
+        for name, (width, value) in self.values.items():
+            encoded = name.encode()
+            body.append(struct.pack("<HI", len(encoded), width))
+            body.append(encoded)
+            body.append(value.to_bytes((width + 7) // 8, "little"))
+        with open(path, "wb") as f:
+            f.write(MAGIC)
+            f.write(zlib.compress(b"".join(body)))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a simulation checkpoint")
+            body = zlib.decompress(f.read())
+        time, count = struct.unpack_from("<QI", body)
+        offset = struct.calcsize("<QI")
+        values = {}
+        for _ in range(count):
+            length, width = struct.unpack_from("<HI", body, offset)
+            offset += struct.calcsize("<HI")
+            name = body[offset:offset + length].decode()
+            offset += length
+            size = (width + 7) // 8
+            value = int.from_bytes(body[offset:offset + size], "little")
+            offset += size
+            values[name] = (width, value)
+        return cls(values, time)
+
+    def value(self, name, signed=False):
+        """The value of the signal called `name`, sign-extended if `signed`."""
+        width, value = self.values[name]
+        if signed and value >> (width - 1):
+            value -= 1 << width
+        return value
+
+
+def test_preset_counter():
+    from amaranth.sim import Simulator
+    from amaranth_examples.counter import Counter
+
+    # A 24-bit counter, as in custom_board.py, started just short of its
+    # rollover instead of 2^24 cycles before it.
+    limit = 2**24
+    counter = Counter(limit)
+    sim = Simulator(counter)
+    sim.add_clock(1/10e6)
+    preset(sim, counter.counter.eq(limit - 3))
+
+    def testbench():
+        for step in range(6):
+            expected = (limit - 3 + step) % limit
+            assert (yield counter.counter) == expected
+            assert (yield counter.rollover) == (expected == limit - 1)
+            yield
+
+    sim.add_sync_process(testbench)
+    sim.run()
+
+
+def test_checkpoint():
+    import os
+    import tempfile
+    from amaranth.sim import Simulator
+    from amaranth_examples.counter import Counter
+
+    limit = 1000
+    preroll = 990
+
+    class Design(Counter):
+        # A signed register as well, to check negative values survive.
+        def elaborate(self, platform):
+            m = super().elaborate(platform)
+            self.total = Signal(range(-limit, limit))
+            m.d.sync += self.total.eq(self.total - 1)
+            return m
+
+    period = 1/10e6
+
+    def simulator(testbench=None):
+        design = Design(limit)
+        sim = Simulator(design)
+        sim.add_clock(period)
+        if testbench is not None:
+            sim.add_sync_process(testbench(design))
+        return sim
+
+    # Run the pre-roll without any testbench, for `preroll` clock edges.
+    sim = simulator()
+    sim.run_until(preroll * period, run_passive=True)
+    checkpoint = Checkpoint.capture(sim)
+    assert checkpoint.value("top.counter") == preroll
+    assert checkpoint.value("top.total", signed=True) == -preroll
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "preroll.ckpt")
+        checkpoint.save(path)
+        assert os.path.getsize(path) < 100
+        loaded = Checkpoint.load(path)
+    assert loaded.values == checkpoint.values
+    assert loaded.time == checkpoint.time
+
+    # Carry on from the checkpoint in a fresh simulation of a new instance
+    # of the design, through the rollover.
+    def carry_on(design):
+        def process():
+            for step in range(preroll, limit + 5):
+                assert (yield design.counter) == step % limit
+                assert (yield design.rollover) == (step == limit - 1)
+                assert (yield design.total) == -step
+                yield
+        return process
+
+    sim = simulator(carry_on)
+    loaded.restore(sim)
+    sim.run()
+
+    # A checkpoint of a different design doesn't restore.
+    sim = Simulator(Counter(limit * 100))
+    try:
+        loaded.restore(sim)
+    except ValueError:
+        pass
+    else:
+        assert False, "restored a checkpoint into the wrong design"
@@ -1,5 +1,13 @@
 """
 Example testbench for a combinatorial-only module.
+
+As well as the simple testbench, which checks a few hundred operand pairs
+one at a time, this shows a batched mode that can exhaustively check every
+8-bit operand pair in a few seconds. Many copies of the ALU are simulated
+side by side with their inputs and outputs packed into wide buses, so each
+`yield Settle()` checks a whole batch, and the expected results for every
+pair are computed at once as a NumPy array. NumPy is only imported by the
+batched mode, so the ALU itself can be used without it.
 """
 
 from amaranth import Module, Signal, Elaboratable
@@ -11,12 +19,16 @@ class ALU(Elaboratable):
     A simple ALU that either adds or subtracts two inputs,
     but implemented only using combinatorial statements,
     without any synchronous logic.
+
+    The output is one bit wider than the inputs, so additions never
+    overflow and subtractions wrap modulo 2**(width+1).
     """
-    def __init__(self):
+    def __init__(self, width=8):
+        self.width = width
         self.op = Signal()
-        self.a = Signal(8)
-        self.b = Signal(8)
-        self.y = Signal(9)
+        self.a = Signal(width)
+        self.b = Signal(width)
+        self.y = Signal(width + 1)
 
     def elaborate(self, platform):
         m = Module()
@@ -57,3 +69,143 @@ def test_comb_alu():
     sim.add_process(testbench)
 
     sim.run()
+
+
+def lane_dtype(width):
+    """The smallest little-endian NumPy type that holds a `width` ALU's y."""
+    import numpy as np
+    return np.min_scalar_type(2**(width + 1) - 1).newbyteorder("<")
+
+
+class BatchedALU(Elaboratable):
+    """
+    `lanes` copies of the ALU, sharing one `op` input, with all of their
+    `a`, `b` and `y` ports packed into the wide `a`, `b` and `y` buses.
+
+    Each lane occupies `slot` bits of each bus, where `slot` is the size
+    of the smallest NumPy integer type that fits `y`, so a whole batch
+    can be converted to and from an array with a single `tobytes()` or
+    `frombuffer()` call.
+    """
+    def __init__(self, width, lanes):
+        self.width = width
+        self.lanes = lanes
+        self.dtype = lane_dtype(width)
+        self.slot = self.dtype.itemsize * 8
+
+        self.op = Signal()
+        self.a = Signal(lanes * self.slot)
+        self.b = Signal(lanes * self.slot)
+        self.y = Signal(lanes * self.slot)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        for lane in range(self.lanes):
+            alu = m.submodules[f"alu{lane}"] = ALU(self.width)
+            lsb = lane * self.slot
+            m.d.comb += [
+                alu.op.eq(self.op),
+                alu.a.eq(self.a[lsb:lsb + self.width]),
+                alu.b.eq(self.b[lsb:lsb + self.width]),
+                self.y[lsb:lsb + self.width + 1].eq(alu.y),
+            ]
+
+        return m
+
+    def pack(self, values):
+        """Pack an array of one value per lane into a bus integer."""
+        return int.from_bytes(values.astype(self.dtype).tobytes(), "little")
+
+    def unpack(self, value):
+        """Unpack a bus integer into an array of one value per lane."""
+        import numpy as np
+        data = value.to_bytes(self.lanes * self.dtype.itemsize, "little")
+        return np.frombuffer(data, self.dtype)
+
+
+def alu_expected(width, op, a, b):
+    """Compute the ALU's expected `y` for arrays of operands."""
+    import numpy as np
+    a = a.astype(np.uint64)
+    b = b.astype(np.uint64)
+    # Unsigned subtraction wraps modulo 2**64, which is a multiple of the
+    # modulus we want, so `% 2**(width+1)` gives the right answer.
+    return np.where(op, a + b, (a - b) % np.uint64(2**(width + 1)))
+
+
+def check_alu_batched(width, a, b, bus_width=8192, max_mismatches=10):
+    """
+    Check the ALU for every pair in the operand arrays `a` and `b`, for both
+    operations, with as many lanes as fit in a `bus_width`-bit bus.
+    (The Python simulator converts constants to decimal strings internally,
+    so buses much wider than this hit Python's integer conversion limit.)
+
+    Returns a list of up to `max_mismatches` (op, a, b, expected, got)
+    tuples, empty if every result was correct.
+    """
+    import numpy as np
+    lanes = bus_width // (lane_dtype(width).itemsize * 8)
+    dut = BatchedALU(width, lanes)
+    count = len(a)
+    pad = -count % lanes
+    a = np.concatenate([a, np.zeros(pad, a.dtype)])
+    b = np.concatenate([b, np.zeros(pad, b.dtype)])
+    got = {op: np.empty(len(a), np.uint64) for op in (0, 1)}
+
+    def testbench():
+        for start in range(0, len(a), lanes):
+            batch = slice(start, start + lanes)
+            yield dut.a.eq(dut.pack(a[batch]))
+            yield dut.b.eq(dut.pack(b[batch]))
+            for op in (0, 1):
+                yield dut.op.eq(op)
+                yield Settle()
+                got[op][batch] = dut.unpack((yield dut.y))
+
+    sim = Simulator(dut)
+    sim.add_process(testbench)
+    sim.run()
+
+    mismatches = []
+    for op in (0, 1):
+        expected = alu_expected(width, op, a[:count], b[:count])
+        bad = np.flatnonzero(got[op][:count] != expected)
+        for i in bad[:max_mismatches - len(mismatches)]:
+            mismatches.append((op, int(a[i]), int(b[i]),
+                               int(expected[i]), int(got[op][i])))
+    return mismatches
+
+
+def format_mismatches(mismatches):
+    return "\n".join(f"op={op} a={a:#x} b={b:#x}: expected {exp:#x}, "
+                     f"got {got:#x}"
+                     for op, a, b, exp, got in mismatches)
+
+
+def test_comb_alu_exhaustive():
+    """Check all 65,536 pairs of 8-bit operands for both operations."""
+    import pytest
+    np = pytest.importorskip("numpy")
+    a, b = np.divmod(np.arange(2**16), 2**8)
+    mismatches = check_alu_batched(8, a, b)
+    assert not mismatches, format_mismatches(mismatches)
+
+
+def test_comb_alu_sampled():
+    """
+    Wider ALUs have far too many operand pairs to check exhaustively,
+    so check a random sample plus the extreme values at each width.
+    """
+    import pytest
+    np = pytest.importorskip("numpy")
+    rng = np.random.default_rng(seed=0)
+    for width in (16, 32):
+        top = 2**width - 1
+        a = rng.integers(0, top, 4096, endpoint=True, dtype=np.uint64)
+        b = rng.integers(0, top, 4096, endpoint=True, dtype=np.uint64)
+        edges = np.array([0, 1, top - 1, top], np.uint64)
+        a = np.concatenate([a, np.repeat(edges, 4)])
+        b = np.concatenate([b, np.tile(edges, 4)])
+        mismatches = check_alu_batched(width, a, b)
+        assert not mismatches, format_mismatches(mismatches)
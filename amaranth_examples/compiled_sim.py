@@ -0,0 +1,312 @@
+"""
+Run generator-style testbenches against a compiled model of the design.
+
+The pure-Python simulator is fine for short testbenches, but something like
+the 24-bit counter from custom_board.py takes millions of cycles to roll
+over. Here, the same kind of testbench can instead drive a native model of
+the design: Yosys converts the design's RTLIL to C++ with its CXXRTL
+backend, the local C++ compiler builds it into a shared library, and we
+load that with ctypes.
+
+Compiled models are cached by a hash of the RTLIL, the Yosys version and
+the compiler command line, in `~/.cache/amaranth-examples/cxxrtl` (or under
+`$AMARANTH_EXAMPLES_CACHE`), so the compiler only runs when the design
+changes.
+
+CompiledSimulator supports a single testbench process, using the same
+commands as the Python simulator: `yield` (or `yield Tick()`) to advance
+one clock cycle, `yield Settle()`, `yield signal` to read and
+`yield signal.eq(value)` to write. Tools are found the same way as for
+builds, through `$YOSYS` and `$CXX`.
+"""
+
+import ctypes
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from amaranth import Signal
+from amaranth.back import rtlil
+from amaranth.hdl.ast import Assign, Const, SignalDict
+from amaranth.hdl.ir import Fragment
+from amaranth.sim import Simulator, Settle, Tick
+
+from amaranth_examples.build_cache import default_cache_dir, tool_version
+from amaranth_examples.counter import Counter
+
+
+def cxxrtl_include_dir():
+    """Find the CXXRTL runtime headers for the Yosys in use."""
+    yosys_config = shutil.which("yosys-config")
+    if yosys_config is not None:
+        datdir = subprocess.run([yosys_config, "--datdir"], text=True,
+                                capture_output=True, check=True).stdout
+        return os.path.join(datdir.strip(), "include", "backends", "cxxrtl",
+                            "runtime")
+    try:
+        import yowasp_yosys
+    except ImportError:
+        raise RuntimeError("Could not find the CXXRTL runtime; install Yosys "
+                           "(with yosys-config) or yowasp-yosys")
+    return os.path.join(os.path.dirname(yowasp_yosys.__file__), "share",
+                        "include", "backends", "cxxrtl", "runtime")
+
+
+def compile_cxxrtl(files, commands, cache_dir=None):
+    """
+    Write `files` (a dict of file name to contents) to a scratch directory,
+    run the Yosys `commands` there to read them into a design, and compile
+    that with CXXRTL into a shared library exposing the CXXRTL C API,
+    returning its path. Cached by a hash of the files and commands.
+    """
+    yosys = os.environ.get("YOSYS", "yosys")
+    cxx = os.environ.get("CXX", "c++")
+    flags = ["-std=c++14", "-O2", "-shared", "-fPIC",
+             "-DCXXRTL_INCLUDE_CAPI_IMPL"]
+
+    hasher = hashlib.blake2b(digest_size=20)
+    for name, contents in sorted(files.items()):
+        hasher.update(f"{name}\0{contents}\0".encode("utf-8"))
+    hasher.update(commands.encode("utf-8"))
+    hasher.update(tool_version("yosys").encode("utf-8"))
+    hasher.update(" ".join([cxx, *flags]).encode("utf-8"))
+    cache_dir = cache_dir or os.path.join(default_cache_dir(), "cxxrtl")
+    library = os.path.join(cache_dir, f"{hasher.hexdigest()}.so")
+    if os.path.exists(library):
+        return library
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, contents in files.items():
+            with open(os.path.join(tmp, name), "w") as f:
+                f.write(contents)
+        subprocess.run([yosys, "-q", "-p",
+                        f"{commands}; write_cxxrtl model.cc"],
+                       cwd=tmp, check=True)
+        subprocess.run([cxx, *flags, "-I", cxxrtl_include_dir(),
+                        "model.cc", "-o", "model.so"], cwd=tmp, check=True)
+        # Rename into place so concurrent compiles never load a partial file.
+        staging = os.path.join(cache_dir, f".{os.getpid()}.so")
+        shutil.move(os.path.join(tmp, "model.so"), staging)
+        os.replace(staging, library)
+    return library
+
+
+def compile_rtlil(rtlil_text, cache_dir=None):
+    """
+    Compile RTLIL for a top-level module named `top` into a shared library
+    exposing the CXXRTL C API, returning its path. Source locations are
+    left out, so the cached model is reused when only line numbers change.
+    """
+    rtlil_text = re.sub(r"^\s*attribute \\src .*\n", "", rtlil_text,
+                        flags=re.MULTILINE)
+    return compile_cxxrtl({"top.il": rtlil_text}, "read_rtlil top.il",
+                          cache_dir)
+
+
+class _CXXRTLObject(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("width", ctypes.c_size_t),
+        ("lsb_at", ctypes.c_size_t),
+        ("depth", ctypes.c_size_t),
+        ("zero_at", ctypes.c_size_t),
+        ("curr", ctypes.POINTER(ctypes.c_uint32)),
+        ("next", ctypes.POINTER(ctypes.c_uint32)),
+        ("outline", ctypes.c_void_p),
+        ("attrs", ctypes.c_void_p),
+    ]
+
+
+class CompiledModel:
+    """A CXXRTL model loaded from a shared library built by compile_rtlil."""
+    def __init__(self, library):
+        self.lib = lib = ctypes.CDLL(library)
+        lib.cxxrtl_design_create.restype = ctypes.c_void_p
+        lib.cxxrtl_create.restype = ctypes.c_void_p
+        lib.cxxrtl_create.argtypes = [ctypes.c_void_p]
+        lib.cxxrtl_destroy.argtypes = [ctypes.c_void_p]
+        lib.cxxrtl_step.argtypes = [ctypes.c_void_p]
+        lib.cxxrtl_get_parts.restype = ctypes.POINTER(_CXXRTLObject)
+        lib.cxxrtl_get_parts.argtypes = [
+            ctypes.c_void_p, ctypes.c_char_p, ctypes.POINTER(ctypes.c_size_t)]
+        lib.cxxrtl_outline_eval.argtypes = [ctypes.c_void_p]
+        self.handle = lib.cxxrtl_create(lib.cxxrtl_design_create())
+
+    def __del__(self):
+        if getattr(self, "handle", None):
+            self.lib.cxxrtl_destroy(self.handle)
+
+    def get(self, name):
+        parts = ctypes.c_size_t()
+        obj = self.lib.cxxrtl_get_parts(self.handle, name.encode("utf-8"),
+                                        ctypes.byref(parts))
+        if not obj or parts.value != 1:
+            raise KeyError(f"No single-part object named {name!r} in model")
+        return obj.contents
+
+    def read(self, obj):
+        if obj.outline:
+            self.lib.cxxrtl_outline_eval(obj.outline)
+        value = 0
+        for i in range((obj.width + 31) // 32):
+            value |= obj.curr[i] << (32 * i)
+        return value
+
+    def write(self, obj, value):
+        if not obj.next:
+            raise ValueError("Object cannot be written; only inputs and "
+                             "registers can be driven by a testbench")
+        for i in range((obj.width + 31) // 32):
+            obj.next[i] = (value >> (32 * i)) & 0xFFFFFFFF
+
+    def step(self):
+        self.lib.cxxrtl_step(self.handle)
+
+
+class CompiledSimulator:
+    """
+    A stand-in for `Simulator` which runs one testbench process against
+    a compiled model of `dut`. `ports` lists the signals the testbench reads
+    or writes which aren't otherwise top-level inputs or outputs.
+    """
+    def __init__(self, dut, ports=(), *, cache_dir=None):
+        fragment = Fragment.get(dut, platform=None).prepare(ports=ports)
+        rtlil_text, self.name_map = rtlil.convert_fragment(fragment)
+        self.domains = fragment.domains
+        self.model = CompiledModel(compile_rtlil(rtlil_text, cache_dir))
+        self.objects = SignalDict()
+        self.process = None
+        self.domain = None
+        self.dirty = True
+
+    def add_clock(self, period, *, domain="sync"):
+        # The compiled model has no notion of time; each `yield` in a sync
+        # process simply toggles the clock, so the period is unused.
+        self.clock = self._object(self.domains[domain].clk)
+
+    def add_sync_process(self, process, *, domain="sync"):
+        assert self.process is None, "only one process is supported"
+        self.process = process
+        self.domain = domain
+
+    def add_process(self, process):
+        assert self.process is None, "only one process is supported"
+        self.process = process
+
+    def _object(self, signal):
+        if signal not in self.objects:
+            if signal not in self.name_map:
+                raise KeyError(f"{signal!r} is not in the compiled design; "
+                               f"add it to `ports`")
+            name = " ".join(self.name_map[signal][1:])
+            self.objects[signal] = self.model.get(name)
+        return self.objects[signal]
+
+    def _settle(self):
+        if self.dirty:
+            self.model.step()
+            self.dirty = False
+
+    def _tick(self):
+        self._settle()
+        self.model.write(self.clock, 1)
+        self.model.step()
+        self.model.write(self.clock, 0)
+        self.model.step()
+
+    def run(self):
+        model = self.model
+        process = self.process()
+        response = None
+        while True:
+            try:
+                command = process.send(response)
+            except StopIteration:
+                break
+            response = None
+            if command is None or isinstance(command, Tick):
+                if self.domain is None:
+                    raise TypeError("Cannot wait for a clock edge in a "
+                                    "process added with add_process()")
+                self._tick()
+            elif isinstance(command, Settle):
+                self._settle()
+            elif isinstance(command, Signal):
+                self._settle()
+                response = model.read(self._object(command))
+            elif isinstance(command, Assign) and \
+                    isinstance(command.lhs, Signal) and \
+                    isinstance(command.rhs, Const):
+                model.write(self._object(command.lhs), command.rhs.value)
+                self.dirty = True
+            else:
+                raise TypeError(f"Command {command!r} is not supported by "
+                                f"the compiled simulator")
+
+
+def compare_backends(make_dut, testbench, *, ports=lambda dut: (),
+                     period=1/10e6):
+    """
+    Run the sync testbench `testbench(dut)` against a fresh `make_dut()` in
+    both the Python simulator and a compiled model, returning the wall time
+    each took (excluding compiling the model, which is cached anyway).
+    """
+    times = []
+    for backend in (Simulator, CompiledSimulator):
+        dut = make_dut()
+        if backend is Simulator:
+            sim = Simulator(dut)
+        else:
+            sim = CompiledSimulator(dut, ports(dut))
+
+        def process():
+            yield from testbench(dut)
+
+        sim.add_clock(period)
+        sim.add_sync_process(process)
+        start = time.perf_counter()
+        sim.run()
+        times.append(time.perf_counter() - start)
+    return tuple(times)
+
+
+def counter_testbench(limit, cycles):
+    """Check a Counter's value and rollover output for `cycles` cycles."""
+    def testbench(counter):
+        for step in range(cycles):
+            assert (yield counter.counter) == step % limit
+            assert (yield counter.rollover) == (step % limit == limit - 1)
+            yield
+    return testbench
+
+
+def test_compiled_counter_toolchain():
+    # Two full periods of a counter with a non-power-of-two limit, too long
+    # to be comfortable in the Python simulator.
+    limit = 100_003
+    counter = Counter(limit)
+    sim = CompiledSimulator(counter, [counter.counter, counter.rollover])
+    sim.add_clock(1/10e6)
+
+    def process():
+        yield from counter_testbench(limit, 2 * limit)(counter)
+
+    sim.add_sync_process(process)
+    start = time.perf_counter()
+    sim.run()
+    print(f"{2 * limit} cycles in {time.perf_counter() - start:.2f}s")
+
+
+def test_compare_backends_toolchain():
+    python_time, compiled_time = compare_backends(
+        lambda: Counter(2**24), counter_testbench(2**24, 20_000),
+        ports=lambda counter: [counter.counter, counter.rollover])
+    print(f"Python simulator {python_time:.3f}s, compiled model "
+          f"{compiled_time:.3f}s: {python_time / compiled_time:.1f}x speedup")
+    assert compiled_time < python_time
@@ -7,7 +7,6 @@ resource which you can later request.
 
 from amaranth import Module, Signal, Elaboratable
 from amaranth.build import Resource, Pins
-from amaranth_boards.icebreaker import ICEBreakerPlatform
 
 
 class Top(Elaboratable):
@@ -29,11 +28,13 @@ class Top(Elaboratable):
         return m
 
 
-def test_connectors():
+def test_connectors_toolchain():
+    from amaranth_boards.icebreaker import ICEBreakerPlatform
+
     top = Top()
     plat = ICEBreakerPlatform()
     plat.build(top)
 
 
 if __name__ == "__main__":
-    test_connectors()
+    test_connectors_toolchain()
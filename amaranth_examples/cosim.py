@@ -0,0 +1,224 @@
+"""
+Simulate designs containing Verilog Instances, using compiled models.
+
+instance.py instantiates a Verilog `counter` module which it adds to the
+build with `platform.add_file()`. The Python simulator can't see inside an
+Instance, so its outputs are just never driven. Here, each Instance whose
+module is defined in one of the platform's Verilog files is compiled on
+its own into a native CXXRTL model (see compiled_sim.py), with the
+Instance's parameters applied, and a process added to the Python
+simulation steps the model alongside the Amaranth logic:
+
+    plat = ICEBreakerPlatform()
+    sim = Simulator(Fragment.get(Top(), plat))
+    sim.add_clock(1/12e6)
+    add_verilog_models(sim, verilog_sources(plat))
+
+Elaborating with a real platform collects the Verilog files it was given,
+while the Simulator still only sees the Amaranth logic (resources such as
+LEDs are just signals to it).
+
+At every clock edge of the domain whose clock drives the Instance, the
+process samples the Instance's inputs as they were just before the edge,
+clocks the model, and drives the Instance's outputs with the results, so
+registered outputs behave just as Amaranth's own registers do. Once the
+Amaranth logic has settled it evaluates the model again with the new
+inputs, so combinational paths through the Instance are updated once per
+clock cycle, but not in between. Only Instances with a clock input are
+supported.
+
+Models are cached by a hash of the Verilog sources, module name and
+parameters, so Yosys and the C++ compiler only run when those change.
+"""
+
+import re
+
+from amaranth import Const, Signal
+from amaranth.hdl.ir import Instance
+from amaranth.sim import Settle, Tick, Passive
+
+from amaranth_examples.compiled_sim import CompiledModel, compile_cxxrtl
+
+
+def verilog_sources(platform):
+    """The Verilog files added to `platform`, as a dict of name to text."""
+    return {name: contents
+            for name, contents in platform.extra_files.items()
+            if name.endswith((".v", ".sv"))}
+
+
+def find_instances(fragment):
+    """Every Instance in the fragment hierarchy under `fragment`."""
+    instances = []
+    for subfragment, _ in fragment.subfragments:
+        if isinstance(subfragment, Instance):
+            instances.append(subfragment)
+        instances += find_instances(subfragment)
+    return instances
+
+
+def _parameter(value):
+    if isinstance(value, Const):
+        value = value.value
+    if isinstance(value, str):
+        return '"' + value.replace('"', '\\"') + '"'
+    return str(int(value))
+
+
+def compile_instance(instance, sources, cache_dir=None):
+    """
+    Compile the module instantiated by `instance` from the Verilog in
+    `sources` with the Instance's parameters, returning a CompiledModel.
+    """
+    commands = [f"read_verilog -defer{' -sv' if name.endswith('.sv') else ''}"
+                f" {name}" for name in sources]
+    chparams = "".join(f" -chparam {name} {_parameter(value)}"
+                       for name, value in instance.parameters.items())
+    commands.append(f"hierarchy -top {instance.type}{chparams}")
+    commands.append("proc")
+    return CompiledModel(compile_cxxrtl(sources, "; ".join(commands),
+                                        cache_dir))
+
+
+class VerilogModel:
+    """
+    Steps the compiled model of one Instance in a Python simulation,
+    clocked by `domain`, whose clock signal is the Instance's `clock` port.
+    """
+    def __init__(self, instance, model, domain, clock):
+        self.instance = instance
+        self.model = model
+        self.domain = domain
+        self.clock = model.get(clock)
+        self.inputs = []
+        self.outputs = []
+        for name, (value, kind) in instance.named_ports.items():
+            if name == clock:
+                continue
+            if kind == "i":
+                self.inputs.append((model.get(name), value))
+            elif kind == "o":
+                self.outputs.append((model.get(name), value))
+            else:
+                raise NotImplementedError(
+                    f"Inout port {name} of {instance.type} can't be "
+                    f"co-simulated")
+
+    def sample_inputs(self):
+        for obj, value in self.inputs:
+            self.model.write(obj, (yield value) % (1 << len(value)))
+
+    def drive_outputs(self):
+        for obj, value in self.outputs:
+            yield value.eq(self.model.read(obj))
+
+    def process(self):
+        yield Passive()
+        yield from self.sample_inputs()
+        self.model.step()
+        yield from self.drive_outputs()
+        while True:
+            yield Tick(self.domain)
+            # The inputs as they were at the clock edge.
+            yield from self.sample_inputs()
+            self.model.write(self.clock, 1)
+            self.model.step()
+            yield from self.drive_outputs()
+            # Then once everything has settled, any combinational outputs.
+            yield Settle()
+            yield from self.sample_inputs()
+            self.model.write(self.clock, 0)
+            self.model.step()
+            yield from self.drive_outputs()
+
+
+def _clock_port(instance, domains):
+    clocks = {id(domain.clk): domain.name for domain in domains.values()}
+    for name, (value, kind) in instance.named_ports.items():
+        if kind == "i" and isinstance(value, Signal) and \
+                id(value) in clocks:
+            return name, clocks[id(value)]
+    raise NotImplementedError(f"Instance of {instance.type} has no clock "
+                              f"input, so can't be co-simulated")
+
+
+def add_verilog_models(sim, sources, *, cache_dir=None):
+    """
+    Add a compiled model to `sim` for each Instance of a module defined in
+    `sources` (a dict of file name to Verilog), returning the VerilogModels.
+    Instances of any other module, such as vendor primitives, are left as
+    black boxes.
+    """
+    if not sources:
+        return []
+    text = "\n".join(sources.values())
+    models = []
+    for instance in find_instances(sim._fragment):
+        if not re.search(rf"\bmodule\s+{re.escape(instance.type)}\b", text):
+            continue
+        clock, domain = _clock_port(instance, sim._fragment.domains)
+        model = VerilogModel(instance, compile_instance(
+            instance, sources, cache_dir), domain, clock)
+        sim.add_process(model.process)
+        models.append(model)
+    return models
+
+
+def test_cosim_instance_toolchain():
+    from amaranth.hdl.ir import Fragment
+    from amaranth.sim import Simulator
+    from amaranth_examples.instance import Top
+    from amaranth_examples.registry import platform
+    from amaranth_examples.tracing import signal_names
+
+    plat = platform("icebreaker")()
+    sim = Simulator(Fragment.get(Top(), plat))
+    sim.add_clock(1/12e6)
+    [model] = add_verilog_models(sim, verilog_sources(plat))
+    assert model.instance.type == "counter"
+    count = signal_names(sim)["top.count"]
+
+    def testbench():
+        for step in range(600):
+            # As with Amaranth's registers, the value before each edge.
+            assert (yield count) == step % 256
+            yield
+
+    sim.add_sync_process(testbench)
+    sim.run()
+
+
+def test_cosim_inputs_toolchain():
+    from amaranth import Module, ClockSignal
+    from amaranth.sim import Simulator
+
+    # An accumulator with a registered sum of its input `d`, and an
+    # unregistered output of what the sum will be after the next edge.
+    verilog = """
+    module acc ( input clk, input [7:0] d, output reg [7:0] sum,
+                 output [7:0] next_sum );
+        assign next_sum = sum + d;
+        always @(posedge clk) sum <= next_sum;
+    endmodule
+    """
+    m = Module()
+    d = Signal(8)
+    total = Signal(8)
+    next_total = Signal(8)
+    m.d.sync += d.eq(d + 1)
+    m.submodules.acc = Instance("acc", i_clk=ClockSignal(), i_d=d,
+                                o_sum=total, o_next_sum=next_total)
+    sim = Simulator(m)
+    sim.add_clock(1/10e6)
+    add_verilog_models(sim, {"acc.v": verilog})
+
+    def testbench():
+        expected = 0
+        for step in range(300):
+            assert (yield total) == expected
+            assert (yield next_total) == (expected + step) % 256
+            expected = (expected + step) % 256
+            yield
+
+    sim.add_sync_process(testbench)
+    sim.run()
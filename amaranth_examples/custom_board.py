@@ -64,7 +64,7 @@ class Top(Elaboratable):
         return m
 
 
-def test_synthesise_custom_board():
+def test_synthesise_custom_board_toolchain():
     # All we need to do is create the top-level module, then call the
     # platform's `build()` method with it.
     top = Top()
@@ -73,4 +73,4 @@ def test_synthesise_custom_board():
 
 
 if __name__ == "__main__":
-    test_synthesise_custom_board()
+    test_synthesise_custom_board_toolchain()
@@ -45,7 +45,7 @@ class Top(Elaboratable):
         # Requesting the pins with `xdr=2` requests a DDR gearing.
         # Using `xdr=1` would be SDR - registered but only one data
         # connection. Higher values of `xdr` may be allowed on particular
-        # hardware, for example `xdr=7` for video interfaces.
+        # hardware, for example `xdr=7` for video interfaces; see gearbox.py.
         # When `xdr` is greater than 0, the `i_clk`/`o_clk` signals
         # become available.
         gpi = platform.request("gpi", 0, xdr=2)
@@ -66,7 +66,7 @@ class Top(Elaboratable):
         return m
 
 
-def test_synthesise_custom_board():
+def test_synthesise_custom_board_toolchain():
     # All we need to do is create the top-level module, then call the
     # platform's `build()` method with it.
     top = Top()
@@ -75,4 +75,4 @@ def test_synthesise_custom_board():
 
 
 if __name__ == "__main__":
-    test_synthesise_custom_board()
+    test_synthesise_custom_board_toolchain()
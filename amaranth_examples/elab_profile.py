@@ -0,0 +1,523 @@
+"""
+Time the Python side of a build: elaboration and netlist generation.
+
+Before Yosys starts, `plat.build()` elaborates the design, prepares the
+resulting fragments (lowering `Sample`s, propagating and lowering clock
+domains and working out the ports) and writes RTLIL. For a generated
+design this can take longer than synthesis, and none of it shows up in
+the build log.
+
+Inside a `with profiling() as profile:` block, Amaranth is patched to
+record:
+
+* every `Fragment.get()` call, each of which elaborates one submodule:
+  what was elaborated, how long it took with and without its own
+  submodules, and how many statements its fragment has and how many
+  signals it drives,
+* each netlist-generation phase, nested as in build_profile.py,
+* the time taken to emit each module's RTLIL.
+
+`report()` turns this into a JSON-friendly tree, and `format_report()`
+prints it with a table of time by class, to find the slow cores, and a
+list of any objects elaborated more than once, which usually means one
+object was added as a submodule in two places:
+
+    python -m amaranth_examples.elab_profile spi_regfile custom_board
+    python -m amaranth_examples.elab_profile --replicated spi 256 8
+
+Each report is also written to `build/<name>/elaboration.json`. Builds run
+with `build_runner.py --profile` write the same file.
+
+The phases are Amaranth internals, which move between releases, so each
+is looked up when profiling starts, and any which can't be found are left
+out of the profile and listed as unavailable in the report.
+"""
+
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import time
+
+from amaranth import Elaboratable, Instance
+from amaranth.back import rtlil
+from amaranth.hdl import Fragment
+
+
+# The methods timed as phases, as "module:attribute" paths, and the names
+# to give them. Each is only timed at its outermost call, as several of
+# them recurse into every subfragment.
+PHASES = [
+    ("amaranth.hdl.xfrm:SampleLowerer.__call__", "lower samples"),
+    ("amaranth.hdl.ir:Fragment._propagate_domains", "propagate domains"),
+    ("amaranth.hdl.xfrm:DomainLowerer.__call__", "lower domains"),
+    ("amaranth.hdl.ir:Fragment._propagate_ports", "propagate ports"),
+    ("amaranth.build.plat:TemplatedPlatform.toolchain_prepare",
+     "toolchain prepare"),
+    ("amaranth.back.rtlil:convert_fragment", "emit RTLIL"),
+]
+
+# Called to emit each module's RTLIL, to time them one by one.
+EMIT = "amaranth.back.rtlil:_convert_fragment"
+
+
+def _resolve(path):
+    """
+    Return (owner, attribute name) for a "module:attribute" path, whose
+    attribute may be dotted, or None if this Amaranth doesn't have it.
+    """
+    module, attrs = path.split(":")
+    *owners, attr = attrs.split(".")
+    try:
+        owner = importlib.import_module(module)
+        for name in owners:
+            owner = getattr(owner, name)
+    except (ImportError, AttributeError):
+        return None
+    if not hasattr(owner, attr):
+        return None
+    return owner, attr
+
+
+class ElabNode:
+    """
+    One call to `Fragment.get()`: the object elaborated, the name it was
+    given as a submodule, the fragment it produced and the time taken,
+    both in total and excluding its children.
+    """
+    def __init__(self, obj):
+        self.obj = obj
+        self.name = None
+        self.children = []
+        self.fragment = None
+        self.elapsed = 0.0
+        self.emit = None
+        self.statements = 0
+        self.signals = 0
+
+    @property
+    def kind(self):
+        if isinstance(self.obj, Instance):
+            return f"Instance {self.obj.type}"
+        return type(self.obj).__name__
+
+    @property
+    def self_time(self):
+        return self.elapsed - sum(child.elapsed for child in self.children)
+
+
+class ElabProfile:
+    """
+    The results of `profiling()`: the trees of `ElabNode`s (one for each
+    `Fragment.get()` called from outside elaboration, such as the design
+    and each of a platform's I/O buffers), the phases as (depth, name,
+    start, end), the objects elaborated more than once, and the names of
+    any phases (or "emit" for per-module RTLIL) which couldn't be timed.
+    """
+    def __init__(self):
+        self.roots = []
+        self.phases = []
+        self.duplicates = []
+        self.emitted = {}
+        self.unavailable = []
+
+
+def _count(fragment):
+    """
+    The number of statements in `fragment` itself, and of the signals it
+    drives, or for an Instance, of its ports. (Signals only read can't be
+    counted before domains are lowered, as they include `ClockSignal`s.)
+    """
+    if isinstance(fragment, Instance):
+        return 0, len(fragment.named_ports)
+    statements = 0
+    pending = list(fragment.statements)
+    while pending:
+        stmt = pending.pop()
+        statements += 1
+        # A Switch, whose cases hold more statements.
+        cases = getattr(stmt, "cases", None)
+        if isinstance(cases, dict):
+            pending += [s for stmts in cases.values() for s in stmts]
+    return statements, sum(len(signals)
+                           for signals in fragment.drivers.values())
+
+
+def _finish(profile, node, path):
+    node.statements, node.signals = _count(node.fragment)
+    names = {id(fragment): name
+             for fragment, name in getattr(node.fragment, "subfragments", [])}
+    for child in node.children:
+        child.name = names.get(id(child.fragment))
+        _finish(profile, child, path + (child.name,)
+                if path is not None else None)
+    if path is not None and path in profile.emitted:
+        children = [time for key, time in profile.emitted.items()
+                    if len(key) == len(path) + 1 and key[:-1] == path]
+        node.emit = profile.emitted[path] - sum(children)
+
+
+@contextlib.contextmanager
+def profiling():
+    """
+    Patch Amaranth to profile elaboration and netlist generation within
+    the `with` block, yielding an `ElabProfile` which is complete once the
+    block exits.
+    """
+    profile = ElabProfile()
+    stack = []
+    active = []
+    seen = {}
+
+    def timed(name, method):
+        def wrapper(*args, **kwargs):
+            if name in active:
+                return method(*args, **kwargs)
+            active.append(name)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                profile.phases.append((len(active) - 1, name, start,
+                                       time.perf_counter()))
+                active.pop()
+        return wrapper
+
+    get = Fragment.get
+
+    def elaborate(obj, platform):
+        node = ElabNode(obj)
+        (stack[-1].children if stack else profile.roots).append(node)
+        if not isinstance(obj, Fragment):
+            # Keep `obj` alive so its id can't be reused.
+            if id(obj) in seen and obj not in profile.duplicates:
+                profile.duplicates.append(obj)
+            seen[id(obj)] = obj
+        stack.append(node)
+        start = time.perf_counter()
+        try:
+            node.fragment = get(obj, platform)
+        finally:
+            node.elapsed = time.perf_counter() - start
+            stack.pop()
+        return node.fragment
+
+    patches = [
+        (Fragment, "get", staticmethod(timed("elaborate", elaborate))),
+    ]
+
+    target = _resolve(EMIT)
+    if target is not None:
+        convert = getattr(*target)
+
+        def emit(builder, fragment, name_map, hierarchy):
+            start = time.perf_counter()
+            try:
+                return convert(builder, fragment, name_map, hierarchy)
+            finally:
+                # Only the first module of each name is kept, so a second
+                # design converted in the same block doesn't add to it.
+                key = tuple(hierarchy[1:])
+                profile.emitted.setdefault(key, time.perf_counter() - start)
+
+        patches.append((*target, emit))
+    else:
+        profile.unavailable.append("emit")
+
+    for path, name in PHASES:
+        target = _resolve(path)
+        if target is None:
+            profile.unavailable.append(name)
+        else:
+            patches.append((*target, timed(name, getattr(*target))))
+    saved = [(owner, attr, owner.__dict__.get(attr))
+             for owner, attr, _ in patches]
+    try:
+        for owner, attr, method in patches:
+            setattr(owner, attr, method)
+        yield profile
+    finally:
+        for owner, attr, method in reversed(saved):
+            if method is None:
+                delattr(owner, attr)
+            else:
+                setattr(owner, attr, method)
+        for index, root in enumerate(profile.roots):
+            if root.fragment is not None:
+                _finish(profile, root, () if index == 0 else None)
+
+
+def profile_design(elaboratable, ports, name="top"):
+    """
+    Elaborate `elaboratable` without a platform, prepare it with `ports`
+    and convert it to RTLIL, returning the `ElabProfile` and the RTLIL.
+    """
+    with profiling() as profile:
+        fragment = Fragment.get(elaboratable, None).prepare(ports=ports)
+        text, _ = rtlil.convert_fragment(fragment, name)
+    return profile, text
+
+
+def _node_report(node):
+    return {
+        "name": node.name,
+        "class": node.kind,
+        "elaborate_s": node.elapsed,
+        "self_s": node.self_time,
+        "emit_s": node.emit,
+        "statements": node.statements,
+        "signals": node.signals,
+        "children": [_node_report(child) for child in node.children],
+    }
+
+
+def _walk(nodes):
+    for node in nodes:
+        yield node
+        yield from _walk(node.children)
+
+
+def by_class(profile):
+    """
+    Totals for each class elaborated: a dict of class name to a dict with
+    the number of objects, their total self time, statements and signals,
+    ordered from the most time to the least.
+    """
+    totals = {}
+    for node in _walk(profile.roots):
+        total = totals.setdefault(node.kind, {
+            "count": 0, "self_s": 0.0, "statements": 0, "signals": 0})
+        total["count"] += 1
+        total["self_s"] += node.self_time
+        total["statements"] += node.statements
+        total["signals"] += node.signals
+    return dict(sorted(totals.items(), key=lambda item: -item[1]["self_s"]))
+
+
+def report(profile):
+    """A JSON-friendly dict of everything in `profile`."""
+    start = min((start for _, _, start, _ in profile.phases), default=0.0)
+    return {
+        "phases": [{"name": name, "depth": depth, "start_s": begin - start,
+                    "seconds": end - begin}
+                   for depth, name, begin, end in sorted(
+                       profile.phases, key=lambda phase: phase[2])],
+        "tree": [_node_report(root) for root in profile.roots],
+        "classes": by_class(profile),
+        "duplicates": [repr(obj) for obj in profile.duplicates],
+        "unavailable": profile.unavailable,
+    }
+
+
+def write_report(path, profile):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report(profile), f, indent=2)
+
+
+def format_report(profile, min_time=0.0):
+    """
+    Format `profile` for printing, leaving out of the tree any subtree
+    which took less than `min_time` seconds to elaborate. Consecutive
+    calls of the same phase, such as elaborating each I/O buffer, are
+    shown as one line.
+    """
+    merged = []
+    for depth, name, start, end in sorted(profile.phases,
+                                          key=lambda phase: phase[2]):
+        if merged and merged[-1][:2] == [depth, name]:
+            merged[-1][2] += end - start
+            merged[-1][3] += 1
+        else:
+            merged.append([depth, name, end - start, 1])
+    lines = ["  Phases"]
+    for depth, name, seconds, calls in merged:
+        count = f" ({calls} calls)" if calls > 1 else ""
+        lines.append(f"    {'  ' * depth}{name:<{24 - 2 * depth}} "
+                     f"{seconds * 1e3:9.2f} ms{count}")
+
+    rows = []
+
+    def add(node, depth):
+        if node.elapsed < min_time:
+            return
+        label = node.kind if node.name is None else \
+            f"{node.name} ({node.kind})"
+        emit = "" if node.emit is None else f"{node.emit * 1e3:7.2f}ms"
+        rows.append((f"{'  ' * depth}{label}",
+                     f"{node.elapsed * 1e3:7.2f}ms "
+                     f"{node.self_time * 1e3:7.2f}ms {emit:>9} "
+                     f"{node.statements:>6} {node.signals:>7}"))
+        for child in node.children:
+            add(child, depth + 1)
+
+    for root in profile.roots:
+        add(root, 0)
+    classes = by_class(profile)
+    width = max([38] + [len(label) for label, _ in rows]
+                + [len(kind) for kind in classes])
+
+    lines.append(f"  {'Submodules':<{width + 2}} {'total':>9} {'self':>9} "
+                 f"{'emit':>9} {'stmts':>6} {'signals':>7}")
+    lines += [f"    {label:<{width}} {row}" for label, row in rows]
+    lines.append(f"  {'Classes':<{width + 2}} {'count':>9} {'self':>9}")
+    for kind, total in classes.items():
+        lines.append(f"    {kind:<{width}} {total['count']:>9} "
+                     f"{total['self_s'] * 1e3:7.2f}ms")
+    if profile.duplicates:
+        lines.append("  Elaborated more than once")
+        lines += [f"    {obj!r}" for obj in profile.duplicates]
+    if profile.unavailable:
+        lines.append(f"  Not timed with this Amaranth: "
+                     f"{', '.join(profile.unavailable)}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    import copy
+    from amaranth_examples.build_runner import EXAMPLES
+    from amaranth_examples.registry import load, platform
+    from amaranth_examples.reports import report_overrides
+    from amaranth_examples.scaling import KINDS, Replicated
+
+    names = [job.name for job in EXAMPLES]
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("examples", nargs="*", metavar="example",
+                        help=f"any of: {', '.join(names)}")
+    parser.add_argument("--replicated", nargs=3, action="append",
+                        default=[], metavar=("KIND", "N", "WIDTH"),
+                        help="also profile N copies of a core, one of "
+                             f"{', '.join(KINDS)}, as in scaling.py")
+    parser.add_argument("--min-time", type=float, default=0.0,
+                        help="hide submodules faster than this, in ms")
+    parser.add_argument("--build-dir", default="build",
+                        help="root directory for per-example build dirs")
+    args = parser.parse_args(argv)
+    for name in args.examples:
+        if name not in names:
+            parser.error(f"unknown example {name!r}")
+
+    for job in EXAMPLES:
+        if job.name not in args.examples:
+            continue
+        plat = platform(job.platform)()
+        # See build_runner.run_build().
+        plat.resources = copy.deepcopy(plat.resources)
+        top = load(job.top)(**job.top_kwargs)
+        with profiling() as profile:
+            plat.build(top, do_build=False, **report_overrides(job.kwargs))
+        write_report(os.path.join(args.build_dir, job.name,
+                                  "elaboration.json"), profile)
+        print(job.name)
+        print(format_report(profile, args.min_time / 1e3))
+
+    for kind, n, width in args.replicated:
+        top = Replicated(kind, int(n), int(width))
+        profile, _ = profile_design(top, [top.out])
+        name = f"{kind}_n{n}_w{width}"
+        write_report(os.path.join(args.build_dir, name, "elaboration.json"),
+                     profile)
+        print(name)
+        print(format_report(profile, args.min_time / 1e3))
+
+
+def test_elab_profile():
+    from amaranth import Module, Signal
+    from amaranth_examples.counter import Counter
+
+    class Top(Elaboratable):
+        def __init__(self, shared):
+            self.shared = shared
+            self.out = Signal(4)
+
+        def elaborate(self, platform):
+            m = Module()
+            m.submodules.a = a = Counter(10)
+            m.submodules.b = Counter(20)
+            m.submodules.shared = self.shared
+            m.submodules.buf = Instance("BUF", i_a=a.counter, o_y=self.out)
+            return m
+
+    class Outer(Elaboratable):
+        def __init__(self):
+            self.tops = [Top(Counter(5)) for _ in range(2)]
+
+        def elaborate(self, platform):
+            m = Module()
+            m.submodules.top0, m.submodules.top1 = self.tops
+            return m
+
+    originals = [Fragment.__dict__["get"], rtlil._convert_fragment]
+    outer = Outer()
+    profile, text = profile_design(outer, [top.out for top in outer.tops])
+    assert "top0" in text
+    # The patches are gone afterwards.
+    assert [Fragment.__dict__["get"], rtlil._convert_fragment] == originals
+    assert profile.unavailable == []
+
+    [root] = profile.roots
+    assert root.kind == "Outer" and root.name is None
+    assert [child.name for child in root.children] == ["top0", "top1"]
+    top0 = root.children[0]
+    assert [(c.name, c.kind) for c in top0.children] == [
+        ("a", "Counter"), ("b", "Counter"), ("shared", "Counter"),
+        ("buf", "Instance BUF")]
+    counter = top0.children[0]
+    # counter.eq(0) or counter.eq(counter + 1), and rollover.eq(...).
+    assert counter.statements >= 3 and counter.signals == 2
+    assert top0.children[3].signals == 2
+    assert 0 < counter.self_time <= counter.elapsed
+    assert top0.elapsed >= sum(child.elapsed for child in top0.children)
+    assert counter.emit is not None and counter.emit > 0
+    assert profile.duplicates == []
+
+    names = [name for _, name, _, _ in profile.phases]
+    assert names[:1] == ["elaborate"]
+    for name in ["lower samples", "propagate domains", "lower domains",
+                 "propagate ports", "emit RTLIL"]:
+        assert names.count(name) == 1
+
+    classes = by_class(profile)
+    assert classes["Counter"]["count"] == 6
+    assert classes["Outer"]["count"] == 1
+
+    # Phases missing from this Amaranth are left out.
+    saved = list(PHASES)
+    PHASES.extend([("amaranth.hdl.ir:Fragment._gone", "gone"),
+                   ("amaranth.hdl._nowhere:Thing", "nowhere")])
+    try:
+        with profiling() as profile:
+            Fragment.get(Counter(5), None).prepare()
+    finally:
+        PHASES[:] = saved
+    assert profile.unavailable == ["gone", "nowhere"]
+    assert "Not timed with this Amaranth: gone" in format_report(profile)
+
+    # An object added in two places is elaborated twice.
+    shared = Counter(5)
+    with profiling() as profile:
+        Fragment.get(Top(shared), None)
+        Fragment.get(Top(shared), None)
+    assert profile.duplicates == [shared]
+    assert "Elaborated more than once" in format_report(profile)
+    json.dumps(report(profile))
+
+
+def test_elab_profile_build_toolchain():
+    import shutil
+    from amaranth_examples.build_runner import EXAMPLES, run_builds
+
+    root = "build/elab_profile"
+    shutil.rmtree(root, ignore_errors=True)
+    job = next(job for job in EXAMPLES if job.name == "custom_board")
+    [result] = run_builds([job], root=root, profile=True)
+    assert result.ok, open(result.log).read()
+    with open(os.path.join(root, "custom_board", "elaboration.json")) as f:
+        elaboration = json.load(f)
+    assert elaboration["tree"][0]["class"] == "Top"
+    assert "toolchain prepare" in [p["name"] for p in elaboration["phases"]]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Find the fastest PLL output clock at which a design still meets timing.
+
+pll_ice40.py and pll_ecp5.py each ask their PLL for one frequency and only
+find out after place and route whether it was achievable. Here instead we
+build the design at many PLL frequencies and search for the highest one at
+which nextpnr closes timing.
+
+The search is a bisection generalised to several builds at once: each round
+builds `workers` frequencies spread evenly across the interval between the
+highest frequency known to pass and the lowest known to fail, concurrently
+using build_runner.py, and then narrows the interval to the new pair.
+With one worker it is an ordinary bisection. Every frequency is first
+snapped to what the PLL can actually produce (using the solvers in pll.py),
+so no build is wasted on a setting already tried.
+
+Each build gets its own directory under `build/fmax/`, and the result
+includes the PLL settings, metrics and bitstream for the best point:
+
+    python -m amaranth_examples.fmax_search pll_ice40 --min 40 --max 150
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from amaranth_examples.build_runner import BuildJob, run_builds, tail
+from amaranth_examples.build_cache import BuildCache
+from amaranth_examples.pll import solve_ice40, solve_ecp5
+from amaranth_examples.reports import timing_failures
+
+
+class FmaxDesign:
+    """
+    A design whose `top` class takes an `f_out` argument, the frequency to
+    request from a PLL with input frequency `f_in` solved by `solve`.
+    Any `kwargs` are passed through to `platform.build()`.
+    """
+    def __init__(self, name, top, platform, solve, f_in, **kwargs):
+        self.name = name
+        self.top = top
+        self.platform = platform
+        self.solve = solve
+        self.f_in = f_in
+        self.kwargs = kwargs
+
+    def achievable(self, f_out):
+        """The frequency the PLL actually produces when asked for `f_out`."""
+        return self.solve(self.f_in, f_out).f_out
+
+    def job(self, f_out):
+        # Let nextpnr finish even if timing fails, so its report is written
+        # and we can tell a timing failure from any other error.
+        return BuildJob(f"{self.name}_{f_out / 1e6:.3f}MHz", self.top,
+                        self.platform, top_kwargs={"f_out": f_out},
+                        nextpnr_opts=["--timing-allow-fail"], **self.kwargs)
+
+
+DESIGNS = {
+    "pll_ice40": FmaxDesign("pll_ice40", "amaranth_examples.pll_ice40:Top",
+                            "icebreaker", solve_ice40, 12e6),
+    "pll_ecp5": FmaxDesign("pll_ecp5", "amaranth_examples.pll_ecp5:Top",
+                           "ulx3s_12f", solve_ecp5, 25e6, program=False),
+}
+
+
+class FmaxResult:
+    """
+    The outcome of a search: the highest passing frequency `f_out` (None if
+    even the lowest failed) with its PLLConfig, build directory, bitstream
+    and metrics, and `tried`, a list of (frequency, passed, achieved Fmax
+    in MHz) for every build in the order they were run.
+    """
+    def __init__(self, design, f_out, config, build_dir, bitstream, metrics,
+                 tried):
+        self.design = design
+        self.f_out = f_out
+        self.config = config
+        self.build_dir = build_dir
+        self.bitstream = bitstream
+        self.metrics = metrics
+        self.tried = tried
+
+
+def bitstream(build_dir, name="top"):
+    """The path to the bitstream in `build_dir`, for iCE40 or ECP5."""
+    for ext in ("bin", "bit"):
+        path = os.path.join(build_dir, f"{name}.{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def spread(lo, hi, n):
+    """`n` frequencies evenly spaced strictly between `lo` and `hi`."""
+    return [lo + (hi - lo) * i / (n + 1) for i in range(1, n + 1)]
+
+
+def sync_clock(metrics):
+    """
+    The metrics of the clock driving the sync domain, which is the one the
+    PLL generates, from a build's `metrics` possibly listing other clocks.
+    """
+    clocks = [clock for clock in metrics["clocks"].values()
+              if clock["domain"] == "sync"]
+    if len(clocks) != 1:
+        raise RuntimeError(f"{metrics['design']}: expected one sync clock, "
+                           f"found {sorted(metrics['clocks'])}")
+    return clocks[0]
+
+
+def search_fmax(design, f_min, f_max, *, resolution=1e6, workers=None,
+                root="build/fmax", cache=None):
+    """
+    Search for the highest PLL frequency between `f_min` and `f_max` Hz at
+    which `design` meets timing, to within `resolution` Hz, running up to
+    `workers` builds at once (by default, one per CPU). Returns an
+    FmaxResult.
+    """
+    workers = workers or os.cpu_count()
+    # Invariant: everything at or below `lo` is assumed to pass, and
+    # everything at or above `hi` to fail, until a build says otherwise.
+    lo = design.achievable(f_min)
+    hi = design.achievable(f_max)
+    tried = {}
+    results = {}
+
+    candidates = spread(lo, hi, workers - 1) + [hi]
+    while candidates:
+        freqs = sorted({design.achievable(f) for f in candidates} - set(tried))
+        if not freqs:
+            break
+        jobs = [design.job(f) for f in freqs]
+        for f, result in zip(freqs, run_builds(jobs, root, workers, cache)):
+            if result.metrics is None:
+                raise RuntimeError(f"{result.name} failed, end of "
+                                   f"{result.log}:\n{tail(result.log)}")
+            passed = not timing_failures(result.metrics)
+            achieved = sync_clock(result.metrics)["achieved_mhz"]
+            tried[f] = (passed, achieved)
+            results[f] = result
+
+        # Builds are noisy, so a frequency can pass above one that failed;
+        # trust the highest pass, and the lowest failure above it.
+        passes = [f for f, (passed, _) in tried.items() if passed]
+        if passes:
+            lo = max(passes)
+        fails = [f for f, (passed, _) in tried.items() if not passed and
+                 f > lo]
+        hi = min(fails) if fails else hi
+        if hi in tried and tried[hi][0]:
+            break
+        if hi - lo <= resolution:
+            # Make sure the answer has really been built.
+            candidates = [] if lo in tried else [lo]
+        else:
+            candidates = spread(lo, hi, workers)
+
+    order = [(f, *tried[f]) for f in tried]
+    passes = [f for f, (passed, _) in tried.items() if passed]
+    if not passes:
+        return FmaxResult(design.name, None, None, None, None, None, order)
+    best = max(passes)
+    result = results[best]
+    return FmaxResult(design.name, best, design.solve(design.f_in, best),
+                      result.build_dir, bitstream(result.build_dir),
+                      result.metrics, order)
+
+
+def format_result(result):
+    lines = []
+    for f, passed, achieved in sorted(result.tried):
+        status = "pass" if passed else "FAIL"
+        lines.append(f"  {f / 1e6:9.3f} MHz  {status}  (nextpnr Fmax "
+                     f"{achieved:.2f} MHz)")
+    if result.f_out is None:
+        lines.append(f"{result.design}: no frequency tried met timing")
+    else:
+        lines.append(f"{result.design}: highest passing frequency "
+                     f"{result.f_out / 1e6:.3f} MHz after "
+                     f"{len(result.tried)} builds")
+        lines.append(f"  PLL: {result.config}")
+        lines.append(f"  bitstream: {result.bitstream}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("design", choices=DESIGNS)
+    parser.add_argument("--min", type=float, default=20,
+                        help="lowest frequency to try in MHz")
+    parser.add_argument("--max", type=float, default=200,
+                        help="highest frequency to try in MHz")
+    parser.add_argument("--resolution", type=float, default=1,
+                        help="stop when the answer is within this many MHz")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of parallel builds (default: CPUs)")
+    parser.add_argument("--build-dir", default="build/fmax",
+                        help="root directory for per-frequency build dirs")
+    parser.add_argument("--cache", action="store_true",
+                        help="reuse products of identical earlier builds")
+    args = parser.parse_args(argv)
+
+    cache = BuildCache() if args.cache else None
+    start = time.perf_counter()
+    result = search_fmax(DESIGNS[args.design], args.min * 1e6,
+                         args.max * 1e6, resolution=args.resolution * 1e6,
+                         workers=args.jobs, root=args.build_dir, cache=cache)
+    print(format_result(result))
+    print(f"Search took {time.perf_counter() - start:.1f}s")
+    return 0 if result.f_out is not None else 1
+
+
+def test_sync_clock():
+    import pytest
+
+    metrics = {"design": "test", "clocks": {
+        "clk12_0__io": {"domain": None, "achieved_mhz": 300.0},
+        "cd_sync_clk": {"domain": "sync", "achieved_mhz": 120.0},
+        "fast_clk": {"domain": "fast", "achieved_mhz": 90.0},
+    }}
+    assert sync_clock(metrics)["achieved_mhz"] == 120.0
+    del metrics["clocks"]["cd_sync_clk"]
+    with pytest.raises(RuntimeError, match="expected one sync clock"):
+        sync_clock(metrics)
+
+
+def test_fmax_search_toolchain():
+    # A coarse search over a wide range, to keep the number of builds down.
+    result = search_fmax(DESIGNS["pll_ice40"], 40e6, 200e6,
+                         resolution=10e6, workers=2)
+    print(format_result(result))
+    assert result.f_out is not None
+    assert os.path.exists(result.bitstream)
+    passes = [f for f, passed, _ in result.tried if passed]
+    fails = [f for f, passed, _ in result.tried if not passed]
+    assert result.f_out == max(passes)
+    # The answer must be pinned down by a failure within the resolution.
+    assert min(f for f in fails if f > result.f_out) - result.f_out <= 10e6
+
+
+if __name__ == "__main__":
+    sys.exit(main())
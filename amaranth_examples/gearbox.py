@@ -0,0 +1,423 @@
+"""
+Move wide words across several pins at many bits per fabric clock cycle.
+
+ddr.py uses `xdr=2` to send two bits per clock cycle on one pin. The ECP5's
+I/O gearboxes go further: with `xdr=4` (ODDRX2F/IDDRX2F) or `xdr=7`
+(ODDR71B/IDDR71B, as used for video links) each pin carries 4 or 7 bits
+per cycle of the fabric's `sync` clock, shifted out by a faster edge clock
+`eclk` running at half the bit rate. So a link's bandwidth is set by how
+fast the I/O can toggle, rather than by how fast the fabric logic can run.
+
+GearboxTX takes a word of `lanes * xdr` bits each `sync` cycle that `valid`
+is high, lane `n` sending bits `data[n * xdr:(n + 1) * xdr]` with the
+lowest bit first, and sends an all-zero idle word on the other cycles;
+GearboxRX does the reverse. GearboxClocks makes the `sync` and `eclk`
+domains from a PLL, an ECLKSYNCB and a CLKDIVF dividing by 2 or 3.5.
+
+When elaborated without a platform (that is, in simulation), the vendor
+primitives are replaced by a model of their gearing: Serializer and
+Deserializer shift bits through a `bit` domain at the full bit rate, so
+the serial `pins` of a GearboxTX can be looped back into a GearboxRX.
+`measure_throughput()` does that with a source which is idle on some
+cycles, finds the receive word alignment (which real hardware would find
+by bit-slipping), and counts how many bits of data per `sync` cycle each
+lane delivers intact:
+
+    python -m amaranth_examples.gearbox --lanes 4 --xdr 7 --idle 0.25
+"""
+
+import argparse
+import random
+
+from amaranth import Signal, Module, Elaboratable, Instance, ClockDomain
+from amaranth import ClockSignal, Cat, Const, Mux
+from amaranth.build import Resource, Pins, Attrs
+from amaranth.sim import Simulator
+
+from amaranth_examples.ddr import CustomPlatform
+from amaranth_examples.pll import ECP5PLL
+
+
+XDRS = (2, 4, 7)
+
+
+# CLKDIVF divides the edge clock down to the fabric clock: each edge clock
+# cycle carries two bits, so for xdr=4 it's 2.0 and for xdr=7 it's 3.5.
+CLKDIVF_DIV = {4: "2.0", 7: "3.5"}
+
+
+class GearboxPlatform(CustomPlatform):
+    """
+    The custom ECP5 board from ddr.py, with four lanes of gearbox inputs
+    and outputs in bank 7 on the left-hand side, which has the edge clocks
+    the X2 and 7:1 gearboxes need. Those gearboxes can only be used at the
+    A and C sites of each group of four pins.
+    """
+    resources = CustomPlatform.resources + [
+        Resource("lanes_in", 0, Pins("C4 A3 E4 C3", dir="i"),
+                 Attrs(IO_TYPE="LVCMOS33")),
+        Resource("lanes_out", 0, Pins("F4 E5 H4 H5", dir="o"),
+                 Attrs(IO_TYPE="LVCMOS33")),
+        Resource("led", 0, Pins("E16", dir="o")),
+    ]
+
+
+def _check_xdr(xdr):
+    if xdr not in XDRS:
+        raise ValueError(f"xdr must be one of {XDRS}, not {xdr}")
+
+
+class Serializer(Elaboratable):
+    """
+    A model of one lane of an output gearbox: each cycle of `domain`, the
+    `xdr` bits of `data` are loaded and then shifted out of `q`, lowest
+    bit first, one per cycle of `bit_domain`, which must run exactly `xdr`
+    times faster with its edges aligned.
+    """
+    def __init__(self, xdr, *, domain="sync", bit_domain="bit"):
+        self.xdr = xdr
+        self.domain = domain
+        self.bit_domain = bit_domain
+        self.data = Signal(xdr)
+        self.q = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+        bit = m.d[self.bit_domain]
+
+        # Which bit of the word is on the pin, counting from when a word
+        # is loaded at the `domain` clock edge.
+        index = Signal(range(self.xdr))
+        shift = Signal(self.xdr)
+        bit += index.eq(Mux(index == self.xdr - 1, 0, index + 1))
+        with m.If(index == self.xdr - 1):
+            bit += shift.eq(self.data)
+        with m.Else():
+            bit += shift.eq(shift[1:])
+        m.d.comb += self.q.eq(shift[0])
+
+        return m
+
+
+class Deserializer(Elaboratable):
+    """
+    A model of one lane of an input gearbox: `d` is sampled once per cycle
+    of `bit_domain`, and every `xdr` bits the word received (first bit
+    lowest) is presented on `data` for the next cycle of `domain`.
+    """
+    def __init__(self, xdr, *, domain="sync", bit_domain="bit"):
+        self.xdr = xdr
+        self.domain = domain
+        self.bit_domain = bit_domain
+        self.d = Signal()
+        self.data = Signal(xdr)
+
+    def elaborate(self, platform):
+        m = Module()
+        bit = m.d[self.bit_domain]
+
+        index = Signal(range(self.xdr))
+        shift = Signal(self.xdr)
+        word = Signal(self.xdr)
+        bit += index.eq(Mux(index == self.xdr - 1, 0, index + 1))
+        bit += shift.eq(Cat(shift[1:], self.d))
+        with m.If(index == self.xdr - 1):
+            bit += word.eq(Cat(shift[1:], self.d))
+        m.d[self.domain] += self.data.eq(word)
+
+        return m
+
+
+class GearboxTX(Elaboratable):
+    """
+    Sends `data`, `lanes * xdr` bits per `sync` cycle in which `valid` is
+    high, or zeros when it's low, on `lanes` pins of the platform resource
+    `resource`, or in simulation on `pins`.
+    """
+    def __init__(self, lanes, xdr, resource=("lanes_out", 0)):
+        _check_xdr(xdr)
+        self.lanes = lanes
+        self.xdr = xdr
+        self.resource = resource
+        self.data = Signal(lanes * xdr)
+        self.valid = Signal()
+        self.pins = Signal(lanes)
+
+    def elaborate(self, platform):
+        m = Module()
+        data = Signal.like(self.data)
+        m.d.comb += data.eq(Mux(self.valid, self.data, 0))
+        words = [data[n * self.xdr:(n + 1) * self.xdr]
+                 for n in range(self.lanes)]
+
+        if platform is None:
+            for n, word in enumerate(words):
+                lane = m.submodules[f"lane{n}"] = Serializer(self.xdr)
+                m.d.comb += [lane.data.eq(word), self.pins[n].eq(lane.q)]
+            return m
+
+        pins = platform.request(*self.resource, xdr=self.xdr)
+        m.d.comb += pins.o_clk.eq(ClockSignal("sync"))
+        if self.xdr > 2:
+            m.d.comb += pins.o_fclk.eq(ClockSignal("eclk"))
+        for k in range(self.xdr):
+            m.d.comb += getattr(pins, f"o{k}").eq(
+                Cat(word[k] for word in words))
+
+        return m
+
+
+class GearboxRX(Elaboratable):
+    """
+    Receives `data`, `lanes * xdr` bits per `sync` cycle, from `lanes` pins
+    of the platform resource `resource`, or in simulation from `pins`.
+    """
+    def __init__(self, lanes, xdr, resource=("lanes_in", 0)):
+        _check_xdr(xdr)
+        self.lanes = lanes
+        self.xdr = xdr
+        self.resource = resource
+        self.data = Signal(lanes * xdr)
+        self.pins = Signal(lanes)
+
+    def elaborate(self, platform):
+        m = Module()
+        words = [self.data[n * self.xdr:(n + 1) * self.xdr]
+                 for n in range(self.lanes)]
+
+        if platform is None:
+            for n, word in enumerate(words):
+                lane = m.submodules[f"lane{n}"] = Deserializer(self.xdr)
+                m.d.comb += [lane.d.eq(self.pins[n]), word.eq(lane.data)]
+            return m
+
+        pins = platform.request(*self.resource, xdr=self.xdr)
+        m.d.comb += pins.i_clk.eq(ClockSignal("sync"))
+        if self.xdr > 2:
+            m.d.comb += pins.i_fclk.eq(ClockSignal("eclk"))
+        for k in range(self.xdr):
+            for n, word in enumerate(words):
+                m.d.comb += word[k].eq(getattr(pins, f"i{k}")[n])
+
+        return m
+
+
+class GearboxClocks(Elaboratable):
+    """
+    Creates the `sync` domain at `f_sync` Hz and, for `xdr` of 4 or 7, the
+    `eclk` edge clock at half the bit rate, from `clk_in` at `f_in` Hz.
+    """
+    def __init__(self, clk_in, f_in, f_sync, xdr):
+        _check_xdr(xdr)
+        self.xdr = xdr
+        self.pll = ECP5PLL(clk_in, f_in, f_sync * xdr / 2 if xdr > 2
+                           else f_sync)
+
+    @property
+    def f_sync(self):
+        return self.pll.config.f_out * 2 / self.xdr if self.xdr > 2 \
+            else self.pll.config.f_out
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.pll = self.pll
+        m.domains.sync = cd_sync = ClockDomain("sync")
+
+        if self.xdr == 2:
+            m.d.comb += cd_sync.clk.eq(self.pll.clk_out)
+            return m
+
+        m.domains.eclk = cd_eclk = ClockDomain("eclk", reset_less=True)
+        m.submodules.eclksync = Instance(
+            "ECLKSYNCB",
+            i_ECLKI=self.pll.clk_out,
+            i_STOP=Const(0),
+            o_ECLKO=cd_eclk.clk,
+        )
+        m.submodules.clkdiv = Instance(
+            "CLKDIVF",
+            p_DIV=CLKDIVF_DIV[self.xdr],
+            i_CLKI=cd_eclk.clk,
+            i_RST=Const(0),
+            i_ALIGNWD=Const(0),
+            o_CDIVX=cd_sync.clk,
+        )
+        m.d.comb += cd_sync.rst.eq(~self.pll.locked)
+        if platform is not None:
+            platform.add_clock_constraint(cd_sync.clk, self.f_sync)
+
+        return m
+
+
+class Top(Elaboratable):
+    """
+    Sends a pseudo-random word every cycle out of GearboxPlatform's four
+    output lanes at `xdr` bits per lane per cycle of a `f_sync` Hz fabric
+    clock, and folds whatever arrives on the four input lanes into an LED.
+    """
+    def __init__(self, xdr=7, lanes=4, f_sync=50e6):
+        self.xdr = xdr
+        self.lanes = lanes
+        self.f_sync = f_sync
+
+    def elaborate(self, platform):
+        m = Module()
+        clk = platform.request("clk", 0).i
+        m.submodules.clocks = GearboxClocks(clk, 20e6, self.f_sync, self.xdr)
+        tx = m.submodules.tx = GearboxTX(self.lanes, self.xdr)
+        rx = m.submodules.rx = GearboxRX(self.lanes, self.xdr)
+
+        width = self.lanes * self.xdr
+        lfsr = Signal(32, reset=1)
+        m.d.sync += lfsr.eq(Cat(lfsr[1:], lfsr[0] ^ lfsr[1] ^ lfsr[21] ^
+                                lfsr[31]))
+        m.d.comb += tx.data.eq(Cat(lfsr, lfsr)[:width]), tx.valid.eq(1)
+
+        signature = Signal(width)
+        m.d.sync += signature.eq(Cat(signature[1:], signature[0]) ^ rx.data)
+        m.d.comb += platform.request("led", 0).o.eq(signature.xor())
+
+        return m
+
+
+class _Loopback(Elaboratable):
+    def __init__(self, lanes, xdr):
+        self.tx = GearboxTX(lanes, xdr)
+        self.rx = GearboxRX(lanes, xdr)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.tx = self.tx
+        m.submodules.rx = self.rx
+        m.d.comb += self.rx.pins.eq(self.tx.pins)
+        return m
+
+
+def lane_bits(words, lane, xdr):
+    """The bits sent or received on `lane`, in order, from a list of words."""
+    bits = []
+    for word in words:
+        bits += [(word >> (lane * xdr + k)) & 1 for k in range(xdr)]
+    return bits
+
+
+def measure_throughput(lanes, xdr, cycles=200, *, idle=0.0, seed=0,
+                       training=8):
+    """
+    Simulate a GearboxTX looped back into a GearboxRX for `cycles` `sync`
+    cycles of random words from a source which, after `training` cycles,
+    is idle on each cycle with probability `idle`.
+
+    Returns (latency in bits, list of each lane's bits of data per `sync`
+    cycle which arrived intact once aligned, and the bits per cycle the
+    source offered each lane). Counting stops at the first word which
+    arrived wrong, including an idle cycle which didn't arrive as zeros.
+    """
+    _check_xdr(xdr)
+    dut = _Loopback(lanes, xdr)
+    rng = random.Random(seed)
+    sent = [rng.getrandbits(lanes * xdr) for _ in range(cycles)]
+    valid = [i < training or rng.random() >= idle for i in range(cycles)]
+    received = []
+
+    # The bit clock's first edge is lined up with the first `sync` edge.
+    bit_period = 1e-9
+    sim = Simulator(dut)
+    sim.add_clock(bit_period, domain="bit")
+    sim.add_clock(xdr * bit_period, domain="sync",
+                  phase=bit_period * (1 - xdr) / 2)
+
+    def testbench():
+        for word, word_valid in zip(sent, valid):
+            yield dut.tx.data.eq(word)
+            yield dut.tx.valid.eq(word_valid)
+            yield
+            received.append((yield dut.rx.data))
+
+    sim.add_sync_process(testbench)
+    sim.run()
+
+    # Find the alignment from lane 0 during training, which must then hold
+    # for every lane, and count the bits of data after it that arrived
+    # intact.
+    tx_bits = lane_bits(sent, 0, xdr)
+    rx_bits = lane_bits(received, 0, xdr)
+    window = min(4, training) * xdr
+    for latency in range(len(rx_bits) - window):
+        if rx_bits[latency:latency + window] == tx_bits[:window]:
+            break
+    else:
+        raise AssertionError("Receiver never saw the transmitted data")
+    expected = [word if word_valid else 0
+                for word, word_valid in zip(sent, valid)]
+    n_words = (len(rx_bits) - latency) // xdr
+    offered = sum(valid[:n_words]) * xdr / n_words
+    rates = []
+    for lane in range(lanes):
+        tx_bits = lane_bits(expected, lane, xdr)
+        rx_bits = lane_bits(received, lane, xdr)[latency:]
+        intact = 0
+        for i in range(n_words):
+            word = slice(i * xdr, (i + 1) * xdr)
+            if tx_bits[word] != rx_bits[word]:
+                break
+            intact += xdr if valid[i] else 0
+        rates.append(intact / n_words)
+    return latency, rates, offered
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lanes", type=int, default=4)
+    parser.add_argument("--xdr", type=int, nargs="+", default=list(XDRS),
+                        choices=XDRS)
+    parser.add_argument("--cycles", type=int, default=500)
+    parser.add_argument("--idle", type=float, default=0.0,
+                        help="probability of the source being idle")
+    parser.add_argument("--f-sync", type=float, default=50,
+                        help="fabric clock in MHz, for the link bandwidth")
+    args = parser.parse_args(argv)
+    for xdr in args.xdr:
+        latency, rates, _ = measure_throughput(args.lanes, xdr, args.cycles,
+                                               idle=args.idle)
+        per_lane = ", ".join(f"{rate:.2f}" for rate in rates)
+        total = sum(rates) * args.f_sync
+        print(f"xdr={xdr}: {per_lane} bits/cycle per lane, latency "
+              f"{latency} bits; {total:.0f} Mbit/s over {args.lanes} lanes "
+              f"at {args.f_sync:g} MHz")
+
+
+def test_gearbox_loopback():
+    for xdr in XDRS:
+        for lanes in (1, 4):
+            latency, rates, offered = measure_throughput(lanes, xdr,
+                                                         cycles=100)
+            # Once aligned, every lane delivers all xdr bits every cycle,
+            # and whole words arrive two cycles after they were sent.
+            assert offered == xdr
+            assert rates == [xdr] * lanes, (xdr, lanes, rates)
+            assert latency == 2 * xdr
+
+            # With a quarter of the cycles idle, every word of data still
+            # gets through, and every idle cycle arrives as zeros.
+            latency, rates, offered = measure_throughput(
+                lanes, xdr, cycles=100, idle=0.25)
+            assert 0.6 * xdr < offered < 0.9 * xdr
+            assert rates == [offered] * lanes, (xdr, lanes, rates)
+            assert latency == 2 * xdr
+
+
+def test_gearbox_elaborates():
+    from amaranth.hdl.ir import Fragment
+
+    for xdr in XDRS:
+        Fragment.get(Top(xdr=xdr), GearboxPlatform()).prepare()
+
+
+def test_gearbox_build_toolchain():
+    for xdr in XDRS:
+        GearboxPlatform().build(Top(xdr=xdr), build_dir=f"build/gearbox{xdr}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,6 @@ an external Verilog file which we'll include in the build.
 """
 
 from amaranth import Module, Signal, Elaboratable, Instance, ClockSignal
-from amaranth_boards.icebreaker import ICEBreakerPlatform
 
 
 class Top(Elaboratable):
@@ -56,11 +55,13 @@ class Top(Elaboratable):
         return m
 
 
-def test_instance():
+def test_instance_toolchain():
+    from amaranth_boards.icebreaker import ICEBreakerPlatform
+
     top = Top()
     plat = ICEBreakerPlatform()
     plat.build(top)
 
 
 if __name__ == "__main__":
-    test_instance()
+    test_instance_toolchain()
@@ -0,0 +1,352 @@
+"""
+Place and route one synthesised netlist with several nextpnr seeds at once.
+
+Whether a design closes timing can vary a lot with nextpnr's placement
+seed. Amaranth's build script runs Yosys, nextpnr and the bitstream packer
+one after another, so here we split it into those three stages: synthesis
+runs once, then nextpnr runs with each seed in parallel, each in its own
+`seeds/<seed>/` subdirectory sharing the same netlist, and only the best
+result is copied back and packed into a bitstream.
+
+Each run is allowed to miss timing, so every seed reports its slack and
+Fmax. The best run is the one with the largest worst-case slack across all
+its clocks, even if that is negative. Alternatively, with `until_pass`,
+the first run to meet every constraint wins and any runs still going are
+stopped. Either way, the
+achieved Fmax of every seed is recorded, to show how much it varies.
+
+build_runner.py uses this when given `--seeds`:
+
+    python -m amaranth_examples.build_runner --seeds 8 pll_ice40
+"""
+
+import os
+import re
+import shutil
+import signal
+import subprocess
+import time
+
+from amaranth_examples.reports import collect_metrics, timing_failures
+
+
+# Which stage of the build each tool in an Amaranth build script runs.
+TOOL_STAGES = {
+    "YOSYS": "synth",
+    "NEXTPNR_ICE40": "pnr",
+    "NEXTPNR_ECP5": "pnr",
+    "ICEPACK": "pack",
+    "ECPPACK": "pack",
+}
+
+
+def split_script(text):
+    """
+    Split the text of an Amaranth build script into its prelude, which sets
+    up the environment, and a dict of stage name to the command running it.
+    """
+    prelude = []
+    stages = {}
+    for line in text.splitlines():
+        match = re.match(r'^"\$(\w+)"', line)
+        if match is None:
+            prelude.append(line)
+        elif match.group(1) in TOOL_STAGES:
+            stages[TOOL_STAGES[match.group(1)]] = line
+        else:
+            raise ValueError(f"Unknown tool {match.group(1)} in build script")
+    if set(stages) != {"synth", "pnr", "pack"}:
+        raise ValueError("Build script does not have separate synthesis, "
+                         "place and route, and packing steps")
+    return "\n".join(prelude), stages
+
+
+def worst_slack(metrics):
+    """The smallest slack in ns across all constrained clocks, or None."""
+    slacks = [clock["slack_ns"] for clock in metrics["clocks"].values()
+              if clock["slack_ns"] is not None]
+    return min(slacks) if slacks else None
+
+
+class SeedRun:
+    """One nextpnr run: its seed, directory, metrics and how it went."""
+    def __init__(self, seed, directory):
+        self.seed = seed
+        self.directory = directory
+        self.process = None
+        self.start = None
+        self.ok = False
+        self.stopped = False
+        self.metrics = None
+        self.elapsed = None
+
+    @property
+    def passed(self):
+        return self.ok and not timing_failures(self.metrics)
+
+    def summary(self):
+        clocks = {}
+        if self.metrics is not None:
+            clocks = {net: clock["achieved_mhz"]
+                      for net, clock in self.metrics["clocks"].items()}
+        return {
+            "seed": self.seed,
+            "ok": self.ok,
+            "stopped": self.stopped,
+            "passed": self.passed,
+            "worst_slack_ns": worst_slack(self.metrics) if self.ok else None,
+            "achieved_mhz": clocks,
+            "elapsed": self.elapsed,
+        }
+
+
+def stop(process):
+    """Stop `process`, started in a new session, and all its children."""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def run_stage(directory, prelude, command, script, log):
+    path = os.path.join(directory, script)
+    with open(path, "w") as f:
+        f.write(f"{prelude}\n{command}\n")
+    subprocess.run(["sh", script], cwd=directory, stdout=log,
+                   stderr=subprocess.STDOUT, check=True)
+
+
+def run_seeds(build_dir, plan, seeds, *, workers=None, until_pass=False,
+              log=None, design=None):
+    """
+    Build `plan`, already written to `build_dir`, running place and route
+    once for each seed in `seeds` with up to `workers` (by default, one per
+    CPU) at a time. Returns (best SeedRun, list of all SeedRuns); the best
+    run's outputs are packed into a bitstream in `build_dir`.
+    """
+    workers = workers or os.cpu_count()
+    name = plan.script.removeprefix("build_")
+    with open(os.path.join(build_dir, f"{plan.script}.sh")) as f:
+        prelude, stages = split_script(f.read())
+    run_stage(build_dir, prelude, stages["synth"], f"{plan.script}_synth.sh",
+              log)
+
+    # Every seed directory gets the plan's files and the netlist, so
+    # anything else in it after place and route is an output. These are
+    # hard links rather than symlinks, as the YoWASP tools are sandboxed
+    # to their working directory and can't follow links out of it.
+    inputs = [*plan.files, f"{name}.json"]
+    runs = []
+    for seed in seeds:
+        directory = os.path.join(build_dir, "seeds", str(seed))
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        for filename in inputs:
+            source = os.path.join(build_dir, filename)
+            target = os.path.join(directory, filename)
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy(source, target)
+        runs.append(SeedRun(seed, directory))
+
+    # A seed which misses timing should still write its report, so it can
+    # be compared with the others.
+    pnr = stages["pnr"]
+    if "--timing-allow-fail" not in pnr.split():
+        pnr += " --timing-allow-fail"
+
+    pending = list(runs)
+    running = []
+    found = None
+    while pending or running:
+        while pending and len(running) < workers and found is None:
+            run = pending.pop(0)
+            script = os.path.join(run.directory, "pnr.sh")
+            with open(script, "w") as f:
+                f.write(f"{prelude}\n{pnr} --seed {run.seed}\n")
+            # In a session of its own, so that stopping it can stop nextpnr
+            # and anything else the script started too.
+            with open(os.path.join(run.directory, "pnr.log"), "w") as out:
+                run.process = subprocess.Popen(
+                    ["sh", "pnr.sh"], cwd=run.directory, stdout=out,
+                    stderr=subprocess.STDOUT, start_new_session=True)
+            run.start = time.perf_counter()
+            running.append(run)
+        time.sleep(0.05)
+        for run in list(running):
+            if run.process.poll() is None:
+                continue
+            running.remove(run)
+            run.elapsed = time.perf_counter() - run.start
+            if run.process.returncode == 0:
+                run.metrics = collect_metrics(
+                    run.directory, f"{design} seed {run.seed}", name)
+                run.ok = run.metrics is not None
+            if log is not None:
+                status = "passed" if run.passed else \
+                    "failed timing" if run.ok else "failed"
+                log.write(f"Seed {run.seed} {status} in "
+                          f"{run.elapsed:.2f}s\n")
+                log.flush()
+            if until_pass and run.passed and found is None:
+                found = run
+                for other in running:
+                    stop(other.process)
+                    other.stopped = True
+        if found is not None:
+            for run in pending:
+                run.stopped = True
+            pending = []
+
+    finished = [run for run in runs if run.ok]
+    if not finished:
+        raise RuntimeError("Place and route failed for every seed")
+    if found is not None:
+        best = found
+    else:
+        best = max(finished, key=lambda run: (
+            worst_slack(run.metrics) is not None,
+            worst_slack(run.metrics) or 0, -run.seed))
+
+    # Bring the best run's outputs back and pack them.
+    for filename in os.listdir(best.directory):
+        path = os.path.join(best.directory, filename)
+        if filename not in inputs and filename not in ("pnr.sh", "pnr.log"):
+            shutil.copy(path, os.path.join(build_dir, filename))
+    run_stage(build_dir, prelude, stages["pack"], f"{plan.script}_pack.sh",
+              log)
+    return best, runs
+
+
+def seed_summary(best, runs):
+    """A record of a seed sweep, for adding to a build's metrics."""
+    spread = {}
+    for run in runs:
+        if run.ok:
+            for net, clock in run.metrics["clocks"].items():
+                spread.setdefault(net, []).append(clock["achieved_mhz"])
+    return {
+        "best": best.seed,
+        "runs": [run.summary() for run in runs],
+        "fmax_spread_mhz": {
+            net: {"min": min(fs), "max": max(fs), "mean": sum(fs) / len(fs)}
+            for net, fs in spread.items()
+        },
+    }
+
+
+def test_split_script():
+    prelude, stages = split_script(
+        '# Automatically generated\n'
+        'set -e\n'
+        ': ${YOSYS:=yosys}\n'
+        '"$YOSYS" -q -l top.rpt top.ys\n'
+        '"$NEXTPNR_ICE40" --quiet --json top.json --asc top.asc\n'
+        '"$ICEPACK" top.asc top.bin\n')
+    assert prelude == "# Automatically generated\nset -e\n: ${YOSYS:=yosys}"
+    assert stages["pnr"].startswith('"$NEXTPNR_ICE40"')
+    assert stages["pack"] == '"$ICEPACK" top.asc top.bin'
+
+
+def _fake_build(tmp, nextpnr):
+    """
+    Write a build script into `tmp/build` running stand-ins for the tools,
+    with `nextpnr` as the body of the nextpnr script, in which `$seed` is
+    the seed. Like the real nextpnr, it fails if timing isn't allowed to.
+    Returns (build directory, plan).
+    """
+    import types
+
+    tools = {
+        "yosys": "echo {} > top.json",
+        "nextpnr": 'case " $* " in *" --timing-allow-fail "*) ;; '
+                   '*) exit 1 ;; esac\neval seed=\\${$#}\n' + nextpnr,
+        "icepack": "touch top.bin",
+    }
+    for tool, text in tools.items():
+        with open(os.path.join(tmp, tool), "w") as f:
+            f.write(f"#!/bin/sh\n{text}\n")
+        os.chmod(os.path.join(tmp, tool), 0o755)
+    build_dir = os.path.join(tmp, "build")
+    os.makedirs(build_dir)
+    with open(os.path.join(build_dir, "build_top.sh"), "w") as f:
+        f.write(f"YOSYS={tmp}/yosys\nNEXTPNR_ICE40={tmp}/nextpnr\n"
+                f"ICEPACK={tmp}/icepack\n"
+                '"$YOSYS"\n"$NEXTPNR_ICE40"\n"$ICEPACK"\n')
+    return build_dir, types.SimpleNamespace(script="build_top", files={})
+
+
+def test_until_pass_stops_seeds():
+    import tempfile
+
+    def alive(pid):
+        # Stopped processes may linger as zombies if nothing reaps them.
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+        except FileNotFoundError:
+            return False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Seed 1 passes after a second, and every other seed starts a
+        # child of its own and waits on it forever.
+        build_dir, plan = _fake_build(
+            tmp, 'if [ $seed = 1 ]; then sleep 1; echo \'{"fmax": {"clk": '
+                 '{"achieved": 100, "constraint": 50}}}\' > top.report.json;'
+                 ' else sleep 60 & echo $! > child.pid; wait; fi')
+        best, runs = run_seeds(build_dir, plan, [1, 2, 3], workers=3,
+                               until_pass=True, design="test")
+        assert best.seed == 1
+        assert [run.stopped for run in runs] == [False, True, True]
+        for run in runs[1:]:
+            with open(os.path.join(run.directory, "child.pid")) as f:
+                assert not alive(int(f.read()))
+        assert os.path.exists(os.path.join(build_dir, "top.bin"))
+
+
+def test_all_seeds_miss_timing():
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Every seed misses a 20ns constraint, seed n by 5 - n ns.
+        build_dir, plan = _fake_build(
+            tmp, 'echo "{\\"fmax\\": {\\"clk\\": {\\"achieved\\": '
+                 '$((40 + seed)), \\"constraint\\": 50}}, '
+                 '\\"critical_paths\\": [{\\"from\\": \\"posedge '
+                 'clk\\", \\"to\\": \\"posedge clk\\", \\"path\\": '
+                 '[{\\"delay\\": $((25 - seed))}]}]}" > top.report.json')
+        best, runs = run_seeds(build_dir, plan, [1, 2, 3], workers=3,
+                               until_pass=True, design="test")
+
+        # No seed passed, but they all finished, and the one which missed
+        # by the least is kept.
+        assert best.seed == 3
+        summary = seed_summary(best, runs)
+        assert [(run["ok"], run["passed"], run["worst_slack_ns"])
+                for run in summary["runs"]] == [
+            (True, False, -4.0), (True, False, -3.0), (True, False, -2.0)]
+        assert summary["fmax_spread_mhz"]["clk"] == {
+            "min": 41, "max": 43, "mean": 42}
+        assert os.path.exists(os.path.join(build_dir, "top.bin"))
+
+
+def test_multi_seed_toolchain():
+    from amaranth_examples.build_runner import EXAMPLES, run_builds
+
+    job = next(job for job in EXAMPLES if job.name == "custom_board")
+    [result] = run_builds([job], root="build/multi_seed", seeds=range(1, 4))
+    assert result.ok, open(result.log).read()
+
+    seeds = result.metrics["seeds"]
+    assert [run["seed"] for run in seeds["runs"]] == [1, 2, 3]
+    best = max(seeds["runs"], key=lambda run: run["worst_slack_ns"])
+    assert seeds["best"] == best["seed"]
+    spread = seeds["fmax_spread_mhz"]
+    print(f"Fmax by seed: {spread}")
+    # Synthesis only ran once, in the top-level build directory.
+    for run in seeds["runs"]:
+        directory = os.path.join(result.build_dir, "seeds", str(run["seed"]))
+        assert not os.path.exists(os.path.join(directory, "top.rpt"))
+    assert os.path.exists(os.path.join(result.build_dir, "top.bin"))
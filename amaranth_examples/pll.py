@@ -0,0 +1,378 @@
+"""
+PLL components for the iCE40 and ECP5 which work out their own dividers.
+
+Rather than running `icepll` or `ecppll` and copying their output into an
+Instance by hand, ICE40PLL and ECP5PLL take the input frequency and the
+frequency wanted, search every valid divider setting in Python for the
+closest output (the same search those tools do, so they pick the same
+settings), and then instantiate the PLL primitive with those parameters and
+add a clock constraint for the frequency actually achieved. Searches are
+memoized, so sweeping over many designs or frequencies is cheap.
+
+Each component also has `config`, a PLLConfig describing the solution and
+how far it is from the target, and can optionally produce a second output
+clock. For example:
+
+    pll = ICE40PLL(platform.request("clk12", dir="-"), 12e6, 48e6)
+    m.submodules.pll = pll
+    m.d.comb += cd_sync.clk.eq(pll.clk_out)
+
+Run this module to print the settings for some frequencies:
+
+    python -m amaranth_examples.pll ice40 12e6 48e6 30e6
+"""
+
+import argparse
+import functools
+import math
+import struct
+import sys
+
+from amaranth import Signal, Module, Elaboratable, Instance
+
+
+class PLLConfig:
+    """
+    A solution for a PLL: the achieved output frequencies and the PLL's
+    VCO frequency in Hz, and the family-specific divider parameters.
+    """
+    def __init__(self, f_in, target, f_out, f_vco, params,
+                 target2=None, f_out2=None):
+        self.f_in = f_in
+        self.target = target
+        self.f_out = f_out
+        self.f_vco = f_vco
+        self.params = params
+        self.target2 = target2
+        self.f_out2 = f_out2
+
+    @property
+    def error_ppm(self):
+        """The primary output's error from its target in parts per million."""
+        return (self.f_out - self.target) / self.target * 1e6
+
+    @property
+    def error2_ppm(self):
+        if self.target2 is None:
+            return None
+        return (self.f_out2 - self.target2) / self.target2 * 1e6
+
+    def __str__(self):
+        outputs = [(self.target, self.f_out, self.error_ppm)]
+        if self.target2 is not None:
+            outputs.append((self.target2, self.f_out2, self.error2_ppm))
+        parts = [f"{f_out / 1e6:.4f} MHz (wanted {target / 1e6:.4f} MHz, "
+                 f"{error:+.0f} ppm)" for target, f_out, error in outputs]
+        params = ", ".join(f"{k}={v}" for k, v in self.params.items())
+        return (f"{self.f_in / 1e6:.4f} MHz -> {' and '.join(parts)}, "
+                f"VCO {self.f_vco / 1e6:.2f} MHz: {params}")
+
+
+# Limits from the iCE40 sysCLOCK PLL documentation, in Hz.
+ICE40_F_IN = (10e6, 133e6)
+ICE40_F_PFD = (10e6, 133e6)
+ICE40_F_VCO = (533e6, 1066e6)
+ICE40_F_OUT = (16e6, 275e6)
+
+
+@functools.lru_cache(maxsize=None)
+def solve_ice40(f_in, f_out, f_out2=None):
+    """
+    Find SB_PLL40 settings, in simple feedback mode, giving the output
+    frequency closest to `f_out` from an input of `f_in` (both in Hz).
+
+    The optional second output of the _2F PLLs can only run at the same
+    frequency as the first or half of it, so `f_out2` must be one of those.
+    """
+    if not ICE40_F_IN[0] <= f_in <= ICE40_F_IN[1]:
+        raise ValueError(f"iCE40 PLL input {f_in / 1e6} MHz out of range")
+    if not ICE40_F_OUT[0] <= f_out <= ICE40_F_OUT[1]:
+        raise ValueError(f"iCE40 PLL output {f_out / 1e6} MHz out of range")
+    if f_out2 not in (None, f_out, f_out / 2):
+        raise ValueError("iCE40 PLL second output must be at the same "
+                         "frequency as the first, or half of it")
+
+    best = None
+    for divr in range(16):
+        f_pfd = f_in / (divr + 1)
+        if not ICE40_F_PFD[0] <= f_pfd <= ICE40_F_PFD[1]:
+            continue
+        for divf in range(128):
+            f_vco = f_pfd * (divf + 1)
+            if not ICE40_F_VCO[0] <= f_vco <= ICE40_F_VCO[1]:
+                continue
+            for divq in range(1, 7):
+                f = f_vco / 2**divq
+                if best is None or abs(f - f_out) < abs(best[0] - f_out):
+                    best = (f, f_vco, f_pfd, divr, divf, divq)
+    if best is None:
+        raise ValueError(f"No iCE40 PLL settings for {f_in / 1e6} MHz in")
+    f, f_vco, f_pfd, divr, divf, divq = best
+
+    # The loop filter setting depends on the phase detector frequency.
+    for filter_range, f_max in enumerate((17e6, 26e6, 44e6, 66e6, 101e6), 1):
+        if f_pfd < f_max:
+            break
+    else:
+        filter_range = 6
+
+    params = {"DIVR": divr, "DIVF": divf, "DIVQ": divq,
+              "FILTER_RANGE": filter_range}
+    f2 = None
+    if f_out2 is not None:
+        half = f_out2 != f_out
+        params["PLLOUT_SELECT_PORTB"] = "GENCLK_HALF" if half else "GENCLK"
+        f2 = f / 2 if half else f
+    return PLLConfig(f_in, f_out, f, f_vco, params, f_out2, f2)
+
+
+# Limits from the ECP5 sysCLOCK PLL documentation, in Hz.
+ECP5_F_IN = (8e6, 400e6)
+ECP5_F_PFD = (3.125e6, 400e6)
+ECP5_F_VCO = (400e6, 800e6)
+ECP5_F_OUT = (3.125e6, 400e6)
+
+
+def _f32(x):
+    # Round to single precision, which ecppll does all its arithmetic in.
+    return struct.unpack("f", struct.pack("f", x))[0]
+
+
+@functools.lru_cache(maxsize=None)
+def solve_ecp5(f_in, f_out, f_out2=None, phase2=0):
+    """
+    Find EHXPLLL settings, with CLKOP as the feedback path, giving the
+    output frequency closest to `f_out` from an input of `f_in`, and if
+    `f_out2` is given, a CLKOS output as close to it as the VCO allows,
+    shifted by `phase2` degrees.
+
+    This is `ecppll`'s search, including its single precision arithmetic:
+    amongst settings with equal error the one with the VCO closest to
+    600 MHz wins, CLKOS_DIV is rounded down, and both outputs get the 180
+    degree CPHASE offset Lattice's tools add to CLKOP.
+    """
+    if not ECP5_F_IN[0] <= f_in <= ECP5_F_IN[1]:
+        raise ValueError(f"ECP5 PLL input {f_in / 1e6} MHz out of range")
+    for f in (f_out, f_out2):
+        if f is not None and not ECP5_F_OUT[0] <= f <= ECP5_F_OUT[1]:
+            raise ValueError(f"ECP5 PLL output {f / 1e6} MHz out of range")
+
+    # ecppll works in MHz.
+    f_in_mhz = _f32(f_in / 1e6)
+    f_out_mhz = _f32(f_out / 1e6)
+    vco_min, vco_max = (f / 1e6 for f in ECP5_F_VCO)
+    best = None
+    error = math.inf
+    for clki_div in range(1, 129):
+        f_pfd = _f32(f_in_mhz / clki_div)
+        if not ECP5_F_PFD[0] <= f_pfd * 1e6 <= ECP5_F_PFD[1]:
+            continue
+        for clkfb_div in range(1, 81):
+            f = _f32(f_pfd * clkfb_div)
+            # Only try the output dividers which could put the VCO in range,
+            # plus one either side for rounding.
+            lo = max(1, math.floor(vco_min / f) - 1)
+            hi = min(128, math.ceil(vco_max / f) + 1)
+            for clkop_div in range(lo, hi + 1):
+                f_vco = _f32(f * clkop_div)
+                if not vco_min <= f_vco <= vco_max:
+                    continue
+                fout = _f32(f_vco / clkop_div)
+                e = _f32(abs(fout - f_out_mhz))
+                if e < error or (e == error and
+                                 abs(f_vco - 600) < abs(best[1] - 600)):
+                    error = e
+                    best = (fout, f_vco, clki_div, clkfb_div, clkop_div)
+    if best is None:
+        raise ValueError(f"No ECP5 PLL settings for {f_in / 1e6} MHz in")
+    fout, f_vco, clki_div, clkfb_div, clkop_div = best
+
+    # Half a CLKOP period in VCO cycles, truncated.
+    cphase = int(_f32(1 / (fout * 1e6) * 0.5) * (f_vco * 1e6))
+    params = {"CLKI_DIV": clki_div, "CLKFB_DIV": clkfb_div,
+              "CLKOP_DIV": clkop_div, "CLKOP_CPHASE": cphase,
+              "CLKOP_FPHASE": 0}
+    f = f_in * clkfb_div / clki_div
+    f2 = None
+    if f_out2 is not None:
+        clkos_div = int(f_vco / _f32(f_out2 / 1e6))
+        f2 = f * clkop_div / clkos_div
+        # The phase shift in VCO cycles, in whole and eighth cycles.
+        freq2 = _f32(f_vco / clkos_div)
+        shift = _f32(1 / (freq2 * 1e6) * phase2 / 360)
+        count = _f32(shift * (f_vco * 1e6))
+        params.update({"CLKOS_DIV": clkos_div,
+                       "CLKOS_CPHASE": int(count) + cphase,
+                       "CLKOS_FPHASE": int((count - int(count)) * 8)})
+    return PLLConfig(f_in, f_out, f, f * clkop_div, params, f_out2, f2)
+
+
+class ICE40PLL(Elaboratable):
+    """
+    An iCE40 PLL generating `clk_out` (and `clk_out2`, if `f_out2` is given)
+    from `clk_in` at `f_in` Hz, with `locked` high once it has locked.
+
+    With `pad=True`, `clk_in` must be the raw package pin, requested with
+    `dir="-"`, and the SB_PLL40_PAD primitives are used; otherwise it is
+    an ordinary signal fed to SB_PLL40_CORE. See pll_ice40.py for why
+    you might need one or the other.
+    """
+    def __init__(self, clk_in, f_in, f_out, *, f_out2=None, pad=True):
+        self.config = solve_ice40(f_in, f_out, f_out2)
+        self.clk_in = clk_in
+        self.pad = pad
+        self.clk_out = Signal()
+        self.clk_out2 = Signal() if f_out2 is not None else None
+        self.locked = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        config = self.config
+        two = self.clk_out2 is not None
+        kind = ("SB_PLL40_2F" if two else "SB_PLL40") + \
+            ("_PAD" if self.pad else "_CORE")
+        ports = {"i_RESETB": 1, "o_LOCK": self.locked}
+        ports["i_PACKAGEPIN" if self.pad else "i_REFERENCECLK"] = self.clk_in
+        if two:
+            ports["o_PLLOUTGLOBALA"] = self.clk_out
+            ports["o_PLLOUTGLOBALB"] = self.clk_out2
+        else:
+            ports["o_PLLOUTGLOBAL"] = self.clk_out
+        params = {f"p_{k}": v for k, v in config.params.items()}
+        m.submodules.pll = Instance(kind, p_FEEDBACK_PATH="SIMPLE",
+                                    **params, **ports)
+
+        if platform is not None:
+            platform.add_clock_constraint(self.clk_out, config.f_out)
+            if two:
+                platform.add_clock_constraint(self.clk_out2, config.f_out2)
+
+        return m
+
+
+class ECP5PLL(Elaboratable):
+    """
+    An ECP5 EHXPLLL generating `clk_out` (and `clk_out2`, if `f_out2` is
+    given, shifted by `phase2` degrees) from `clk_in` at `f_in` Hz, with
+    `locked` high once it has locked.
+    """
+    def __init__(self, clk_in, f_in, f_out, *, f_out2=None, phase2=0):
+        self.config = solve_ecp5(f_in, f_out, f_out2, phase2)
+        self.clk_in = clk_in
+        self.clk_out = Signal()
+        self.clk_out2 = Signal() if f_out2 is not None else None
+        self.locked = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        config = self.config
+        params = {f"p_{k}": v for k, v in config.params.items()}
+        ports = {}
+        if self.clk_out2 is not None:
+            params["p_CLKOS_ENABLE"] = "ENABLED"
+            params["a_FREQUENCY_PIN_CLKOS"] = f"{config.f_out2 / 1e6:g}"
+            ports["o_CLKOS"] = self.clk_out2
+        m.submodules.pll = Instance(
+            "EHXPLLL",
+            a_FREQUENCY_PIN_CLKI=f"{config.f_in / 1e6:g}",
+            a_FREQUENCY_PIN_CLKOP=f"{config.f_out / 1e6:g}",
+            a_ICP_CURRENT="12",
+            a_LPF_RESISTOR="8",
+            p_FEEDBK_PATH="CLKOP",
+            p_CLKOP_ENABLE="ENABLED",
+            i_CLKI=self.clk_in,
+            i_CLKFB=self.clk_out,
+            o_CLKOP=self.clk_out,
+            o_LOCK=self.locked,
+            **params, **ports,
+        )
+
+        if platform is not None:
+            platform.add_clock_constraint(self.clk_out, config.f_out)
+            if self.clk_out2 is not None:
+                platform.add_clock_constraint(self.clk_out2, config.f_out2)
+
+        return m
+
+
+SOLVERS = {"ice40": solve_ice40, "ecp5": solve_ecp5}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("family", choices=SOLVERS)
+    parser.add_argument("f_in", type=float, help="input frequency in Hz")
+    parser.add_argument("f_out", type=float, nargs="+",
+                        help="output frequencies in Hz to solve for")
+    parser.add_argument("--f-out2", type=float, default=None,
+                        help="frequency in Hz for a second output")
+    args = parser.parse_args(argv)
+    for f_out in args.f_out:
+        try:
+            print(SOLVERS[args.family](args.f_in, f_out, args.f_out2))
+        except ValueError as e:
+            print(f"{f_out / 1e6:.4f} MHz: {e}")
+    return 0
+
+
+def test_solve_ice40():
+    # Matches `icepll -i 12 -o 48`.
+    config = solve_ice40(12e6, 48e6)
+    assert config.params == {"DIVR": 0, "DIVF": 63, "DIVQ": 4,
+                             "FILTER_RANGE": 1}
+    assert config.f_out == 48e6 and config.error_ppm == 0
+
+    # Matches `icepll -i 12 -o 40`, which can't be hit exactly.
+    config = solve_ice40(12e6, 40e6)
+    assert config.params == {"DIVR": 0, "DIVF": 52, "DIVQ": 4,
+                             "FILTER_RANGE": 1}
+    assert config.f_out == 39.75e6
+
+    config = solve_ice40(12e6, 48e6, 24e6)
+    assert config.params["PLLOUT_SELECT_PORTB"] == "GENCLK_HALF"
+    assert config.f_out2 == 24e6
+
+
+def test_solve_ecp5():
+    # Recorded from `ecppll -i 25 -o <f_out>`, and with `--clkout1 <f_out2>
+    # --phase1 <phase2>` for a second output.
+    recorded = {
+        (133e6,): (3, 16, 5, 2),
+        (400e6,): (1, 16, 1, 0),
+        (48e6,): (8, 15, 13, 6),
+        (100e6,): (1, 4, 6, 2),
+        (100e6, 50e6, 0): (1, 4, 6, 2, 12, 2, 0),
+        (133e6, 40e6, 90): (3, 16, 5, 2, 16, 6, 0),
+    }
+    names = ["CLKI_DIV", "CLKFB_DIV", "CLKOP_DIV", "CLKOP_CPHASE",
+             "CLKOS_DIV", "CLKOS_CPHASE", "CLKOS_FPHASE"]
+    for args, values in recorded.items():
+        config = solve_ecp5(25e6, *args)
+        assert config.params["CLKOP_FPHASE"] == 0
+        assert {name: config.params[name] for name in names[:len(values)]} \
+            == dict(zip(names, values)), args
+
+    config = solve_ecp5(25e6, 100e6, 50e6)
+    assert config.f_vco == 600e6 and config.f_out2 == 50e6
+    # CLKOS_DIV is rounded down, so the second output can be well off.
+    config = solve_ecp5(25e6, 133e6, 40e6)
+    assert round(config.f_out2) == 41_666_667
+
+
+def test_pll_sweep():
+    # Every output frequency in range should give a solution within 5%,
+    # respecting the VCO limits.
+    for mhz in range(16, 276):
+        config = solve_ice40(12e6, mhz * 1e6)
+        assert ICE40_F_VCO[0] <= config.f_vco <= ICE40_F_VCO[1]
+        assert abs(config.error_ppm) < 50_000, str(config)
+    for mhz in range(4, 401):
+        config = solve_ecp5(25e6, mhz * 1e6)
+        assert ECP5_F_VCO[0] <= config.f_vco <= ECP5_F_VCO[1]
+        assert abs(config.error_ppm) < 50_000, str(config)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
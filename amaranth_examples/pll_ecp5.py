@@ -3,13 +3,34 @@ Demonstrates instantiating and using a PLL on an ECP5 platform.
 """
 
 from amaranth import Signal, Module, Elaboratable, Instance, ClockDomain
-from amaranth_boards.ulx3s import ULX3S_12F_Platform
+
+from amaranth_examples.pll import solve_ecp5
 
 
 class Top(Elaboratable):
+    """
+    `f_out` is the frequency to run the PLL at, 100MHz by default;
+    fmax_search.py varies it to find the fastest clock that meets timing.
+    """
+    def __init__(self, f_out=100e6):
+        self.f_out = f_out
+
     def elaborate(self, platform):
         m = Module()
 
+        # Parameters are taken from the `ecppll` output:
+        # $ ecppll -i 25 -o 100 -f /dev/stdout
+        divider = dict(p_CLKI_DIV=1, p_CLKOP_DIV=6, p_CLKFB_DIV=4)
+        f_out = 100e6
+        if self.f_out != f_out:
+            # For any other frequency, use the settings found by
+            # solve_ecp5() from pll.py, which does the same search as
+            # ecppll. (pll.py's ECP5PLL wraps all of this up in a
+            # component; see pll_solved.py.)
+            config = solve_ecp5(25e6, self.f_out)
+            divider = {f"p_{k}": v for k, v in config.params.items()}
+            f_out = config.f_out
+
         # We'll need to create our own "sync" clock domain using the PLL's
         # output, since the default sync domain would use the 25MHz input.
         cd_sync = ClockDomain("sync")
@@ -17,7 +38,7 @@ class Top(Elaboratable):
 
         # We add a clock constraint so amaranth can tell nextpnr to check that
         # this clock domain meets timing.
-        platform.add_clock_constraint(cd_sync.clk, 100e6)
+        platform.add_clock_constraint(cd_sync.clk, f_out)
 
         # Create an Instance with the required parameters, inputs, and outputs.
         # For the ECP5, this is EHXPLLL; refer to the "FPGA Libraries Reference
@@ -25,15 +46,12 @@ class Top(Elaboratable):
         m.submodules.pll = Instance(
             "EHXPLLL",
 
-            # Parameters are taken from the `ecppll` output:
-            # $ ecppll -i 25 -o 100 -f /dev/stdout
+            # The rest of the ecppll output, with the dividers from above.
             a_FREQUENCY_PIN_CLKI="25",
-            a_FREQUENCY_PIN_CLKOP="100",
+            a_FREQUENCY_PIN_CLKOP=f"{f_out / 1e6:g}",
             a_ICP_CURRENT="12",
             a_LPF_RESISTOR="8",
-            p_CLKI_DIV=1,
-            p_CLKOP_DIV=6,
-            p_CLKFB_DIV=4,
+            **divider,
             p_FEEDBK_PATH="CLKOP",
             p_CLKOP_ENABLE="ENABLED",
 
@@ -49,7 +67,7 @@ class Top(Elaboratable):
             i_CLKFB=cd_sync.clk,
         )
 
-        # Now our sync logic runs at 100MHz:
+        # Now our sync logic runs at 100MHz (by default):
         cnt = Signal(24)
         m.d.sync += cnt.eq(cnt + 1)
         m.d.comb += platform.request("led", 0).o.eq(cnt[-1])
@@ -57,19 +75,13 @@ class Top(Elaboratable):
         return m
 
 
-def test_pll_ecp5():
-    top = Top()
-
-    # The real ULX3S_12F_Platform inconsiderately requires openFPGAloader
-    # present in the build environment, even if you're not programming.
-    class FakeULX3SPlatform(ULX3S_12F_Platform):
-        @property
-        def required_tools(self):
-            return super().required_tools[:-1]
+def test_pll_ecp5_toolchain():
+    from amaranth_examples.registry import platform
 
-    plat = FakeULX3SPlatform()
+    top = Top()
+    plat = platform("ulx3s_12f")()
     plat.build(top, program=False)
 
 
 if __name__ == "__main__":
-    test_pll_ecp5()
+    test_pll_ecp5_toolchain()
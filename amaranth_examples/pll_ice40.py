@@ -3,13 +3,34 @@ Demonstrates instantiating and using a PLL on an iCE40 platform.
 """
 
 from amaranth import Signal, Module, Elaboratable, Instance, ClockDomain
-from amaranth_boards.icebreaker import ICEBreakerPlatform
+
+from amaranth_examples.pll import solve_ice40
 
 
 class Top(Elaboratable):
+    """
+    `f_out` is the frequency to run the PLL at, 48MHz by default;
+    fmax_search.py varies it to find the fastest clock that meets timing.
+    """
+    def __init__(self, f_out=48e6):
+        self.f_out = f_out
+
     def elaborate(self, platform):
         m = Module()
 
+        # Parameters are taken from the `icepll` output:
+        # $ icepll -i 12 -o 48 -m
+        divider = dict(p_DIVR=0, p_DIVF=63, p_DIVQ=4, p_FILTER_RANGE=1)
+        f_out = 48e6
+        if self.f_out != f_out:
+            # For any other frequency, use the settings found by
+            # solve_ice40() from pll.py, which does the same search as
+            # icepll. (pll.py's ICE40PLL wraps all of this up in a
+            # component; see pll_solved.py.)
+            config = solve_ice40(12e6, self.f_out)
+            divider = {f"p_{k}": v for k, v in config.params.items()}
+            f_out = config.f_out
+
         # We'll need to create our own "sync" clock domain using the PLL's
         # output, since the default sync domain would use the 12MHz input.
         cd_sync = ClockDomain("sync")
@@ -17,7 +38,7 @@ class Top(Elaboratable):
 
         # We add a clock constraint so amaranth can tell nextpnr to check that
         # this clock domain meets timing.
-        platform.add_clock_constraint(cd_sync.clk, 48e6)
+        platform.add_clock_constraint(cd_sync.clk, f_out)
 
         # A mystery errata on iCE40 devices means that BRAMs will read as
         # all-zero for ~3µs after configuration completes. If you use a "sync"
@@ -33,7 +54,7 @@ class Top(Elaboratable):
         # amaranth/vendor/_lattice_ice40.py.
         cd_por = ClockDomain("por", local=True)
         m.domains += cd_por
-        delay = int(5 * 3e-6 * 48e6)
+        delay = int(5 * 3e-6 * f_out)
         timer = Signal(range(delay))
         ready = Signal()
         pll_locked = Signal()
@@ -58,13 +79,9 @@ class Top(Elaboratable):
         m.submodules.pll = Instance(
             "SB_PLL40_PAD",
 
-            # Parameters are taken from the `icepll` output:
-            # $ icepll -i 12 -o 40 -m
+            # The divider parameters from icepll, above.
             p_FEEDBACK_PATH="SIMPLE",
-            p_DIVR=0,
-            p_DIVF=52,
-            p_DIVQ=4,
-            p_FILTER_RANGE=1,
+            **divider,
 
             # Input from the clk12 pin. Since we want the raw pin without
             # an input buffer, use `dir="-"` and then don't try to access
@@ -83,7 +100,7 @@ class Top(Elaboratable):
             o_LOCK=pll_locked,
         )
 
-        # Now our sync logic runs at 48MHz:
+        # Now our sync logic runs at 48MHz (by default):
         cnt = Signal(24)
         m.d.sync += cnt.eq(cnt + 1)
         m.d.comb += platform.request("led_g", 0).o.eq(cnt[-1])
@@ -91,11 +108,13 @@ class Top(Elaboratable):
         return m
 
 
-def test_pll_ice40():
+def test_pll_ice40_toolchain():
+    from amaranth_boards.icebreaker import ICEBreakerPlatform
+
     top = Top()
     plat = ICEBreakerPlatform()
     plat.build(top)
 
 
 if __name__ == "__main__":
-    test_pll_ice40()
+    test_pll_ice40_toolchain()
@@ -0,0 +1,100 @@
+"""
+Demonstrates the PLL components from pll.py on the iCE40 and ECP5.
+
+pll_ice40.py and pll_ecp5.py instantiate each PLL primitive by hand, with
+divider settings copied from `icepll` and `ecppll`. Here ICE40PLL and
+ECP5PLL work those settings out themselves and add the clock constraints,
+so each design just names the frequencies it wants, including a second
+output at half the frequency of the first.
+"""
+
+from amaranth import Signal, Module, Elaboratable, ClockDomain
+
+from amaranth_examples.pll import ICE40PLL, ECP5PLL
+
+
+class ICE40Top(Elaboratable):
+    """
+    Blinks the ICEBreaker's green LED from a 48MHz domain and its red LED
+    from a 24MHz one, both from the same PLL.
+    """
+    def elaborate(self, platform):
+        m = Module()
+
+        # As in pll_ice40.py, the PLL has to be fed from the raw clk12 pin,
+        # so ICE40PLL uses SB_PLL40_2F_PAD.
+        pll = ICE40PLL(platform.request("clk12", dir="-"), 12e6, 48e6,
+                       f_out2=24e6, pad=True)
+        m.submodules.pll = pll
+
+        m.domains.sync = cd_sync = ClockDomain("sync")
+        m.domains.slow = cd_slow = ClockDomain("slow")
+        m.d.comb += [
+            cd_sync.clk.eq(pll.clk_out),
+            cd_slow.clk.eq(pll.clk_out2),
+            # There are no BRAMs, so holding the domains in reset until
+            # the PLL has locked is enough; see pll_ice40.py otherwise.
+            cd_sync.rst.eq(~pll.locked),
+            cd_slow.rst.eq(~pll.locked),
+        ]
+
+        fast = Signal(24)
+        slow = Signal(24)
+        m.d.sync += fast.eq(fast + 1)
+        m.d.slow += slow.eq(slow + 1)
+        m.d.comb += [
+            platform.request("led_g", 0).o.eq(fast[-1]),
+            platform.request("led_r", 0).o.eq(slow[-1]),
+        ]
+
+        return m
+
+
+class ECP5Top(Elaboratable):
+    """
+    Blinks two of the ULX3S's LEDs from a 100MHz domain and a 50MHz one,
+    the second shifted by 90 degrees, both from the same EHXPLLL.
+    """
+    def elaborate(self, platform):
+        m = Module()
+
+        pll = ECP5PLL(platform.request("clk25").i, 25e6, 100e6,
+                      f_out2=50e6, phase2=90)
+        m.submodules.pll = pll
+
+        m.domains.sync = cd_sync = ClockDomain("sync")
+        m.domains.slow = cd_slow = ClockDomain("slow")
+        m.d.comb += [
+            cd_sync.clk.eq(pll.clk_out),
+            cd_slow.clk.eq(pll.clk_out2),
+            cd_sync.rst.eq(~pll.locked),
+            cd_slow.rst.eq(~pll.locked),
+        ]
+
+        fast = Signal(24)
+        slow = Signal(24)
+        m.d.sync += fast.eq(fast + 1)
+        m.d.slow += slow.eq(slow + 1)
+        m.d.comb += [
+            platform.request("led", 0).o.eq(fast[-1]),
+            platform.request("led", 1).o.eq(slow[-1]),
+        ]
+
+        return m
+
+
+def test_pll_solved_ice40_toolchain():
+    from amaranth_boards.icebreaker import ICEBreakerPlatform
+
+    ICEBreakerPlatform().build(ICE40Top())
+
+
+def test_pll_solved_ecp5_toolchain():
+    from amaranth_examples.registry import platform
+
+    platform("ulx3s_12f")().build(ECP5Top(), program=False)
+
+
+if __name__ == "__main__":
+    test_pll_solved_ice40_toolchain()
+    test_pll_solved_ecp5_toolchain()
@@ -0,0 +1,139 @@
+"""
+Look up example platforms by name, importing them only when needed.
+
+pytest imports every module in this package to collect its tests, so any
+module which imports a board from amaranth_boards, or a vendor platform,
+at its top level makes even a one-second simulation test pay for those
+imports. Instead, examples refer to platforms by a short name in
+`PLATFORMS` (or a "module:attribute" path), and `platform()` imports the
+class the first time a design is actually built.
+
+This module can also report how long each example module takes to import,
+each in a fresh interpreter, and which of the slow packages it pulls in:
+
+    python -m amaranth_examples.registry
+"""
+
+import argparse
+import functools
+import importlib
+import pkgutil
+import re
+import subprocess
+import sys
+
+
+PLATFORMS = {
+    "icebreaker": "amaranth_boards.icebreaker:ICEBreakerPlatform",
+    "ulx3s_12f": "amaranth_examples.ulx3s:FakeULX3SPlatform",
+    "custom_ice40": "amaranth_examples.custom_board:CustomPlatform",
+    "custom_ecp5": "amaranth_examples.ddr:CustomPlatform",
+    "gearbox_ecp5": "amaranth_examples.gearbox:GearboxPlatform",
+}
+
+
+# Packages worth knowing about when a module is slow to import: the build
+# system (which loads Jinja2), this package's build runner (which loads the
+# cache, profiling, seed sweep and reporting modules), vendor platforms,
+# boards, and the optional NumPy and VCD dependencies.
+SLOW_IMPORTS = [
+    "amaranth.build",
+    "amaranth_examples.build_runner",
+    "amaranth.vendor._lattice_ice40",
+    "amaranth.vendor._lattice_ecp5",
+    "amaranth_boards",
+    "numpy",
+    "vcd",
+]
+
+
+def load(path):
+    """Import and return the attribute named by a "module:attribute" path."""
+    module, attr = path.split(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+@functools.lru_cache(maxsize=None)
+def platform(name):
+    """
+    Return the platform class called `name` in `PLATFORMS`, or named by a
+    "module:attribute" path, importing it if this is the first use.
+    """
+    return load(PLATFORMS.get(name, name))
+
+
+def example_modules():
+    """The names of every module in this package."""
+    package = importlib.import_module(__package__)
+    return [f"{__package__}.{info.name}"
+            for info in pkgutil.iter_modules(package.__path__)]
+
+
+def import_times(module):
+    """
+    Import `module` in a new interpreter with `-X importtime`, returning
+    (its cumulative import time in seconds, dict of each package in
+    `SLOW_IMPORTS` that it pulled in to that package's own cumulative time).
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                           f"import {module}"],
+                          capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)", line)
+        if match:
+            # A package can be listed more than once if importing it
+            # fails part way, so keep the first, outermost time.
+            times.setdefault(match.group(3), int(match.group(1)) / 1e6)
+    slow = {name: times[name] for name in SLOW_IMPORTS if name in times}
+    return times[module], slow
+
+
+def import_report(modules=None):
+    """Return a list of (module, seconds, slow imports) for `modules`."""
+    modules = modules or example_modules()
+    return [(module, *import_times(module)) for module in modules]
+
+
+def format_report(report):
+    width = max(len(module) for module, _, _ in report)
+    lines = []
+    for module, seconds, slow in sorted(report, key=lambda r: -r[1]):
+        pulled = ", ".join(f"{name} {t * 1e3:.0f}ms"
+                           for name, t in slow.items())
+        lines.append(f"  {module:<{width}}  {seconds * 1e3:6.1f}ms  "
+                     f"{pulled}".rstrip())
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("modules", nargs="*", metavar="MODULE",
+                        help="modules to time (default: all examples)")
+    args = parser.parse_args(argv)
+    print(format_report(import_report(args.modules)))
+
+
+def test_lazy_platforms():
+    # None of the examples which build for a board from amaranth_boards
+    # should import it until asked to, and simulation-only examples
+    # shouldn't import the build system at all.
+    modules = ["connectors", "instance", "pll_ice40", "pll_ecp5", "counter"]
+    for module in modules:
+        _, slow = import_times(f"{__package__}.{module}")
+        assert "amaranth_boards" not in slow, module
+    for module in ["counter", "alu_pipelined"]:
+        _, slow = import_times(f"{__package__}.{module}")
+        assert slow == {}, module
+
+    from amaranth_boards.ulx3s import ULX3S_12F_Platform
+    from amaranth_examples import ulx3s
+    fake = platform("ulx3s_12f")
+    assert fake is ulx3s.FakeULX3SPlatform
+    assert issubclass(fake, ULX3S_12F_Platform)
+    assert platform("amaranth_examples.ddr:CustomPlatform") is \
+        platform("custom_ecp5")
+
+
+if __name__ == "__main__":
+    main()
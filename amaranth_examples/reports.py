@@ -0,0 +1,241 @@
+"""
+Turn the toolchain's timing and utilization reports into structured metrics.
+
+nextpnr prints the Fmax it achieved for each clock, and how many of each
+kind of cell it used, into its log; Yosys prints cell counts into its own.
+Rather than scraping those, we ask nextpnr for its machine-readable report
+with `--report` (through the platform's `nextpnr_opts` override), and read
+the final `stat` from the Yosys log for LUT and flip-flop counts, which
+nextpnr only reports combined into logic cells on the iCE40.
+
+`collect_metrics()` combines them into one record per design:
+
+    {
+      "design": "custom_board",
+      "clocks": {
+        "cd_sync_clk_0__i": {
+          "domain": "sync", "constraint_mhz": 20.0, "achieved_mhz": 98.3,
+          "critical_path_ns": 10.2, "slack_ns": 39.8, "ok": true
+        }
+      },
+      "resources": {"lut": 41, "ff": 24, "carry": 23, "bram": 0, ...},
+      "utilization": {"ICESTORM_LC": {"used": 50, "available": 5280}, ...}
+    }
+
+build_runner.py uses this after every build, writing `metrics.json` into
+each build directory, and fails any build whose achieved Fmax is below
+its clock constraint.
+"""
+
+import json
+import os
+import re
+
+
+def report_overrides(overrides, name="top"):
+    """
+    Return a copy of the `platform.build()` overrides in `overrides` with
+    the options asking nextpnr to write `<name>.report.json` added.
+    """
+    overrides = dict(overrides)
+    opts = overrides.get("nextpnr_opts", "")
+    if isinstance(opts, str):
+        opts = opts.split()
+    if "--report" not in opts:
+        opts = [*opts, "--report", f"{name}.report.json"]
+    overrides["nextpnr_opts"] = opts
+    return overrides
+
+
+# How cell types in the Yosys statistics map to resource kinds.
+CELL_KINDS = [
+    (r"SB_LUT4|LUT4", "lut"),
+    (r"SB_DFF.*|TRELLIS_FF", "ff"),
+    (r"SB_CARRY|CCU2C", "carry"),
+    (r"SB_RAM40_4K.*|SB_SPRAM256KA|DP16KD|PDPW16KD", "bram"),
+    (r"SB_PLL40_.*|EHXPLLL", "pll"),
+    (r"SB_MAC16|MULT18X18D|ALU54B", "dsp"),
+    (r"SB_(GB_)?IO.*|TRELLIS_IO", "io"),
+]
+
+
+def parse_yosys_stat(path):
+    """
+    Return a dict of cell type to count from the last `stat` output in
+    the Yosys log at `path`.
+    """
+    cells = {}
+    counting = False
+    with open(path) as f:
+        for line in f:
+            if "Number of cells:" in line:
+                cells = {}
+                counting = True
+            elif counting:
+                match = re.match(r"^\s+(\S+)\s+(\d+)\s*$", line)
+                if match:
+                    cells[match.group(1)] = int(match.group(2))
+                else:
+                    counting = False
+    return cells
+
+
+def resources(cells):
+    """Summarise a dict of cell counts into totals for each kind."""
+    totals = {kind: 0 for _, kind in CELL_KINDS}
+    for cell, count in cells.items():
+        for pattern, kind in CELL_KINDS:
+            if re.fullmatch(pattern, cell):
+                totals[kind] += count
+                break
+    return totals
+
+
+def clock_domain(net):
+    """
+    Guess the Amaranth clock domain name from a clock net name: either a
+    platform clock used as a default domain, like `cd_sync_clk_0__i`, or
+    a domain's own clock signal, `clk` for sync and `<domain>_clk` for any
+    other, possibly with a global buffer prefix or suffix added by nextpnr.
+    """
+    net = re.sub(r"^\$glbnet\$|_\$glb_clk$", "", net)
+    match = re.match(r"cd_(\w+?)_clk", net)
+    if match:
+        return match.group(1)
+    if net == "clk":
+        return "sync"
+    match = re.fullmatch(r"(\w+)_clk", net)
+    return match.group(1) if match else None
+
+
+def parse_nextpnr_report(path):
+    """
+    Return (clocks, utilization) from the nextpnr JSON report at `path`,
+    where `clocks` is a dict of clock net name to its timing metrics.
+    """
+    with open(path) as f:
+        report = json.load(f)
+
+    # Each critical path is reported as a list of delays in ns, from
+    # one clock edge (or "<async>") to another.
+    paths = {}
+    for path in report.get("critical_paths", []):
+        start = path["from"].split(" ", 1)[-1]
+        end = path["to"].split(" ", 1)[-1]
+        if start == end:
+            paths[start] = sum(step["delay"] for step in path["path"])
+
+    clocks = {}
+    for net, fmax in report.get("fmax", {}).items():
+        constraint = fmax.get("constraint")
+        achieved = fmax["achieved"]
+        critical = paths.get(net)
+        slack = None
+        if constraint and critical is not None:
+            slack = 1000 / constraint - critical
+        clocks[net] = {
+            "domain": clock_domain(net),
+            "constraint_mhz": constraint,
+            "achieved_mhz": achieved,
+            "critical_path_ns": critical,
+            "slack_ns": slack,
+            "ok": not constraint or achieved >= constraint,
+        }
+    return clocks, report.get("utilization", {})
+
+
+def collect_metrics(build_dir, design, name="top"):
+    """
+    Collect the metrics for the build of `design` in `build_dir`, returning
+    None if nextpnr wrote no report there.
+    """
+    report = os.path.join(build_dir, f"{name}.report.json")
+    if not os.path.exists(report):
+        return None
+    clocks, utilization = parse_nextpnr_report(report)
+    stat = os.path.join(build_dir, f"{name}.rpt")
+    cells = parse_yosys_stat(stat) if os.path.exists(stat) else {}
+    return {
+        "design": design,
+        "clocks": clocks,
+        "resources": resources(cells),
+        "utilization": utilization,
+    }
+
+
+def timing_failures(metrics):
+    """Return a message for each clock in `metrics` which missed timing."""
+    return [f"{metrics['design']}: clock {net} achieved "
+            f"{clock['achieved_mhz']:.2f} MHz, below its constraint of "
+            f"{clock['constraint_mhz']:.2f} MHz"
+            for net, clock in metrics["clocks"].items() if not clock["ok"]]
+
+
+def format_metrics(metrics):
+    """A one-line summary of each clock's timing and the resource use."""
+    parts = []
+    for clock in metrics["clocks"].values():
+        parts.append(f"{clock['domain'] or '?'} {clock['achieved_mhz']:.1f}"
+                     f"/{clock['constraint_mhz'] or 0:.1f} MHz")
+    used = metrics["resources"]
+    parts.append(f"{used['lut']} LUT {used['ff']} FF {used['bram']} BRAM "
+                 f"{used['pll']} PLL")
+    if "seeds" in metrics:
+        seeds = metrics["seeds"]
+        spread = "; ".join(f"{s['min']:.1f}-{s['max']:.1f}"
+                           for s in seeds["fmax_spread_mhz"].values())
+        finished = sum(run["ok"] for run in seeds["runs"])
+        parts.append(f"seed {seeds['best']} best of {finished} "
+                     f"(Fmax {spread} MHz)")
+    return ", ".join(parts)
+
+
+def test_reports():
+    import tempfile
+
+    report = {
+        "fmax": {
+            "cd_sync_clk_0__i": {"achieved": 60.0, "constraint": 20},
+            "cd_fast_clk": {"achieved": 40.0, "constraint": 48},
+        },
+        "critical_paths": [
+            {"from": "posedge cd_sync_clk_0__i",
+             "to": "posedge cd_sync_clk_0__i",
+             "path": [{"delay": 10.0}, {"delay": 6.5}]},
+            {"from": "posedge cd_sync_clk_0__i", "to": "<async>",
+             "path": [{"delay": 3.0}]},
+        ],
+        "utilization": {"ICESTORM_LC": {"used": 50, "available": 5280}},
+    }
+    stat = [
+        "   Number of cells:                 12\n",
+        "     SB_LUT4                         5\n",
+        "     SB_DFFSR                        4\n",
+        "     SB_DFFE                         2\n",
+        "     SB_PLL40_PAD                    1\n",
+        "\n",
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "top.report.json"), "w") as f:
+            json.dump(report, f)
+        with open(os.path.join(tmp, "top.rpt"), "w") as f:
+            # Only the final statistics should count.
+            f.writelines(stat[:2] + ["\n"] + stat)
+        metrics = collect_metrics(tmp, "example")
+
+    sync = metrics["clocks"]["cd_sync_clk_0__i"]
+    assert sync["domain"] == "sync"
+    assert clock_domain("$glbnet$cd_sync_clk25_0__i") == "sync"
+    assert clock_domain("clk") == "sync"
+    assert clock_domain("fast_clk_$glb_clk") == "fast"
+    assert sync["critical_path_ns"] == 16.5
+    assert sync["slack_ns"] == 50.0 - 16.5
+    assert sync["ok"]
+    assert not metrics["clocks"]["cd_fast_clk"]["ok"]
+    assert metrics["resources"]["lut"] == 5
+    assert metrics["resources"]["ff"] == 6
+    assert metrics["resources"]["pll"] == 1
+    assert timing_failures(metrics) == [
+        "example: clock cd_fast_clk achieved 40.00 MHz, below its "
+        "constraint of 48.00 MHz"]
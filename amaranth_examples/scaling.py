@@ -0,0 +1,308 @@
+"""
+Find where elaboration, simulation and synthesis stop scaling linearly.
+
+Every example here is tiny, so they say nothing about how the tools cope
+with bigger designs. `Replicated` generates one: `n` copies of Counter,
+ALU or SPIPeriph, each `width` bits wide, as submodules of one top level.
+A free-running counter drives every copy's inputs, mixed differently for
+each copy, and their outputs are XORed together into `out`, so all the
+logic is used and no two copies are the same, which stops Yosys merging
+them. (Each counter has a different limit too, which only runs out past
+2**(width - 1) counters, and each ALU accumulates its own result.)
+
+For each point of a sweep over `n` and `width`, in a fresh process:
+
+* the time to elaborate the design (`Fragment.get`), to prepare it
+  (domain and port inference), and to emit RTLIL, and the RTLIL's size,
+* the Python simulator's cycles per second with a testbench that only
+  clocks it,
+* optionally, Yosys's `synth_ice40` time and peak memory (measured as in
+  build_profile.py) and the LUTs and flip-flops it used.
+
+The results are written as CSV and JSON. Each cost is also divided by the
+size of the design (`n * width`); a point whose cost per bit is more than
+`tolerance` times the smallest seen at any smaller size is marked as a
+non-linear point, which is where to look for a problem:
+
+    python -m amaranth_examples.scaling --kinds alu spi --n 1 4 16 64 256
+    python -m amaranth_examples.scaling --kinds counter --width 8 32 128 \\
+        --synth
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from amaranth import Module, Signal, Elaboratable, Cat
+from amaranth.back import rtlil
+from amaranth.hdl.ir import Fragment
+from amaranth.sim import Simulator
+
+from amaranth_examples.build_profile import Stage, profile_stage
+from amaranth_examples.comb_test import ALU
+from amaranth_examples.counter import Counter
+from amaranth_examples.reports import parse_yosys_stat, resources
+from amaranth_examples.spi_oversampled import SPIPeriph
+
+
+KINDS = ("counter", "alu", "spi")
+
+# The costs at each point which are checked for non-linear growth.
+COSTS = ["elaborate_s", "prepare_s", "rtlil_s", "sim_s_per_cycle",
+         "synth_s", "synth_rss_mib"]
+
+
+def _xor_tree(values):
+    # A balanced tree, rather than a chain which Amaranth would have to
+    # recurse n levels deep into.
+    while len(values) > 1:
+        values = [values[i] ^ values[i + 1] if i + 1 < len(values)
+                  else values[i] for i in range(0, len(values), 2)]
+    return values[0]
+
+
+class Replicated(Elaboratable):
+    """`n` copies of the `kind` of core, each `width` bits wide."""
+    def __init__(self, kind, n, width):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown kind {kind!r}, not one of {KINDS}")
+        self.kind = kind
+        self.n = n
+        self.width = width
+        self.out = Signal(width + 1)
+
+    def elaborate(self, platform):
+        m = Module()
+        width = self.width
+        mask = 2**width - 1
+
+        # The stimulus for every copy.
+        t = Signal(width)
+        m.d.sync += t.eq(t + 1)
+
+        outputs = []
+        for i in range(self.n):
+            mix = (i * 0x9E3779B1) & mask
+            if self.kind == "counter":
+                core = Counter(2**width - 1 - i % 2**(width - 1))
+                outputs.append(Cat(core.counter, core.rollover))
+            elif self.kind == "alu":
+                # Without some state of its own, each ALU would only be a
+                # function of `t`, and Yosys would merge the whole lot.
+                core = ALU(width)
+                acc = Signal(width, name=f"acc{i}")
+                m.d.sync += acc.eq(core.y)
+                m.d.comb += [
+                    core.a.eq(acc ^ mix),
+                    core.b.eq(t + i),
+                    core.op.eq(t[0] ^ (i & 1)),
+                ]
+                outputs.append(core.y)
+            else:
+                core = SPIPeriph(width)
+                m.d.comb += [
+                    core.csn.eq(0),
+                    core.sck.eq(t[1]),
+                    core.sdi.eq((t ^ mix).xor()),
+                ]
+                outputs.append(Cat(core.din, core.sdo))
+            m.submodules[f"{self.kind}{i}"] = core
+
+        m.d.comb += self.out.eq(_xor_tree(outputs))
+        return m
+
+
+def measure(kind, n, width, cycles=1000, synth_dir=None):
+    """
+    Measure one point, returning a dict of its results. If `synth_dir` is
+    given, Yosys synthesises the design there too.
+    """
+    result = {"kind": kind, "n": n, "width": width, "size": n * width}
+
+    top = Replicated(kind, n, width)
+    start = time.perf_counter()
+    fragment = Fragment.get(top, None)
+    result["elaborate_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fragment = fragment.prepare(ports=[top.out])
+    result["prepare_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    text, _ = rtlil.convert_fragment(fragment, emit_src=False)
+    result["rtlil_s"] = time.perf_counter() - start
+    result["rtlil_bytes"] = len(text)
+
+    sim = Simulator(Replicated(kind, n, width))
+    sim.add_clock(1/10e6)
+
+    def testbench():
+        for _ in range(cycles):
+            yield
+
+    sim.add_sync_process(testbench)
+    start = time.perf_counter()
+    sim.run()
+    elapsed = time.perf_counter() - start
+    result["sim_cycles_per_s"] = cycles / elapsed
+    result["sim_s_per_cycle"] = elapsed / cycles
+
+    if synth_dir is not None:
+        os.makedirs(synth_dir, exist_ok=True)
+        with open(os.path.join(synth_dir, "top.il"), "w") as f:
+            f.write(text)
+        stage = Stage("synth", '"$YOSYS" -q -l top.rpt -p '
+                      '"read_rtlil top.il; synth_ice40 -top top; stat"')
+        with open(os.path.join(synth_dir, "synth.log"), "w") as log:
+            profile_stage(synth_dir, ": ${YOSYS:=yosys}", stage, "synth.sh",
+                          log)
+        if not stage.ok:
+            raise RuntimeError(f"Synthesis failed, see {synth_dir}")
+        used = resources(parse_yosys_stat(os.path.join(synth_dir,
+                                                       "top.rpt")))
+        result["synth_s"] = stage.elapsed
+        result["synth_rss_mib"] = stage.peak_rss / 2**20
+        result["lut"] = used["lut"]
+        result["ff"] = used["ff"]
+    return result
+
+
+def sweep(kinds, ns, widths, cycles=1000, synth_root=None):
+    """
+    Measure every combination of `kinds`, `ns` and `widths`, each in a
+    fresh process, returning a list of results.
+    """
+    results = []
+    for kind in kinds:
+        for width in widths:
+            for n in ns:
+                synth_dir = None
+                if synth_root is not None:
+                    synth_dir = os.path.join(synth_root,
+                                             f"{kind}_n{n}_w{width}")
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    results.append(pool.submit(measure, kind, n, width,
+                                               cycles, synth_dir).result())
+    return results
+
+
+def mark_nonlinear(results, tolerance=2.0):
+    """
+    For each result, add "<cost>_per_bit" for each cost it has, and list
+    under "nonlinear" the costs whose per-bit value is more than
+    `tolerance` times the smallest per-bit value of that cost among
+    smaller designs of the same kind.
+    """
+    for result in results:
+        result["nonlinear"] = []
+        for cost in COSTS:
+            if cost not in result:
+                continue
+            result[f"{cost}_per_bit"] = result[cost] / result["size"]
+            smaller = [other[f"{cost}_per_bit"] for other in results
+                       if other["kind"] == result["kind"]
+                       and other["size"] < result["size"]
+                       and f"{cost}_per_bit" in other]
+            if smaller and \
+                    result[f"{cost}_per_bit"] > tolerance * min(smaller):
+                result["nonlinear"].append(cost)
+    return results
+
+
+def write_results(results, directory):
+    """Write `results` to `scaling.json` and `scaling.csv` in `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "scaling.json"), "w") as f:
+        json.dump(results, f, indent=2)
+    fields = []
+    for result in results:
+        fields += [key for key in result if key not in fields]
+    with open(os.path.join(directory, "scaling.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        for result in results:
+            writer.writerow({**result,
+                             "nonlinear": " ".join(result["nonlinear"])})
+
+
+def format_results(results):
+    lines = [f"  {'kind':<8} {'n':>5} {'width':>5}  {'elab':>8} "
+             f"{'prepare':>8} {'rtlil':>8} {'sim c/s':>9} {'synth':>8} "
+             f"{'RSS':>7}"]
+    for r in results:
+        synth = f"{r['synth_s']:7.2f}s {r['synth_rss_mib']:5.0f}MB" \
+            if "synth_s" in r else ""
+        flags = f"  non-linear: {', '.join(r['nonlinear'])}" \
+            if r["nonlinear"] else ""
+        lines.append(f"  {r['kind']:<8} {r['n']:>5} {r['width']:>5}  "
+                     f"{r['elaborate_s']:7.3f}s {r['prepare_s']:7.3f}s "
+                     f"{r['rtlil_s']:7.3f}s {r['sim_cycles_per_s']:9.0f} "
+                     f"{synth}{flags}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--kinds", nargs="+", choices=KINDS,
+                        default=list(KINDS))
+    parser.add_argument("--n", nargs="+", type=int, default=[1, 4, 16, 64],
+                        help="numbers of copies (default: 1 4 16 64)")
+    parser.add_argument("--width", nargs="+", type=int, default=[8],
+                        help="widths in bits (default: 8)")
+    parser.add_argument("--cycles", type=int, default=1000,
+                        help="cycles to simulate at each point")
+    parser.add_argument("--synth", action="store_true",
+                        help="also synthesise each point with Yosys")
+    parser.add_argument("--tolerance", type=float, default=2.0,
+                        help="per-bit cost ratio marking a non-linear point")
+    parser.add_argument("-o", "--output", default="build/scaling",
+                        help="directory for scaling.csv and scaling.json")
+    args = parser.parse_args(argv)
+
+    synth_root = os.path.join(args.output, "synth") if args.synth else None
+    results = mark_nonlinear(sweep(args.kinds, args.n, args.width,
+                                   args.cycles, synth_root), args.tolerance)
+    write_results(results, args.output)
+    print(format_results(results))
+
+
+def test_scaling():
+    import tempfile
+
+    results = mark_nonlinear(sweep(KINDS, [1, 4], [4, 8], cycles=50))
+    assert len(results) == 12
+    for r in results:
+        assert r["elaborate_s"] > 0 and r["sim_cycles_per_s"] > 0
+    # More copies means more RTLIL, roughly in proportion.
+    for kind in KINDS:
+        small, large = [r["rtlil_bytes"] for r in results
+                        if r["kind"] == kind and r["width"] == 8]
+        assert 2 * small < large < 5 * small
+
+    # Only the point whose cost per bit jumped is marked.
+    fake = [{"kind": "alu", "size": size, "elaborate_s": seconds}
+            for size, seconds in [(8, 0.01), (16, 0.02), (32, 0.2)]]
+    mark_nonlinear(fake)
+    assert [r["nonlinear"] for r in fake] == [[], [], ["elaborate_s"]]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_results(results, tmp)
+        with open(os.path.join(tmp, "scaling.csv")) as f:
+            rows = list(csv.DictReader(f))
+    assert len(rows) == 12 and float(rows[0]["elaborate_s"]) > 0
+
+
+def test_scaling_synth_toolchain():
+    results = sweep(["alu"], [1, 4], [8], cycles=10,
+                    synth_root="build/scaling_test")
+    small, large = results
+    assert small["synth_rss_mib"] > 0 and small["synth_s"] > 0
+    # The copies weren't merged.
+    assert large["lut"] > 3 * small["lut"]
+
+
+if __name__ == "__main__":
+    main()
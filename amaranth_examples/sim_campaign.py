@@ -0,0 +1,414 @@
+"""
+Run randomized simulation campaigns across every core.
+
+The testbenches elsewhere in this package run one at a time inside pytest,
+each checking one fixed design. This runs many simulations at once: each
+job names a design, its parameters, a testbench and a random seed, and the
+jobs are spread over a process pool like build_runner.py's builds. Every
+job runs in its own directory (`build/sim/<name>/`), so anything it writes,
+such as a waveform trace (enabled as usual by the environment variables in
+tracing.py) or a log of the exception which failed it, can't clobber any
+other job's.
+
+The campaigns below each draw a design's parameters from the seed, so a
+campaign of a thousand seeds checks a thousand variants of the core; for
+example, 500 counters with random limits and 500 SPI peripherals with
+random widths and SCK rates:
+
+    python -m amaranth_examples.sim_campaign counter spi --seeds 500 -j 4
+
+A summary of pass/fail, the clock cycles (or for a combinational design,
+test vectors) actually simulated and wall time is printed and
+written to `build/sim/summary.json`. A failed job can be run again on its
+own from its seed:
+
+    python -m amaranth_examples.sim_campaign spi --seeds 1 --first-seed 17
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from amaranth.sim import Simulator, Settle
+
+from amaranth_examples.registry import load
+from amaranth_examples.tracing import TraceConfig, trace
+
+
+class SimJob:
+    """
+    One simulation to run.
+
+    As in build_runner.BuildJob, `design` and `testbench` are
+    "module:attribute" strings, so jobs are cheap to send to the worker
+    processes. The design is created with `params` as keyword arguments,
+    and the testbench is called as `testbench(sim, design, rng, progress)`,
+    with `rng` a `random.Random` seeded with `seed` and `progress` a
+    SimProgress. It adds its processes to `sim`, and any clock with
+    `progress.add_clock()`, and the processes count what they've checked
+    as they go.
+    """
+    def __init__(self, name, design, testbench, seed, params=None):
+        self.name = name
+        self.design = design
+        self.testbench = testbench
+        self.seed = seed
+        self.params = params or {}
+
+    def __repr__(self):
+        return f"SimJob({self.name!r})"
+
+
+class SimProgress:
+    """
+    What a testbench has simulated so far: the clock cycles its processes
+    have waited for, or for a combinational design, the test vectors they
+    have checked. A job which fails part way reports only what ran before
+    it failed.
+    """
+    def __init__(self):
+        self.cycles = 0
+        self.vectors = 0
+        self.clocked = False
+
+    def add_clock(self, sim, period):
+        """Add the sync clock to `sim`, so the design can be traced."""
+        sim.add_clock(period)
+        self.clocked = True
+
+
+class SimResult:
+    """
+    The outcome of one SimJob: whether it passed, what it simulated (as
+    counted in a SimProgress), how long it took, and the exception it
+    failed with, if any.
+    """
+    def __init__(self, job, directory, ok, progress, elapsed, error=None):
+        self.job = job
+        self.directory = directory
+        self.ok = ok
+        self.cycles = progress.cycles
+        self.vectors = progress.vectors
+        self.clocked = progress.clocked
+        self.elapsed = elapsed
+        self.error = error
+
+    def summary(self):
+        return {
+            "name": self.job.name,
+            "design": self.job.design,
+            "testbench": self.job.testbench,
+            "seed": self.job.seed,
+            "params": self.job.params,
+            "ok": self.ok,
+            "cycles": self.cycles,
+            "vectors": self.vectors,
+            "elapsed": self.elapsed,
+            "error": self.error,
+        }
+
+
+def counter_random(sim, counter, rng, progress):
+    """
+    Check the counter and its rollover pulse against a model for a random
+    number of cycles, up to four rollovers.
+    """
+    cycles = rng.randrange(1, 4 * counter.limit + 1)
+
+    def testbench():
+        for step in range(cycles):
+            assert (yield counter.counter) == step % counter.limit
+            assert (yield counter.rollover) == \
+                (step % counter.limit == counter.limit - 1)
+            yield
+            progress.cycles += 1
+
+    progress.add_clock(sim, 1/10e6)
+    sim.add_sync_process(testbench)
+
+
+def alu_random(sim, alu, rng, progress, vectors=200):
+    """Check `vectors` random operand pairs and operations."""
+    mask = 2**alu.width - 1
+
+    def testbench():
+        for _ in range(vectors):
+            a, b, op = rng.getrandbits(alu.width), \
+                rng.getrandbits(alu.width), rng.getrandbits(1)
+            yield alu.a.eq(a)
+            yield alu.b.eq(b)
+            yield alu.op.eq(op)
+            yield Settle()
+            expected = a + b if op else (a - b) % (2 * (mask + 1))
+            assert (yield alu.y) == expected, (a, b, op)
+            progress.vectors += 1
+
+    sim.add_process(testbench)
+
+
+def spi_random(sim, spi, rng, progress):
+    """
+    Exchange between one and eight random words with the peripheral in a
+    single CS assertion each, with SCK's half-period a random 2 to 4 sync
+    cycles. (It needs at least 2 to see each SCK edge in time to update
+    SDO; see spi_fast.py.)
+    """
+    width = len(spi.din)
+    half = rng.randint(2, 4)
+    words = [(rng.getrandbits(width), rng.getrandbits(width))
+             for _ in range(rng.randint(1, 8))]
+
+    def tick():
+        yield
+        progress.cycles += 1
+
+    def testbench():
+        for sent, reply in words:
+            yield spi.csn.eq(1)
+            yield spi.dout.eq(reply)
+            yield from tick()
+            yield spi.csn.eq(0)
+            yield from tick()
+
+            bits = []
+            for bit in reversed(range(width)):
+                bits.append((yield spi.sdo))
+                yield spi.sdi.eq((sent >> bit) & 1)
+                yield spi.sck.eq(1)
+                for _ in range(half):
+                    yield from tick()
+                yield spi.sck.eq(0)
+                for _ in range(half):
+                    yield from tick()
+
+            yield spi.csn.eq(1)
+            yield from tick()
+            assert (yield spi.din) == sent, (sent, half)
+            assert bits == [(reply >> bit) & 1
+                            for bit in reversed(range(width))], (reply, half)
+
+    progress.add_clock(sim, 1/10e6)
+    sim.add_sync_process(testbench)
+
+
+# Each campaign's design, testbench, and the parameters to give the design
+# for a random.Random seeded from the job's seed.
+CAMPAIGNS = {
+    "counter": ("amaranth_examples.counter:Counter",
+                "amaranth_examples.sim_campaign:counter_random",
+                lambda rng: {"limit": rng.randrange(2, 300)}),
+    "alu": ("amaranth_examples.comb_test:ALU",
+            "amaranth_examples.sim_campaign:alu_random",
+            lambda rng: {"width": rng.randint(1, 32)}),
+    "spi": ("amaranth_examples.spi_oversampled:SPIPeriph",
+            "amaranth_examples.sim_campaign:spi_random",
+            lambda rng: {"width": rng.randint(1, 16)}),
+}
+
+
+def campaign_jobs(names, seeds):
+    """A SimJob for each of `seeds` in each campaign in `names`."""
+    jobs = []
+    for name in names:
+        design, testbench, params = CAMPAIGNS[name]
+        for seed in seeds:
+            # Seeded apart from the testbench's own random numbers.
+            rng = random.Random(f"{name} params {seed}")
+            jobs.append(SimJob(f"{name}_{seed}", design, testbench, seed,
+                               params(rng)))
+    return jobs
+
+
+def run_sim(job, root="build/sim", trace_config=None):
+    """
+    Run a single job in `root/<job.name>`, returning a SimResult.
+
+    Any exception, from elaborating the design to a failed assertion in
+    the testbench, fails the job, and is written to `sim.log` in its
+    directory. A waveform trace of a clocked design is written to the same
+    directory if `trace_config` (by default, read from the environment)
+    enables one.
+    """
+    directory = os.path.join(root, job.name)
+    os.makedirs(directory, exist_ok=True)
+    if trace_config is None:
+        trace_config = TraceConfig.from_env()
+    if trace_config is not None:
+        trace_config = TraceConfig(trace_config.signals, trace_config.window,
+                                   directory)
+
+    start = time.perf_counter()
+    progress = SimProgress()
+    error = None
+    with open(os.path.join(directory, "sim.log"), "w") as log:
+        log.write(f"{job.design} {job.params} {job.testbench} "
+                  f"seed {job.seed}\n")
+        try:
+            design = load(job.design)(**job.params)
+            sim = Simulator(design)
+            load(job.testbench)(sim, design, random.Random(job.seed),
+                                progress)
+            # Traces are sampled on the sync clock, so purely combinational
+            # designs can't be traced.
+            tracing = contextlib.nullcontext()
+            if trace_config is not None and progress.clocked:
+                tracing = trace(sim, "trace", config=trace_config)
+            with tracing:
+                sim.run()
+        except Exception as e:
+            log.write(traceback.format_exc())
+            error = f"{type(e).__name__}: {e}"
+    elapsed = time.perf_counter() - start
+    return SimResult(job, directory, error is None, progress, elapsed,
+                     error)
+
+
+def run_campaign(jobs, root="build/sim", workers=None, trace_config=None):
+    """
+    Run all `jobs` using a pool of `workers` processes (by default, one per
+    CPU). Returns the SimResults in the same order as `jobs`.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_sim, job, root, trace_config)
+                   for job in jobs]
+        return [f.result() for f in futures]
+
+
+def write_summary(path, results, wall_time):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({
+            "wall_time": wall_time,
+            "passed": sum(r.ok for r in results),
+            "failed": sum(not r.ok for r in results),
+            "cycles": sum(r.cycles for r in results),
+            "vectors": sum(r.vectors for r in results),
+            "jobs": [r.summary() for r in results],
+        }, f, indent=2)
+
+
+def format_summary(results, wall_time, max_failures=20):
+    """
+    Format totals for each design in `results`, and the first
+    `max_failures` failed jobs.
+    """
+    designs = {}
+    for r in results:
+        designs.setdefault(r.job.design.split(":")[-1], []).append(r)
+    width = max(len(design) for design in designs)
+    lines = []
+    for design, group in designs.items():
+        passed = sum(r.ok for r in group)
+        cycles = sum(r.cycles for r in group)
+        vectors = sum(r.vectors for r in group)
+        count, unit = (vectors, "vectors") if vectors > cycles \
+            else (cycles, "cycles")
+        elapsed = sum(r.elapsed for r in group)
+        lines.append(f"  {design:<{width}}  {passed:>6} passed "
+                     f"{len(group) - passed:>6} failed  {count:>10} {unit:<7} "
+                     f"in {elapsed:8.2f}s ({count / elapsed:8.0f}/s)")
+    failures = [r for r in results if not r.ok]
+    for r in failures[:max_failures]:
+        lines.append(f"  FAILED {r.job.name} {r.job.params}: {r.error} "
+                     f"(see {r.directory})")
+    if len(failures) > max_failures:
+        lines.append(f"  ... and {len(failures) - max_failures} more")
+    serial = sum(r.elapsed for r in results)
+    lines.append(f"{len(results)} simulations in {wall_time:.2f}s wall clock "
+                 f"({serial:.2f}s if run one after another), "
+                 f"{len(failures)} failed")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("campaigns", nargs="+", choices=CAMPAIGNS,
+                        metavar="campaign",
+                        help=f"any of: {', '.join(CAMPAIGNS)}")
+    parser.add_argument("--seeds", type=int, default=100,
+                        help="number of seeds per campaign (default: 100)")
+    parser.add_argument("--first-seed", type=int, default=0,
+                        help="first seed to run (default: 0)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of parallel simulations "
+                             "(default: CPUs)")
+    parser.add_argument("--sim-dir", default="build/sim",
+                        help="root directory for per-job directories")
+    args = parser.parse_args(argv)
+
+    jobs = campaign_jobs(args.campaigns, range(
+        args.first_seed, args.first_seed + args.seeds))
+    start = time.perf_counter()
+    results = run_campaign(jobs, args.sim_dir, args.jobs)
+    wall_time = time.perf_counter() - start
+    write_summary(os.path.join(args.sim_dir, "summary.json"), results,
+                  wall_time)
+    print(format_summary(results, wall_time))
+    return 0 if all(r.ok for r in results) else 1
+
+
+def test_sim_campaign():
+    import tempfile
+    from amaranth_examples.tracing import read_changes
+
+    jobs = campaign_jobs(CAMPAIGNS, range(4))
+    assert [job.params for job in jobs] == \
+        [job.params for job in campaign_jobs(CAMPAIGNS, range(4))]
+    assert len({job.params["width"] for job in jobs
+                if job.name.startswith("spi")}) > 1
+    # The counter testbench can't drive an ALU, and a pipelined ALU doesn't
+    # settle to its result, so it fails on its first vector.
+    jobs.append(SimJob("broken", "amaranth_examples.comb_test:ALU",
+                       "amaranth_examples.sim_campaign:counter_random", 0))
+    jobs.append(SimJob("late", "amaranth_examples.alu_pipelined:PipelinedALU",
+                       "amaranth_examples.sim_campaign:alu_random", 0))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run_campaign(jobs, tmp, workers=2,
+                               trace_config=TraceConfig(["sdo"]))
+        *passed, broken, late = results
+        assert all(r.ok for r in passed), \
+            [r.error for r in passed if not r.ok]
+        assert not broken.ok and "AttributeError" in broken.error
+        assert not late.ok and "AssertionError" in late.error
+        assert (broken.cycles, late.vectors) == (0, 0)
+
+        # Each job counted what its testbench actually ran.
+        for r in passed:
+            rng = random.Random(r.job.seed)
+            if r.job.name.startswith("counter"):
+                expected = rng.randrange(1, 4 * r.job.params["limit"] + 1)
+            elif r.job.name.startswith("spi"):
+                # The word count is drawn before the words themselves.
+                half, words = rng.randint(2, 4), rng.randint(1, 8)
+                expected = words * (3 + 2 * half * r.job.params["width"])
+            else:
+                assert (r.cycles, r.vectors, r.clocked) == (0, 200, False)
+                continue
+            assert (r.cycles, r.vectors, r.clocked) == (expected, 0, True)
+        with open(os.path.join(tmp, "broken", "sim.log")) as f:
+            assert "Traceback" in f.read()
+
+        # Each SPI job traced into its own directory.
+        for r in passed:
+            if r.job.name.startswith("spi"):
+                changes = read_changes(os.path.join(r.directory,
+                                                    "trace.vcd.gz"))
+                assert list(changes) == ["top.sdo"]
+
+        write_summary(os.path.join(tmp, "summary.json"), results, 1.0)
+        with open(os.path.join(tmp, "summary.json")) as f:
+            summary = json.load(f)
+    assert summary["passed"] == 12 and summary["failed"] == 2
+    assert summary["vectors"] == 800
+    formatted = format_summary(results, 1.0)
+    assert "FAILED broken" in formatted and " 800 vectors" in formatted
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
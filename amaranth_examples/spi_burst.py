@@ -0,0 +1,310 @@
+"""
+A streaming SPI peripheral which sends and receives back-to-back bytes.
+
+Like spi_oversampled.py, this oversamples SCLK from the sync domain and uses
+SPI mode 0, but instead of a single `din`/`dout` register that the host must
+poll and reload between bytes, received bytes are pushed into a receive FIFO
+and bytes to send are taken from a transmit FIFO. Both FIFOs are exposed as
+valid/ready streams. Consecutive bytes within one CS assertion are sent and
+received with no gap cycles, so the SPI controller can clock continuously.
+
+If the transmit FIFO was empty when the controller starts clocking out a new
+byte, zeros are sent and `tx_underflow` is pulsed; if the receive FIFO is
+full when a byte completes, it is dropped and `rx_overflow` is pulsed.
+"""
+
+import random
+
+from amaranth import Module, Signal, Elaboratable, Cat
+from amaranth.lib.fifo import SyncFIFOBuffered
+from amaranth.sim import Simulator, Settle, Passive
+
+
+class SPIBurstPeriph(Elaboratable):
+    def __init__(self, depth=16):
+        self.depth = depth
+
+        # Stream of bytes received from the controller
+        self.rx_data = Signal(8)
+        self.rx_valid = Signal()
+        self.rx_ready = Signal()
+
+        # Stream of bytes to send to the controller
+        self.tx_data = Signal(8)
+        self.tx_valid = Signal()
+        self.tx_ready = Signal()
+
+        # FIFO occupancy, and strobes for bytes that couldn't be handled
+        self.rx_level = Signal(range(depth + 1))
+        self.tx_level = Signal(range(depth + 1))
+        self.rx_overflow = Signal()
+        self.tx_underflow = Signal()
+
+        # Pulsed for one cycle when each byte has been received
+        self.byte_done = Signal()
+
+        # SPI interface
+        self.csn = Signal()
+        self.sck = Signal()
+        self.sdi = Signal()
+        self.sdo = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        rx_fifo = m.submodules.rx_fifo = SyncFIFOBuffered(
+            width=8, depth=self.depth)
+        tx_fifo = m.submodules.tx_fifo = SyncFIFOBuffered(
+            width=8, depth=self.depth)
+
+        # Connect the FIFOs to the stream interfaces.
+        m.d.comb += [
+            self.rx_data.eq(rx_fifo.r_data),
+            self.rx_valid.eq(rx_fifo.r_rdy),
+            rx_fifo.r_en.eq(self.rx_ready),
+            self.rx_level.eq(rx_fifo.level),
+
+            tx_fifo.w_data.eq(self.tx_data),
+            tx_fifo.w_en.eq(self.tx_valid),
+            self.tx_ready.eq(tx_fifo.w_rdy),
+            self.tx_level.eq(tx_fifo.level),
+        ]
+
+        # Detect edges on SCK
+        last_sck = Signal()
+        m.d.sync += last_sck.eq(self.sck)
+        sck_rose = Signal()
+        sck_fell = Signal()
+        m.d.comb += sck_rose.eq(self.sck & ~last_sck)
+        m.d.comb += sck_fell.eq(~self.sck & last_sck)
+
+        # Count bits within the current byte. This wraps to 0 on the eighth
+        # rising edge, so on the following falling edge `bit == 0` tells us
+        # to start shifting out the next byte.
+        bit = Signal(range(8))
+        din = Signal(8)
+        dout = Signal(8)
+
+        # Whether `dout` holds a byte from the transmit FIFO that hasn't
+        # started being sent yet.
+        loaded = Signal()
+
+        # Always output the current most significant bit of `dout`.
+        m.d.comb += self.sdo.eq(dout[-1])
+
+        with m.If(self.csn):
+            m.d.sync += bit.eq(0)
+            # Between transfers, preload the first byte to send, since its
+            # first bit must be on SDO before the first rising edge.
+            with m.If(~loaded & tx_fifo.r_rdy):
+                m.d.comb += tx_fifo.r_en.eq(1)
+                m.d.sync += dout.eq(tx_fifo.r_data), loaded.eq(1)
+
+        with m.Else():
+            # Capture SDI into `din` on rising edge, and push each complete
+            # byte into the receive FIFO.
+            with m.If(sck_rose):
+                m.d.sync += din.eq(Cat(self.sdi, din)), bit.eq(bit + 1)
+                m.d.sync += loaded.eq(0)
+                with m.If((bit == 0) & ~loaded):
+                    m.d.comb += self.tx_underflow.eq(1)
+                with m.If(bit == 7):
+                    m.d.comb += [
+                        rx_fifo.w_data.eq(Cat(self.sdi, din)),
+                        rx_fifo.w_en.eq(1),
+                        self.byte_done.eq(1),
+                        self.rx_overflow.eq(~rx_fifo.w_rdy),
+                    ]
+
+            # Shift `dout` into SDO on falling edge, or once a whole byte
+            # has been sent, load the next byte from the transmit FIFO.
+            with m.If(sck_fell):
+                with m.If(bit == 0):
+                    with m.If(tx_fifo.r_rdy):
+                        m.d.comb += tx_fifo.r_en.eq(1)
+                        m.d.sync += dout.eq(tx_fifo.r_data), loaded.eq(1)
+                    with m.Else():
+                        m.d.sync += dout.eq(0)
+                with m.Else():
+                    m.d.sync += dout.eq(dout.rotate_left(1))
+
+        return m
+
+
+def run_burst(n_bytes, host_interval=32, depth=16, seed=0):
+    """
+    Simulate a single CS assertion transferring `n_bytes` in each direction,
+    with SCK at 1/4 of the sync frequency.
+
+    A host process services the peripheral's streams once every
+    `host_interval` sync cycles, topping up the transmit FIFO and draining
+    the receive FIFO.
+
+    A monitor watches the peripheral while CS is asserted, counting SCK
+    cycles and the peripheral's `byte_done`, `rx_overflow` and
+    `tx_underflow` pulses, and sampling both FIFO levels every cycle.
+    Returns a dict of statistics, including the bytes per SCK cycle which
+    actually got through in each direction: bytes the peripheral received
+    and kept, and bytes it sent from the transmit FIFO rather than zeros.
+
+    Checks that the bytes which got through arrived intact and in order,
+    and that only the bytes counted as lost went missing.
+    """
+    spi = SPIBurstPeriph(depth)
+    rng = random.Random(seed)
+    to_periph = [rng.randrange(256) for _ in range(n_bytes)]
+    # The host has more bytes to send than the controller will clock out,
+    # so the transmit FIFO only runs low if the host falls behind.
+    to_ctrl = [rng.randrange(256) for _ in range(n_bytes + depth + 2)]
+    received_by_periph = []
+    received_by_ctrl = []
+    stats = {"depth": depth, "sck_cycles": 0, "bytes_done": 0,
+             "rx_overflows": 0, "tx_underflows": 0,
+             "rx_high_water": 0, "tx_low_water": depth}
+    done = False
+
+    def host():
+        tx_queue = list(to_ctrl)
+        while not done:
+            # Drain the receive FIFO. Each byte is taken at the clock edge
+            # where both valid and ready are high.
+            yield spi.rx_ready.eq(1)
+            yield Settle()
+            while (yield spi.rx_valid):
+                received_by_periph.append((yield spi.rx_data))
+                yield
+                yield Settle()
+            yield spi.rx_ready.eq(0)
+
+            # Top up the transmit FIFO.
+            yield spi.tx_valid.eq(1)
+            yield Settle()
+            while tx_queue and (yield spi.tx_ready):
+                yield spi.tx_data.eq(tx_queue.pop(0))
+                yield
+                yield Settle()
+            yield spi.tx_valid.eq(0)
+
+            for _ in range(host_interval):
+                yield
+
+    def controller():
+        nonlocal done
+        yield spi.csn.eq(1)
+        # Give the host time to fill the transmit FIFO before we start.
+        for _ in range(4 * host_interval):
+            yield
+
+        yield spi.csn.eq(0)
+        yield
+        yield
+
+        for byte in to_periph:
+            rx = 0
+            for bit in range(8):
+                # On the rising edge, capture the output and set new input.
+                rx = (rx << 1) | (yield spi.sdo)
+                yield spi.sdi.eq((byte >> (7 - bit)) & 1)
+                yield spi.sck.eq(1)
+                yield
+                yield
+
+                yield spi.sck.eq(0)
+                yield
+                yield
+            received_by_ctrl.append(rx)
+
+        # Wait for the last byte to reach the receive FIFO.
+        yield
+        yield
+        yield spi.csn.eq(1)
+        # Let the host drain the last few bytes.
+        for _ in range(4 * host_interval):
+            yield
+        done = True
+
+    def monitor():
+        yield Passive()
+        # CS starts out low until the controller's first cycle.
+        while not (yield spi.csn):
+            yield
+        last_sck = 0
+        while True:
+            if not (yield spi.csn):
+                sck = yield spi.sck
+                stats["sck_cycles"] += sck and not last_sck
+                last_sck = sck
+                stats["bytes_done"] += yield spi.byte_done
+                stats["rx_overflows"] += yield spi.rx_overflow
+                stats["tx_underflows"] += yield spi.tx_underflow
+                stats["rx_high_water"] = max(stats["rx_high_water"],
+                                             (yield spi.rx_level))
+                stats["tx_low_water"] = min(stats["tx_low_water"],
+                                            (yield spi.tx_level))
+            yield
+
+    sim = Simulator(spi)
+    sim.add_clock(1/10e6)
+    sim.add_sync_process(controller)
+    sim.add_sync_process(host)
+    sim.add_sync_process(monitor)
+    sim.run()
+
+    rx_bytes = stats["bytes_done"] - stats["rx_overflows"]
+    tx_bytes = stats["bytes_done"] - stats["tx_underflows"]
+    stats["rx_bytes_per_sck"] = rx_bytes / stats["sck_cycles"]
+    stats["tx_bytes_per_sck"] = tx_bytes / stats["sck_cycles"]
+
+    # Lost bytes are dropped whole, so what did arrive is in order.
+    assert len(received_by_periph) == rx_bytes
+    assert _is_subsequence(received_by_periph, to_periph)
+    sent = [byte for byte in received_by_ctrl if byte != 0]
+    assert _is_subsequence(sent, to_ctrl)
+    if not stats["rx_overflows"] and not stats["tx_underflows"]:
+        assert received_by_periph == to_periph
+        assert received_by_ctrl == to_ctrl[:n_bytes]
+    return stats
+
+
+def _is_subsequence(items, sequence):
+    remaining = iter(sequence)
+    return all(item in remaining for item in items)
+
+
+def test_spi_burst():
+    stats = run_burst(2048)
+    print(stats)
+
+    # Every byte got through in both directions with no gaps, so each
+    # SCK cycle carried one bit.
+    assert stats["bytes_done"] == 2048
+    assert stats["rx_bytes_per_sck"] == stats["tx_bytes_per_sck"] == 1 / 8
+
+    # A host servicing the FIFOs every 32 cycles (one byte time, plus the
+    # time servicing takes) never lets more than two bytes pile up in the
+    # receive FIFO, or the transmit FIFO fall more than two below full.
+    assert 1 <= stats["rx_high_water"] <= 2
+    assert stats["depth"] - 2 <= stats["tx_low_water"] < stats["depth"]
+
+
+def test_spi_burst_slow_host():
+    # A host servicing the FIFOs every 256 cycles (eight byte times) fills
+    # more of the FIFOs, but as long as they're deep enough to cover the
+    # interval, no bytes are lost.
+    stats = run_burst(512, host_interval=256)
+    print(stats)
+    assert stats["rx_bytes_per_sck"] == stats["tx_bytes_per_sck"] == 1 / 8
+    assert 8 <= stats["rx_high_water"] <= 10
+    assert stats["depth"] - 10 <= stats["tx_low_water"] <= stats["depth"] - 8
+
+
+def test_spi_burst_overflow():
+    # With FIFOs of only four bytes, the same host can't keep up: about
+    # half of each eight bytes is dropped on receive, or replaced by zeros
+    # on transmit.
+    stats = run_burst(512, host_interval=256, depth=4)
+    print(stats)
+    assert stats["rx_high_water"] == stats["depth"]
+    assert stats["tx_low_water"] == 0
+    for direction in ("rx", "tx"):
+        assert 1 / 32 < stats[f"{direction}_bytes_per_sck"] < 1 / 12
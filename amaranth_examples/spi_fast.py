@@ -0,0 +1,232 @@
+"""
+A SPI peripheral which runs its shift registers directly from SCLK, so the
+SPI clock can be as fast as, or faster than, the internal sync domain.
+
+The oversampled SPIPeriph in spi_oversampled.py has to see every SCLK level
+for at least one sync cycle (in practice it needs SCLK to be about 1/3 of the
+sync frequency or slower). Here instead, SDI is shifted in by an "spi" clock
+domain clocked by the rising edge of SCLK, and SDO is shifted out by an
+"spi_n" domain clocked by the falling edge, using SPI mode 0 as before.
+The bit counters are held in reset while CS is deasserted.
+
+Bytes cross between the SPI domains and sync with a toggle handshake: when
+a byte has been received, the SPI side copies it to a holding register and
+flips a toggle bit, which is synchronised into sync with an FFSynchronizer.
+The holding register is then stable for the next eight SCLK periods, which
+is plenty of time for sync to notice the toggle and read it. The same
+scheme tells sync when `dout` has been taken so the next byte can be loaded.
+
+In hardware SCLK must enter the FPGA on a clock-capable pin. The testbench
+sweeps the ratio of SCLK to the sync clock frequency for both this design
+and the oversampled SPIPeriph, and reports the highest ratio each passes.
+"""
+
+from amaranth import Module, Signal, Elaboratable, Cat, Mux, ClockDomain
+from amaranth.lib.cdc import FFSynchronizer
+from amaranth.sim import Simulator, Delay, Settle, Passive
+
+from amaranth_examples.spi_oversampled import SPIPeriph
+
+
+class SPIFastPeriph(Elaboratable):
+    def __init__(self):
+        # Data received from controller, valid when `din_valid` is pulsed
+        self.din = Signal(8)
+        self.din_valid = Signal()
+
+        # Data to send to controller. `dout_ack` is pulsed once the current
+        # value has been taken, after which the next byte can be written;
+        # it must be written within about six SCLK periods.
+        self.dout = Signal(8)
+        self.dout_ack = Signal()
+
+        # SPI interface
+        self.csn = Signal()
+        self.sck = Signal()
+        self.sdi = Signal()
+        self.sdo = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        # Create the SCLK clock domains. The bit counters are in "spi" and
+        # "spi_n", which are held in reset whenever CS is deasserted. Logic
+        # in an asynchronously reset domain is also evaluated on the reset
+        # edge, even for reset_less signals, so the holding registers and
+        # toggles live in twin domains clocked by the same edges but with
+        # no reset at all; otherwise CS deasserting could flip a toggle.
+        for name, edge, reset in (("spi", "pos", True),
+                                  ("spi_n", "neg", True),
+                                  ("spi_hold", "pos", False),
+                                  ("spi_n_hold", "neg", False)):
+            cd = ClockDomain(name, clk_edge=edge, async_reset=reset,
+                             reset_less=not reset, local=True)
+            m.domains += cd
+            m.d.comb += cd.clk.eq(self.sck)
+            if reset:
+                m.d.comb += cd.rst.eq(self.csn)
+
+        # Receive: shift SDI in on each rising edge, and on the eighth copy
+        # the whole byte to `rx_hold` and flip `rx_toggle`.
+        rx_bit = Signal(range(8))
+        rx_shreg = Signal(7)
+        rx_hold = Signal(8)
+        rx_toggle = Signal()
+        m.d.spi += rx_bit.eq(rx_bit + 1), rx_shreg.eq(Cat(self.sdi, rx_shreg))
+        with m.If(rx_bit == 7):
+            m.d.spi_hold += [
+                rx_hold.eq(Cat(self.sdi, rx_shreg)),
+                rx_toggle.eq(~rx_toggle),
+            ]
+
+        rx_toggle_sync = Signal()
+        rx_toggle_last = Signal()
+        m.submodules.rx_sync = FFSynchronizer(rx_toggle, rx_toggle_sync)
+        m.d.sync += rx_toggle_last.eq(rx_toggle_sync)
+        m.d.sync += self.din_valid.eq(rx_toggle_sync != rx_toggle_last)
+        with m.If(rx_toggle_sync != rx_toggle_last):
+            m.d.sync += self.din.eq(rx_hold)
+
+        # Transmit: the first bit is driven straight from `dout` until the
+        # first falling edge, which takes a copy of the rest of the byte.
+        # Each eighth falling edge after that takes the next byte whole.
+        # Every time `dout` is taken, `tx_toggle` flips.
+        tx_bit = Signal(range(8))
+        tx_shreg = Signal(8)
+        started = Signal()
+        tx_toggle = Signal()
+        m.d.spi_n += tx_bit.eq(tx_bit + 1), started.eq(1)
+        with m.If(~started):
+            m.d.spi_n_hold += tx_shreg.eq(self.dout << 1)
+            m.d.spi_n_hold += tx_toggle.eq(~tx_toggle)
+        with m.Elif(tx_bit == 7):
+            m.d.spi_n_hold += tx_shreg.eq(self.dout)
+            m.d.spi_n_hold += tx_toggle.eq(~tx_toggle)
+        with m.Else():
+            m.d.spi_n_hold += tx_shreg.eq(tx_shreg << 1)
+        m.d.comb += self.sdo.eq(Mux(started, tx_shreg[-1], self.dout[-1]))
+
+        tx_toggle_sync = Signal()
+        tx_toggle_last = Signal()
+        m.submodules.tx_sync = FFSynchronizer(tx_toggle, tx_toggle_sync)
+        m.d.sync += tx_toggle_last.eq(tx_toggle_sync)
+        m.d.comb += self.dout_ack.eq(tx_toggle_sync != tx_toggle_last)
+
+        return m
+
+
+def spi_transfer(dut, ratio, to_periph, to_ctrl, phase=0.3, sync_hz=100e6):
+    """
+    Simulate a SPI controller clocking `to_periph` into `dut` with SCLK at
+    `ratio` times the sync clock frequency, starting `phase` of a sync
+    period away from the sync clock edges.
+
+    For SPIFastPeriph, a host process writes each byte of `to_ctrl` to
+    `dout` as the previous one is taken, and collects bytes from `din`;
+    SPIPeriph can only transfer a single byte, from and to its registers.
+
+    Returns (bytes received by the peripheral, bytes received by the
+    controller).
+    """
+    sync_period = 1 / sync_hz
+    half_sck = sync_period / ratio / 2
+    fast = isinstance(dut, SPIFastPeriph)
+    received_by_periph = []
+    received_by_ctrl = []
+
+    def host():
+        # The host runs for as long as the controller does.
+        yield Passive()
+        tx_queue = list(to_ctrl)
+        yield dut.dout.eq(tx_queue.pop(0))
+        while True:
+            yield Settle()
+            if (yield dut.din_valid):
+                received_by_periph.append((yield dut.din))
+            if (yield dut.dout_ack) and tx_queue:
+                yield dut.dout.eq(tx_queue.pop(0))
+            yield
+
+    def controller():
+        yield dut.csn.eq(1)
+        if not fast:
+            yield dut.dout.eq(to_ctrl[0])
+        yield Delay(4 * sync_period + phase * sync_period)
+        yield dut.csn.eq(0)
+        yield Delay(max(half_sck, 3 * sync_period))
+
+        for byte in to_periph:
+            rx = 0
+            for bit in range(8):
+                # On the rising edge, capture the output and set new input.
+                yield Settle()
+                rx = (rx << 1) | (yield dut.sdo)
+                yield dut.sdi.eq((byte >> (7 - bit)) & 1)
+                yield Delay(half_sck / 2)
+                yield dut.sck.eq(1)
+                yield Delay(half_sck)
+                yield dut.sck.eq(0)
+                yield Delay(half_sck / 2)
+            received_by_ctrl.append(rx)
+
+        yield Delay(max(half_sck, 3 * sync_period))
+        yield dut.csn.eq(1)
+        yield Delay(8 * sync_period)
+        if not fast:
+            received_by_periph.append((yield dut.din))
+
+    sim = Simulator(dut)
+    sim.add_clock(sync_period)
+    sim.add_process(controller)
+    if fast:
+        sim.add_sync_process(host)
+    sim.run()
+
+    return received_by_periph, received_by_ctrl
+
+
+def max_passing_ratio(make_dut, ratios, n_bytes):
+    """
+    Return the highest SCLK/sync ratio in `ratios` at which `n_bytes`
+    transfer correctly in both directions at several clock phases, and
+    below which every ratio also passed.
+    """
+    to_periph = [(0x3C + 0x61 * i) & 0xFF for i in range(n_bytes)]
+    to_ctrl = [(0xA5 + 0x37 * i) & 0xFF for i in range(n_bytes)]
+    best = None
+    for ratio in sorted(ratios):
+        for phase in (0.13, 0.47, 0.81):
+            result = spi_transfer(make_dut(), ratio, to_periph, to_ctrl, phase)
+            if result != (to_periph, to_ctrl):
+                return best
+        best = ratio
+    return best
+
+
+RATIOS = [0.1, 0.2, 0.25, 1/3, 0.4, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0, 3.0]
+
+
+def test_spi_fast_periph():
+    # Check a multi-byte transfer at the sync frequency.
+    to_periph = [0x55, 0x00, 0xFF, 0x81]
+    to_ctrl = [0xAB, 0xCD, 0x12, 0x7E]
+    result = spi_transfer(SPIFastPeriph(), 1.0, to_periph, to_ctrl)
+    assert result == (to_periph, to_ctrl)
+
+
+def test_spi_ratio_sweep():
+    oversampled = max_passing_ratio(SPIPeriph, RATIOS, n_bytes=1)
+    fast = max_passing_ratio(SPIFastPeriph, RATIOS, n_bytes=4)
+    # None means even the slowest ratio failed.
+    assert oversampled is not None, f"SPIPeriph failed at {min(RATIOS)}"
+    assert fast is not None, f"SPIFastPeriph failed at {min(RATIOS)}"
+    print(f"Highest passing SCLK/sync ratio: oversampled {oversampled:.2f}, "
+          f"SCLK-clocked {fast:.2f}")
+    # The oversampled design needs SCLK at about 1/3 of sync or slower,
+    # while clocking directly from SCLK works beyond twice sync.
+    assert oversampled < 1/3
+    assert fast >= 2.0
+
+
+if __name__ == "__main__":
+    test_spi_ratio_sweep()
@@ -8,20 +8,23 @@ data is sampled on the rising edge and changed on the falling edge.
 This works when the external SPI clock is sufficiently slow (maybe 1/3 or less
 of the sync frequency); for higher-speed SPI clocks it would be better to run
 some logic directly from that external clock (which likely then needs to enter
-the FPGA via a clock input pin) and synchronise the data internally.
+the FPGA via a clock input pin) and synchronise the data internally, as in
+spi_fast.py.
 """
 
 from amaranth import Module, Signal, Elaboratable, Cat
 from amaranth.sim import Simulator
 
+from amaranth_examples.tracing import trace
+
 
 class SPIPeriph(Elaboratable):
-    def __init__(self):
+    def __init__(self, width=8):
         # Data received from controller
-        self.din = Signal(8)
+        self.din = Signal(width)
 
         # Data to send to controller
-        self.dout = Signal(8)
+        self.dout = Signal(width)
 
         # SPI interface
         self.csn = Signal()
@@ -100,6 +103,7 @@ def test_spi_periph():
     sim.add_clock(1/10e6)
     sim.add_sync_process(testbench)
 
-    # Output a VCD file for visualisation.
-    with sim.write_vcd("spi.vcd"):
+    # Output waveforms for visualisation, if enabled by setting the
+    # AMARANTH_EXAMPLES_TRACE environment variable; see tracing.py.
+    with trace(sim, "spi", period=1/10e6):
         sim.run()
@@ -0,0 +1,398 @@
+"""
+A memory-mapped register file in block RAM, accessed over SPI with bursts.
+
+SPIPeriph from spi_oversampled.py only shifts raw bytes in and out, so a
+host reading or writing a register would have to send each address and
+value as a separate CS assertion and poll between them. SPIRegisterFile
+builds on SPIPeriph to give each CS assertion a header followed by data,
+in the style of SPI flash chips:
+
+    0x02 (WRITE), address high byte, address low byte, data, data, ...
+    0x03 (READ),  address high byte, address low byte, then the peripheral
+                  sends data, data, ... while the host sends anything
+
+Each data byte is written to, or read from, an 8-bit wide Memory which
+synthesises to block RAM, and the address increments after every byte
+(wrapping at the end of the memory) for as long as CS stays asserted, so
+a whole block moves in one transaction. The peripheral sends zeros during
+the header. Read data is fetched as soon as the last address bit arrives,
+which gives the block RAM's one cycle of read latency time to complete
+before the first data bit is due on the following SCK falling edge; each
+following address is prefetched the same way.
+
+On the iCE40, block RAM reads as all zeros for about 3µs after the device
+is configured (see pll_ice40.py). Amaranth holds the `sync` domain it
+creates in reset for long enough, but not a domain you create yourself,
+such as one from a PLL, so the register file keeps its own start-up timer:
+until `ready` goes high it ignores SPI transactions, including the rest of
+any transaction already under way when it does.
+
+The testbench compares how many bytes per second a host can move with one
+burst against one register per transaction.
+"""
+
+import math
+import random
+
+from amaranth import Module, Signal, Elaboratable, Cat, Memory, Mux
+from amaranth.build import Resource, Subsignal, Pins, PinsN, Attrs
+from amaranth.lib.enum import Enum
+from amaranth.sim import Simulator
+
+from amaranth_examples.spi_oversampled import SPIPeriph
+
+
+WRITE = 0x02
+READ = 0x03
+
+
+class Phase(Enum, shape=3):
+    COMMAND = 0
+    ADDR_HIGH = 1
+    ADDR_LOW = 2
+    DATA = 3
+    IGNORE = 4
+
+
+class SPIRegisterFile(SPIPeriph):
+    """
+    `depth` bytes of block RAM, optionally starting with the contents of
+    `init`, behind an SPIPeriph. `depth` must be a power of two, so that
+    addresses wrap by ignoring their upper bits. `clk_freq` is the
+    frequency of the domain it runs in, used to time the start-up delay of
+    `startup` seconds; if it's None, the platform's default clock
+    frequency is used, and without a platform (in simulation) there's no
+    delay.
+    """
+    def __init__(self, depth=1024, init=None, clk_freq=None, startup=15e-6):
+        super().__init__()
+        if depth > 2**16:
+            raise ValueError("Addresses are two bytes, so the depth can't "
+                             "be more than 65536")
+        if depth < 1 or depth & (depth - 1):
+            raise ValueError(f"Depth must be a power of two, not {depth}")
+        self.depth = depth
+        self.clk_freq = clk_freq
+        self.startup = startup
+        self.mem = Memory(width=8, depth=depth, init=init)
+
+        # High once the start-up delay has passed
+        self.ready = Signal()
+
+        # Pulsed for one cycle when each byte has been received
+        self.byte_done = Signal()
+
+    def elaborate(self, platform):
+        # SPIPeriph shifts SDI into `din` and `dout` out of SDO; we load
+        # `dout` with each byte to send, overriding its rotation.
+        m = super().elaborate(platform)
+
+        m.submodules.rdport = rdport = self.mem.read_port(transparent=False)
+        m.submodules.wrport = wrport = self.mem.write_port()
+
+        clk_freq = self.clk_freq
+        if clk_freq is None and platform is not None:
+            clk_freq = platform.default_clk_frequency
+        if clk_freq:
+            delay = math.ceil(self.startup * clk_freq)
+            timer = Signal(range(delay + 1))
+            with m.If(timer == delay):
+                m.d.sync += self.ready.eq(1)
+            with m.Else():
+                m.d.sync += timer.eq(timer + 1)
+        else:
+            m.d.comb += self.ready.eq(1)
+
+        # Detect edges on SCK, in step with SPIPeriph.
+        last_sck = Signal()
+        m.d.sync += last_sck.eq(self.sck)
+        sck_rose = Signal()
+        sck_fell = Signal()
+        m.d.comb += sck_rose.eq(self.sck & ~last_sck)
+        m.d.comb += sck_fell.eq(~self.sck & last_sck)
+
+        # Count bits within the current byte. On the eighth rising edge the
+        # whole byte is the last bit on SDI plus what's already in `din`,
+        # and `bit` wraps to 0 ready for the following falling edge.
+        bit = Signal(range(8))
+        byte = Signal(8)
+        m.d.comb += byte.eq(Cat(self.sdi, self.din[:7]))
+
+        phase = Signal(Phase)
+        command = Signal(8)
+        addr = Signal(range(self.depth))
+        addr_high = Signal(8)
+        next_addr = Signal(range(self.depth))
+        m.d.comb += next_addr.eq(Mux(addr == self.depth - 1, 0, addr + 1))
+
+        # The read port normally looks at the current address, so its data
+        # is the byte to send next.
+        m.d.comb += rdport.addr.eq(addr)
+
+        with m.If(self.csn):
+            m.d.sync += bit.eq(0), self.dout.eq(0)
+            m.d.sync += phase.eq(Mux(self.ready, Phase.COMMAND,
+                                     Phase.IGNORE))
+
+        with m.Else():
+            with m.If(~self.ready):
+                m.d.sync += phase.eq(Phase.IGNORE)
+
+            with m.If(sck_rose):
+                m.d.sync += bit.eq(bit + 1)
+                with m.If(bit == 7):
+                    m.d.comb += self.byte_done.eq(1)
+                    with m.Switch(phase):
+                        with m.Case(Phase.COMMAND):
+                            m.d.sync += command.eq(byte)
+                            with m.If((byte == WRITE) | (byte == READ)):
+                                m.d.sync += phase.eq(Phase.ADDR_HIGH)
+                            with m.Else():
+                                m.d.sync += phase.eq(Phase.IGNORE)
+                        with m.Case(Phase.ADDR_HIGH):
+                            m.d.sync += addr_high.eq(byte)
+                            m.d.sync += phase.eq(Phase.ADDR_LOW)
+                        with m.Case(Phase.ADDR_LOW):
+                            # Start reading the first byte straight away.
+                            full = Cat(byte, addr_high)[:len(addr)]
+                            m.d.comb += rdport.addr.eq(full)
+                            m.d.sync += addr.eq(full)
+                            m.d.sync += phase.eq(Phase.DATA)
+                        with m.Case(Phase.DATA):
+                            with m.If(command == WRITE):
+                                m.d.comb += [
+                                    wrport.addr.eq(addr),
+                                    wrport.data.eq(byte),
+                                    wrport.en.eq(1),
+                                ]
+                            # And prefetch the next byte to read.
+                            m.d.comb += rdport.addr.eq(next_addr)
+                            m.d.sync += addr.eq(next_addr)
+
+            # Once a whole byte has been sent, start sending the byte read
+            # from memory, or zeros.
+            with m.If(sck_fell & (bit == 0)):
+                with m.If((phase == Phase.DATA) & (command == READ)):
+                    m.d.sync += self.dout.eq(rdport.data)
+                with m.Else():
+                    m.d.sync += self.dout.eq(0)
+
+        return m
+
+
+class Top(Elaboratable):
+    """
+    A register file on the iCEBreaker, with its SPI interface on PMOD 1A.
+    """
+    def elaborate(self, platform):
+        m = Module()
+        platform.add_resources([
+            Resource("spi_regfile", 0,
+                     Subsignal("cs", PinsN("1", dir="i", conn=("pmod", 0))),
+                     Subsignal("clk", Pins("4", dir="i", conn=("pmod", 0))),
+                     Subsignal("copi", Pins("2", dir="i", conn=("pmod", 0))),
+                     Subsignal("cipo", Pins("3", dir="o", conn=("pmod", 0))),
+                     Attrs(IO_STANDARD="SB_LVCMOS")),
+        ])
+        spi = platform.request("spi_regfile", 0)
+        m.submodules.regfile = regfile = SPIRegisterFile()
+        m.d.comb += [
+            regfile.csn.eq(~spi.cs.i),
+            regfile.sck.eq(spi.clk.i),
+            regfile.sdi.eq(spi.copi.i),
+            spi.cipo.o.eq(regfile.sdo),
+        ]
+        return m
+
+
+class SPIHost:
+    """
+    Testbench helpers acting as an SPI controller for `spi`, clocking SCK
+    at 1/4 of the sync frequency and counting the sync cycles it takes.
+    """
+    def __init__(self, spi, gap=4):
+        self.spi = spi
+        self.gap = gap
+        self.cycles = 0
+
+    def tick(self, n=1):
+        for _ in range(n):
+            yield
+        self.cycles += n
+
+    def transfer(self, data):
+        """Send `data` in one CS assertion, returning the bytes received."""
+        spi = self.spi
+        yield spi.csn.eq(0)
+        yield from self.tick()
+        received = []
+        for byte in data:
+            rx = 0
+            for bit in range(8):
+                rx = (rx << 1) | (yield spi.sdo)
+                yield spi.sdi.eq((byte >> (7 - bit)) & 1)
+                yield spi.sck.eq(1)
+                yield from self.tick(2)
+                yield spi.sck.eq(0)
+                yield from self.tick(2)
+            received.append(rx)
+        yield spi.csn.eq(1)
+        # CS must stay deasserted for a while between transactions.
+        yield from self.tick(self.gap)
+        return received
+
+    def write(self, addr, data):
+        yield from self.transfer([WRITE, addr >> 8, addr & 0xff, *data])
+
+    def read(self, addr, n):
+        received = yield from self.transfer(
+            [READ, addr >> 8, addr & 0xff, *[0] * n])
+        return received[3:]
+
+
+def measure_throughput(n_bytes=512, f_sync=10e6, seed=0):
+    """
+    Write then read back `n_bytes` of random data, first as one burst each
+    way and then one register per transaction, checking the data, and
+    return a dict of host-visible bytes per second for each, plus the
+    limit set by the SCK frequency.
+    """
+    regfile = SPIRegisterFile(depth=1 << (n_bytes - 1).bit_length())
+    rng = random.Random(seed)
+    data = [rng.randrange(256) for _ in range(n_bytes)]
+    rates = {"sck_limit": f_sync / 4 / 8}
+
+    def testbench():
+        host = SPIHost(regfile)
+        yield regfile.csn.eq(1)
+        yield from host.tick(4)
+
+        def timed(name, process):
+            start = host.cycles
+            result = yield from process
+            rates[name] = n_bytes * f_sync / (host.cycles - start)
+            return result
+
+        def singles(make):
+            results = []
+            for addr in range(n_bytes):
+                results.append((yield from make(addr)))
+            return results
+
+        yield from timed("burst_write", host.write(0, data))
+        assert (yield from timed("burst_read", host.read(0, n_bytes))) \
+            == data
+        for addr in range(n_bytes):
+            assert (yield regfile.mem[addr]) == data[addr]
+
+        reversed_data = data[::-1]
+        yield from timed("single_write", singles(
+            lambda addr: host.write(addr, [reversed_data[addr]])))
+        read = yield from timed("single_read", singles(
+            lambda addr: host.read(addr, 1)))
+        assert [byte for [byte] in read] == reversed_data
+
+    sim = Simulator(regfile)
+    sim.add_clock(1 / f_sync)
+    sim.add_sync_process(testbench)
+    sim.run()
+    return rates
+
+
+def test_spi_regfile():
+    import gc
+    import warnings
+    from amaranth.hdl.ir import UnusedElaboratable
+
+    regfile = SPIRegisterFile(depth=16, init=range(100, 116))
+
+    def testbench():
+        host = SPIHost(regfile)
+        yield regfile.csn.eq(1)
+        yield from host.tick(4)
+
+        # Reads start at any address and wrap around the end.
+        assert (yield from host.read(0, 3)) == [100, 101, 102]
+        assert (yield from host.read(14, 4)) == [114, 115, 100, 101]
+
+        # Header bytes are answered with zeros.
+        received = yield from host.transfer([READ, 0, 5, 0])
+        assert received == [0, 0, 0, 105]
+
+        # A burst write is visible to the next read, and to the memory.
+        yield from host.write(6, [1, 2, 3])
+        assert (yield from host.read(5, 5)) == [105, 1, 2, 3, 109]
+        assert (yield regfile.mem[8]) == 3
+
+        # Address bits beyond the depth are ignored.
+        assert (yield from host.read(0x1234, 1)) == [104]
+
+        # An unknown command is ignored, including its data bytes.
+        assert (yield from host.transfer([0x55, 0, 0, 7])) == [0, 0, 0, 0]
+        assert (yield regfile.mem[0]) == 100
+
+    sim = Simulator(regfile)
+    sim.add_clock(1/10e6)
+    sim.add_sync_process(testbench)
+    sim.run()
+
+    # Depths which aren't a power of two are rejected (and so never get
+    # elaborated, which Amaranth would otherwise warn about).
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UnusedElaboratable)
+        for depth in (0, 12, 1000, 2**17):
+            try:
+                SPIRegisterFile(depth=depth)
+            except ValueError:
+                pass
+            else:
+                assert False, f"depth {depth} should be rejected"
+        gc.collect()
+
+
+def test_spi_regfile_startup():
+    # At 10MHz, the start-up delay is 150 cycles.
+    regfile = SPIRegisterFile(depth=16, init=range(16), clk_freq=10e6)
+
+    def testbench():
+        host = SPIHost(regfile)
+        yield regfile.csn.eq(1)
+        yield
+        assert not (yield regfile.ready)
+        # This write starts before the register file is ready, and is
+        # ignored, even the bytes sent after it becomes ready.
+        yield from host.write(0, [0xaa] * 8)
+        assert host.cycles > 150 and (yield regfile.ready)
+        assert (yield from host.read(0, 2)) == [0, 1]
+        yield from host.write(0, [0xaa])
+        assert (yield from host.read(0, 2)) == [0xaa, 1]
+
+    sim = Simulator(regfile)
+    sim.add_clock(1/10e6)
+    sim.add_sync_process(testbench)
+    sim.run()
+
+
+def test_spi_regfile_throughput():
+    rates = measure_throughput(128)
+    for name, rate in rates.items():
+        print(f"{name:>12}: {rate / 1e3:7.1f} kB/s")
+    # A burst spends nearly all its time on data; one register per
+    # transaction sends three header bytes and waits between transactions
+    # for every byte of data.
+    for direction in ("write", "read"):
+        burst = rates[f"burst_{direction}"]
+        single = rates[f"single_{direction}"]
+        assert burst > 0.95 * rates["sck_limit"]
+        assert single < 0.25 * rates["sck_limit"]
+        assert burst > 4 * single
+
+
+def test_spi_regfile_build_toolchain():
+    from amaranth_examples.build_runner import EXAMPLES, run_builds
+
+    job = next(job for job in EXAMPLES if job.name == "spi_regfile")
+    [result] = run_builds([job], root="build/spi_regfile")
+    assert result.ok, open(result.log).read()
+    # 1024 bytes needs two 4kbit block RAMs.
+    assert result.metrics["resources"]["bram"] == 2
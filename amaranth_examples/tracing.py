@@ -0,0 +1,304 @@
+"""
+Opt-in, filtered waveform tracing for testbenches.
+
+`sim.write_vcd()` records every signal at every delta cycle into an
+uncompressed text file, which for long simulations dominates both runtime
+and disk usage. Instead, testbenches here wrap `sim.run()` in `trace()`:
+
+    with trace(sim, "spi", period=1/10e6):
+        sim.run()
+
+which does nothing at all unless tracing is turned on with environment
+variables:
+
+* `AMARANTH_EXAMPLES_TRACE`: `1` (or `all`) to trace every signal, or a
+  comma-separated allow-list of signal names or glob patterns, matched
+  against either the signal's name or its full hierarchical name, such as
+  `sck,sdo,top.rx_fifo.*`.
+* `AMARANTH_EXAMPLES_TRACE_WINDOW`: which clock cycles to write:
+  `START:END` for a range of cycles, `last:N` for the final N cycles of the
+  simulation, or `fail:N` for the N cycles before the one in which an
+  assertion failed (nothing is written if the testbench passes). By
+  default every cycle is written.
+* `AMARANTH_EXAMPLES_TRACE_DIR`: where to write traces, by default
+  `build/traces`.
+
+Signals are sampled once per clock cycle of the given domain and only
+changes are written, streamed through gzip as they happen, to
+`<name>.vcd.gz` (which GTKWave opens directly).
+"""
+
+import collections
+import contextlib
+import fnmatch
+import gzip
+import os
+
+from amaranth.sim import Simulator, Passive
+from vcd import VCDWriter
+
+
+def signal_names(sim):
+    """
+    Return a dict of hierarchical name (such as "top.rx_fifo.level") to
+    Signal for every signal in the design being simulated by `sim`.
+    """
+    names = {}
+    fragments = sim._fragment._assign_names_to_fragments(hierarchy=("top",))
+    for fragment, hierarchy in fragments.items():
+        for signal, name in fragment._assign_names_to_signals().items():
+            names.setdefault(".".join((*hierarchy, name)), signal)
+    return names
+
+
+class TraceConfig:
+    """
+    Which signals and cycles to trace, and where to write them.
+
+    `signals` is a list of name patterns (or `["*"]` for everything), and
+    `window` is None for every cycle, or one of `(start, end)`,
+    `("last", n)` or `("fail", n)`.
+    """
+    def __init__(self, signals=("*",), window=None, directory="build/traces"):
+        self.signals = list(signals)
+        self.window = window
+        self.directory = directory
+
+    @classmethod
+    def from_env(cls):
+        """Read a TraceConfig from the environment, or None if disabled."""
+        signals = os.environ.get("AMARANTH_EXAMPLES_TRACE", "")
+        if signals.lower() in ("", "0", "no", "false"):
+            return None
+        if signals.lower() in ("1", "yes", "true", "all"):
+            signals = "*"
+
+        window = os.environ.get("AMARANTH_EXAMPLES_TRACE_WINDOW", "")
+        if window:
+            start, end = window.split(":")
+            if start in ("last", "fail"):
+                window = (start, int(end))
+            else:
+                window = (int(start), int(end))
+        else:
+            window = None
+
+        directory = os.environ.get("AMARANTH_EXAMPLES_TRACE_DIR",
+                                   "build/traces")
+        return cls(signals.split(","), window, directory)
+
+    def matches(self, name):
+        short = name.rsplit(".", 1)[-1]
+        return any(fnmatch.fnmatchcase(name, pattern) or
+                   fnmatch.fnmatchcase(short, pattern)
+                   for pattern in self.signals)
+
+
+class _Tracer:
+    def __init__(self, sim, name, period, domain, config):
+        self.signals = {name: signal
+                        for name, signal in signal_names(sim).items()
+                        if config.matches(name)}
+        self.path = os.path.join(config.directory, f"{name}.vcd.gz")
+        self.period = period
+        self.window = config.window
+        self.buffered = self.window is not None and \
+            self.window[0] in ("last", "fail")
+        # One extra sample, in case it's from the cycle which failed.
+        self.ring = collections.deque(
+            maxlen=self.window[1] + 1 if self.buffered else None)
+        self.engine = sim._engine
+        self.sampled_at = None
+        self.writer = None
+        sim.add_sync_process(self.sampler, domain=domain)
+
+    def sampler(self):
+        yield Passive()
+        cycle = 0
+        while True:
+            # Like the testbench processes, sample the values each signal
+            # had at the clock edge.
+            if self.buffered or self.window is None or \
+                    self.window[0] <= cycle < self.window[1]:
+                values = []
+                for signal in self.signals.values():
+                    values.append((yield signal))
+                if self.buffered:
+                    self.ring.append((cycle, values))
+                    self.sampled_at = self.engine.now
+                else:
+                    self.write(cycle, values)
+            yield
+            cycle += 1
+
+    def timestamp(self, cycle):
+        if self.period is None:
+            return cycle
+        return round(cycle * self.period * 1e12)
+
+    def open(self, timestamp, values):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = gzip.open(self.path, "wt")
+        if self.period is None:
+            timescale = "1 ns"
+            comment = "One time unit per clock cycle"
+        else:
+            timescale = "1 ps"
+            comment = f"Sampled every {self.period * 1e12:.0f}ps"
+        self.writer = VCDWriter(self.file, timescale=timescale,
+                                comment=comment, init_timestamp=timestamp)
+        self.vars = []
+        for (name, signal), value in zip(self.signals.items(), values):
+            scope, var = name.rsplit(".", 1)
+            self.vars.append(self.writer.register_var(
+                scope, var, "wire", size=len(signal), init=value))
+        self.last = list(values)
+
+    def write(self, cycle, values):
+        timestamp = self.timestamp(cycle)
+        if self.writer is None:
+            self.open(timestamp, values)
+            return
+        for i, value in enumerate(values):
+            if value != self.last[i]:
+                self.writer.change(self.vars[i], timestamp, value)
+                self.last[i] = value
+
+    def close(self, failed):
+        if self.buffered and (failed or self.window[0] == "last"):
+            samples = list(self.ring)
+            # The sampler and the testbench wake up on the same clock edge
+            # in no fixed order, so whether the sampler ran before the
+            # testbench failed varies. Always leave out the failing cycle.
+            if failed and samples and self.sampled_at == self.engine.now:
+                samples.pop()
+            for cycle, values in samples[-self.window[1]:]:
+                self.write(cycle, values)
+        if self.writer is not None:
+            self.writer.close()
+            self.file.close()
+
+
+@contextlib.contextmanager
+def trace(sim, name, *, period=None, domain="sync", config=None):
+    """
+    Trace signals from `sim` (which must not have started running yet)
+    into `<name>.vcd.gz`, if enabled by `config`, which by default is read
+    from the environment. `period` is the clock period of `domain` in
+    seconds, used to timestamp samples; if None, the trace is in cycles.
+    """
+    if config is None:
+        config = TraceConfig.from_env()
+    if config is None:
+        yield None
+        return
+
+    tracer = _Tracer(sim, name, period, domain, config)
+    failed = True
+    try:
+        yield tracer
+        failed = False
+    finally:
+        tracer.close(failed)
+
+
+def read_changes(path):
+    """
+    Return a dict of hierarchical signal name to a list of (timestamp,
+    value) changes from a trace written by `trace()`.
+    """
+    from vcd.reader import tokenize, TokenKind
+
+    ids = {}
+    changes = collections.defaultdict(list)
+    scope = []
+    timestamp = 0
+    with gzip.open(path, "rb") as f:
+        for token in tokenize(f):
+            if token.kind is TokenKind.SCOPE:
+                scope.append(token.scope.ident)
+            elif token.kind is TokenKind.UPSCOPE:
+                scope.pop()
+            elif token.kind is TokenKind.VAR:
+                ids[token.var.id_code] = ".".join((*scope,
+                                                   token.var.reference))
+            elif token.kind is TokenKind.CHANGE_TIME:
+                timestamp = token.time_change
+            elif token.kind is TokenKind.CHANGE_VECTOR:
+                changes[ids[token.vector_change.id_code]].append(
+                    (timestamp, token.vector_change.value))
+            elif token.kind is TokenKind.CHANGE_SCALAR:
+                changes[ids[token.scalar_change.id_code]].append(
+                    (timestamp, int(token.scalar_change.value)))
+    return dict(changes)
+
+
+def test_trace_window():
+    import tempfile
+    from .counter import Counter
+
+    counter = Counter(limit=18)
+
+    def testbench():
+        for _ in range(40):
+            yield
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sim = Simulator(counter)
+        sim.add_clock(1/10e6)
+        sim.add_sync_process(testbench)
+        config = TraceConfig(["counter"], window=(10, 20), directory=tmp)
+        with trace(sim, "counter", config=config):
+            sim.run()
+
+        # Only the allow-listed signal is traced, and only inside the window.
+        changes = read_changes(os.path.join(tmp, "counter.vcd.gz"))
+        assert list(changes) == ["top.counter"]
+        assert changes["top.counter"] == [(t, t % 18) for t in range(10, 20)]
+
+
+def test_trace_on_failure():
+    import tempfile
+    from .counter import Counter
+
+    counter = Counter(limit=18)
+
+    def testbench(fail_at):
+        def bench():
+            for cycle in range(40):
+                assert cycle != fail_at
+                yield
+        return bench
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = TraceConfig(["rollover"], window=("fail", 8), directory=tmp)
+        path = os.path.join(tmp, "counter.vcd.gz")
+
+        # Nothing is written when the testbench passes...
+        sim = Simulator(counter)
+        sim.add_clock(1/10e6)
+        sim.add_sync_process(testbench(fail_at=None))
+        with trace(sim, "counter", config=config):
+            sim.run()
+        assert not os.path.exists(path)
+
+        # ...but a failure writes the cycles before it, whichever of the
+        # sampler and the testbench runs first on the failing cycle.
+        config.signals = ["counter"]
+        for tracer_first in (False, True):
+            sim = Simulator(counter)
+            sim.add_clock(1/10e6)
+            if not tracer_first:
+                sim.add_sync_process(testbench(fail_at=30))
+            try:
+                with trace(sim, "counter", config=config):
+                    if tracer_first:
+                        sim.add_sync_process(testbench(fail_at=30))
+                    sim.run()
+            except AssertionError:
+                pass
+            else:
+                assert False, "testbench should have failed"
+            changes = read_changes(path)
+            assert changes == {"top.counter": [(t, t % 18)
+                                               for t in range(22, 30)]}
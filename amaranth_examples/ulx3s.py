@@ -0,0 +1,19 @@
+"""
+The ULX3S board, with a tweak so the ECP5 examples can be built for it
+without the tools needed to program it.
+
+Examples refer to this by the name "ulx3s_12f" in registry.py, so that it
+(and amaranth_boards) is only imported when one of them is built.
+"""
+
+from amaranth_boards.ulx3s import ULX3S_12F_Platform
+
+
+class FakeULX3SPlatform(ULX3S_12F_Platform):
+    """
+    The real ULX3S_12F_Platform inconsiderately requires openFPGAloader
+    present in the build environment, even if you're not programming.
+    """
+    @property
+    def required_tools(self):
+        return super().required_tools[:-1]
@@ -0,0 +1,474 @@
+"""
+Keep the YoWASP tools loaded in a server, so builds don't start them cold.
+
+CI runs Yosys, nextpnr and the bitstream packers through YoWASP, where each
+`yowasp-yosys` or `yowasp-nextpnr-ice40` command starts a fresh Python,
+imports wasmtime, reads and hashes the tool's WebAssembly (26MB for
+Yosys), and loads its compiled machine code from YoWASP's cache before the
+tool itself starts. A build runs three tools, so that happens three times
+per design.
+
+Instead, a server loads every tool's compiled module once and keeps it:
+
+    python -m amaranth_examples.warm_toolchain serve
+
+It writes a small client script for each tool next to its socket, in a
+directory only the current user can access (in `$XDG_RUNTIME_DIR` if it's
+set; the server refuses to use one anybody else could write to), and
+`python -m amaranth_examples.warm_toolchain env` prints the `YOSYS`,
+`NEXTPNR_ICE40` (and so on) variables pointing Amaranth's build scripts at
+them. Each client sends its arguments, working directory and its stdout
+and stderr file descriptors to the server over a Unix socket, so the tool
+writes exactly where a cold one would, then exits with the tool's exit
+status. The server runs each request in a fresh instance of the module on
+a pool of threads, several at once for parallel builds. If the server
+isn't running, the clients start the usual YoWASP command instead.
+
+build_runner.py starts a server for the length of a run when given
+`--warm`. To compare build latency of every synthesis example with cold and
+warm tools:
+
+    python -m amaranth_examples.warm_toolchain bench
+
+The tools' own run time is the same either way, so the saving is only the
+fixed start-up cost of each invocation: with the compiled modules already
+in YoWASP's cache, around 0.1 to 0.3 seconds per build here, or a few
+percent of these small examples' build times. It matters more for many
+short builds, and when YoWASP's cache is cold, since the server compiles
+each tool once rather than in every parallel build which finds it missing.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Each tool Amaranth's build scripts run: the environment variable naming
+# it, and its YoWASP package, WebAssembly file and resource directories.
+TOOLS = {
+    "yosys": ("YOSYS", "yowasp_yosys", "yosys.wasm", ["share"]),
+    "nextpnr-ice40": ("NEXTPNR_ICE40", "yowasp_nextpnr_ice40",
+                      "nextpnr-ice40.wasm", ["share"]),
+    "icepack": ("ICEPACK", "yowasp_nextpnr_ice40", "icepack.wasm", []),
+    "nextpnr-ecp5": ("NEXTPNR_ECP5", "yowasp_nextpnr_ecp5",
+                     "nextpnr-ecp5.wasm", ["share"]),
+    "ecppack": ("ECPPACK", "yowasp_nextpnr_ecp5", "ecppack.wasm", ["share"]),
+}
+
+
+# The client each tool's command runs. It only uses the standard library,
+# and Python runs it with -S, to start as quickly as possible.
+CLIENT = """\
+#!{python} -S
+import json, os, socket, sys
+sock = socket.socket(socket.AF_UNIX)
+try:
+    sock.connect({socket!r})
+except OSError:
+    os.execvp("yowasp-{tool}", ["yowasp-{tool}", *sys.argv[1:]])
+request = {{"tool": "{tool}", "argv": sys.argv[1:], "cwd": os.getcwd()}}
+socket.send_fds(sock, [json.dumps(request).encode() + b"\\n"], [1, 2])
+sys.exit(int(sock.makefile().readline() or 1))
+"""
+
+
+def default_directory():
+    """
+    Where the server keeps its socket and client scripts by default: in
+    `$XDG_RUNTIME_DIR` if it's set, which only this user can write to, or
+    else in a directory for this user in the system's temporary directory.
+    """
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, "amaranth-toolchain")
+    return os.path.join(tempfile.gettempdir(),
+                        f"amaranth-toolchain-{os.getuid()}")
+
+
+def private_directory(directory):
+    """
+    Create `directory`, readable and writable only by this user, or check
+    that it already is, returning it. Anyone who could write to it could
+    replace the client scripts that builds run as their tools, so this
+    raises RuntimeError if it's a symlink, has another owner, or any
+    permissions for group or others.
+    """
+    with contextlib.suppress(FileExistsError):
+        os.mkdir(directory, 0o700)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode):
+        raise RuntimeError(f"{directory} is not a directory")
+    if info.st_uid != os.getuid():
+        raise RuntimeError(f"{directory} is owned by another user")
+    if info.st_mode & 0o077:
+        raise RuntimeError(f"{directory} is accessible by other users "
+                           f"(mode {stat.S_IMODE(info.st_mode):o})")
+    return directory
+
+
+def socket_path(directory):
+    return os.path.join(directory, "toolchain.sock")
+
+
+def environ(directory=None):
+    """
+    The environment variables which point Amaranth's build scripts at the
+    clients of the server in `directory`.
+    """
+    directory = directory or default_directory()
+    return {var: os.path.join(directory, "bin", tool)
+            for tool, (var, _, _, _) in TOOLS.items()}
+
+
+def write_clients(directory):
+    """Write a client script for each tool into `directory/bin`."""
+    os.makedirs(os.path.join(directory, "bin"), exist_ok=True)
+    for tool, path in zip(TOOLS, environ(directory).values()):
+        with open(path, "w") as f:
+            f.write(CLIENT.format(python=sys.executable, tool=tool,
+                                  socket=socket_path(directory)))
+        os.chmod(path, 0o755)
+
+
+def load_module(engine, package, wasm):
+    """
+    Load the compiled module for `wasm` in the YoWASP `package`, from
+    YoWASP's own cache if it's there, otherwise compiling and caching it.
+    """
+    import platformdirs
+    import wasmtime
+    from importlib import resources
+
+    binary = resources.files(package).joinpath(wasm).read_bytes()
+    cache_dir = os.environ.get(
+        "YOWASP_CACHE_DIR",
+        platformdirs.user_cache_dir("YoWASP", appauthor=False))
+    cache = os.path.join(cache_dir, package, wasm,
+                         hashlib.sha1(binary).hexdigest())
+    if os.path.exists(cache):
+        try:
+            return wasmtime.Module.deserialize_file(engine, cache)
+        except wasmtime.WasmtimeError:
+            pass
+    module = wasmtime.Module(engine, binary)
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    with open(cache, "wb") as f:
+        f.write(module.serialize())
+    return module
+
+
+def _writer(fd):
+    def write(data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    return write
+
+
+class ToolServer:
+    """
+    Runs YoWASP tools in this process, from modules loaded once. `run()` is
+    safe to call from several threads at once.
+    """
+    def __init__(self, tools=None):
+        import wasmtime
+
+        config = wasmtime.Config()
+        # As for YoWASP, which builds the tools with exception handling.
+        config.wasm_exceptions = True
+        self.engine = wasmtime.Engine(config)
+        self.modules = {}
+        self.load_times = {}
+        for tool in tools or TOOLS:
+            _, package, wasm, _ = TOOLS[tool]
+            start = time.perf_counter()
+            self.modules[tool] = load_module(self.engine, package, wasm)
+            self.load_times[tool] = time.perf_counter() - start
+
+    def _wasi(self, tool, argv, cwd, fds):
+        import wasmtime
+        from importlib import resources
+
+        _, package, _, dirs = TOOLS[tool]
+        wasi = wasmtime.WasiConfig()
+        wasi.argv = [f"yowasp-{tool}", *argv]
+        wasi.stdout_custom = _writer(fds[0])
+        wasi.stderr_custom = _writer(fds[1])
+        # The same directories as YoWASP would make visible: the whole
+        # filesystem, the working directory and each of its parents as
+        # relative paths, and the tool's resources.
+        for name in os.listdir("/"):
+            if os.path.isdir(f"/{name}"):
+                try:
+                    wasi.preopen_dir(f"/{name}", f"/{name}")
+                except wasmtime.WasmtimeError:
+                    continue
+        wasi.preopen_dir(cwd, ".")
+        for level in range(len(pathlib.Path(cwd).parts)):
+            wasi.preopen_dir(os.path.join(cwd, *[".."] * level),
+                             "/".join([".."] * level))
+        for name in dirs:
+            wasi.preopen_dir(str(resources.files(package) / name), f"/{name}")
+        return wasi
+
+    def run(self, tool, argv, cwd, fds=(1, 2)):
+        """
+        Run `tool` with arguments `argv` in the directory `cwd`, with its
+        stdout and stderr on the file descriptors `fds`, returning its exit
+        status.
+        """
+        import wasmtime
+
+        with tempfile.TemporaryDirectory(prefix="yowasp_") as tmp:
+            wasi = self._wasi(tool, argv, cwd, fds)
+            wasi.preopen_dir(tmp, "/tmp")
+            linker = wasmtime.Linker(self.engine)
+            linker.define_wasi()
+            store = wasmtime.Store(self.engine)
+            store.set_wasi(wasi)
+            app = linker.instantiate(store, self.modules[tool])
+            linker.define_instance(store, "app", app)
+            try:
+                app.exports(store)["_start"](store)
+                return 0
+            except wasmtime.ExitTrap as trap:
+                return trap.code
+            except Exception:
+                _writer(fds[1])(traceback.format_exc().encode())
+                return 1
+
+
+def _handle(server, conn):
+    with conn:
+        data = b""
+        fds = []
+        while not data.endswith(b"\n"):
+            chunk, more, _, _ = socket.recv_fds(conn, 65536, 2)
+            if not chunk:
+                return
+            data += chunk
+            fds += more
+        try:
+            if len(fds) != 2:
+                return
+            request = json.loads(data)
+            if request["tool"] in server.modules:
+                status = server.run(request["tool"], request["argv"],
+                                    request["cwd"], fds)
+            else:
+                _writer(fds[1])(f"{request['tool']} is not loaded in the "
+                                f"toolchain server\n".encode())
+                status = 127
+        finally:
+            for fd in fds:
+                os.close(fd)
+        conn.sendall(f"{status}\n".encode())
+
+
+def serve(directory=None, workers=None, ready=None):
+    """
+    Load the tools and serve requests from their clients in `directory`
+    forever, running up to `workers` (by default, one per CPU) at once.
+    `ready` is called once the tools are loaded and the clients written.
+    """
+    directory = private_directory(directory or default_directory())
+    server = ToolServer()
+    for tool, seconds in server.load_times.items():
+        print(f"Loaded {tool} in {seconds:.2f}s", file=sys.stderr)
+    path = socket_path(directory)
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX)
+    listener.bind(path)
+    listener.listen()
+    write_clients(directory)
+    if ready is not None:
+        ready()
+    with listener, ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+        while True:
+            conn, _ = listener.accept()
+            pool.submit(_handle, server, conn)
+
+
+@contextlib.contextmanager
+def running_server(directory=None, workers=None):
+    """
+    Start a toolchain server in a new process for the duration of the
+    `with` block, giving the environment variables to use its tools.
+    Unless a `directory` is given, its socket and clients go in a new
+    temporary directory, removed afterwards.
+    """
+    temporary = directory is None
+    if temporary:
+        directory = tempfile.mkdtemp(prefix="amaranth-toolchain-")
+    command = [sys.executable, "-m", f"{__package__}.warm_toolchain",
+               "serve", "--dir", directory]
+    if workers is not None:
+        command += ["--workers", str(workers)]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    try:
+        if proc.stdout.readline().strip() != "ready":
+            raise RuntimeError("The toolchain server failed to start")
+        yield environ(directory)
+    finally:
+        proc.terminate()
+        proc.wait()
+        if temporary:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def tool_environ(env):
+    """Set the environment variables in `env` for a `with` block."""
+    saved = {var: os.environ.get(var) for var in env}
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                del os.environ[var]
+            else:
+                os.environ[var] = value
+
+
+def cold_environ():
+    """The environment variables to run each YoWASP tool's own command."""
+    return {var: f"yowasp-{tool}" for tool, (var, _, _, _) in TOOLS.items()}
+
+
+def benchmark(jobs=None, root="build/warm_bench", repeats=3):
+    """
+    Build each of `jobs` (by default, every example in build_runner.py) one
+    at a time, `repeats` times each with cold tools and with the toolchain
+    server, returning a dict of job name to the fastest (cold, warm) total
+    time in seconds of its toolchain stages.
+    """
+    from amaranth_examples.build_runner import EXAMPLES, run_build
+
+    jobs = jobs or EXAMPLES
+    times = {job.name: {"cold": [], "warm": []} for job in jobs}
+
+    def build(kind):
+        for job in jobs:
+            result = run_build(job, os.path.join(root, kind), profile=True)
+            if not result.ok:
+                raise RuntimeError(f"{job.name} failed with {kind} tools, "
+                                   f"see {result.log}")
+            times[job.name][kind].append(
+                sum(stage.elapsed for stage in result.stages))
+
+    with running_server(workers=1) as env:
+        for _ in range(repeats):
+            with tool_environ(cold_environ()):
+                build("cold")
+            with tool_environ(env):
+                build("warm")
+    return {name: (min(t["cold"]), min(t["warm"]))
+            for name, t in times.items()}
+
+
+def format_benchmark(results):
+    width = max(len(name) for name in results)
+    lines = [f"  {'':<{width}}     cold     warm  speedup"]
+    for name, (cold, warm) in results.items():
+        lines.append(f"  {name:<{width}}  {cold:6.2f}s  {warm:6.2f}s  "
+                     f"{cold / warm:6.2f}x")
+    cold = sum(cold for cold, _ in results.values())
+    warm = sum(warm for _, warm in results.values())
+    lines.append(f"  {'total':<{width}}  {cold:6.2f}s  {warm:6.2f}s  "
+                 f"{cold / warm:6.2f}x")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run the server")
+    serve_parser.add_argument("--dir", default=None,
+                              help="where to put the socket and clients")
+    serve_parser.add_argument("--workers", type=int, default=None,
+                              help="tools to run at once (default: CPUs)")
+    env_parser = commands.add_parser(
+        "env", help="print shell commands to use a running server")
+    env_parser.add_argument("--dir", default=None)
+    bench_parser = commands.add_parser(
+        "bench", help="compare build latency with cold and warm tools")
+    bench_parser.add_argument("examples", nargs="*", metavar="EXAMPLE")
+    bench_parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args.dir, args.workers, ready=lambda: print("ready", flush=True))
+    elif args.command == "env":
+        directory = private_directory(args.dir or default_directory())
+        for var, path in environ(directory).items():
+            print(f"export {var}={path}")
+    else:
+        from amaranth_examples.build_runner import EXAMPLES
+        jobs = [job for job in EXAMPLES
+                if not args.examples or job.name in args.examples]
+        print(format_benchmark(benchmark(jobs, repeats=args.repeats)))
+
+
+def test_private_directory():
+    with tempfile.TemporaryDirectory() as tmp:
+        # A new directory is only accessible by this user.
+        path = private_directory(os.path.join(tmp, "new"))
+        assert stat.S_IMODE(os.lstat(path).st_mode) == 0o700
+        assert private_directory(path) == path
+
+        # Anything else already there is refused.
+        shared = os.path.join(tmp, "shared")
+        os.mkdir(shared)
+        os.chmod(shared, 0o777)
+        link = os.path.join(tmp, "link")
+        os.symlink(path, link)
+        for directory in (shared, link):
+            try:
+                private_directory(directory)
+            except RuntimeError:
+                pass
+            else:
+                assert False, f"{directory} should be refused"
+
+
+def test_warm_toolchain():
+    from amaranth_examples.build_runner import EXAMPLES, run_build
+
+    job = next(job for job in EXAMPLES if job.name == "custom_board")
+    with tool_environ(cold_environ()):
+        cold = run_build(job, "build/warm/cold")
+    with running_server() as env, tool_environ(env):
+        # A tool's output goes wherever the client's would.
+        proc = subprocess.run([env["YOSYS"], "-V"], capture_output=True,
+                              text=True)
+        assert proc.returncode == 0 and proc.stdout.startswith("Yosys")
+        proc = subprocess.run([env["ICEPACK"], "missing.asc", "out.bin"],
+                              capture_output=True, text=True)
+        assert proc.returncode == 1 and "Failed to open" in proc.stderr
+        warm = run_build(job, "build/warm/warm")
+    for result in (cold, warm):
+        assert result.ok, open(result.log).read()
+    # The same tools build the same bitstream.
+    bitstreams = []
+    for result in (cold, warm):
+        with open(os.path.join(result.build_dir, "top.bin"), "rb") as f:
+            bitstreams.append(f.read())
+    assert bitstreams[0] == bitstreams[1]
+
+
+if __name__ == "__main__":
+    main()
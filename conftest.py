@@ -0,0 +1,55 @@
+"""
+Split the tests into two tiers.
+
+Tests whose names end in `_toolchain` run Yosys and nextpnr (or a C++
+compiler) and can take minutes, so they're marked `toolchain` here, rather
+than in the examples themselves, and skipped unless pytest is given
+`--toolchain`. Everything else only simulates or elaborates designs,
+including build_runner.py's `test_elaborate_examples`, which checks every
+synthesis example elaborates against its platform without running the
+toolchain.
+
+At the end of the run we print how long each tier took.
+"""
+
+import pytest
+
+
+def pytest_addoption(parser):
+    parser.addoption("--toolchain", action="store_true",
+                     help="also run tests which need the FPGA toolchain")
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(config, items):
+    # Before pytest's own hook, so `-m toolchain` sees the markers.
+    for item in items:
+        name = getattr(item, "originalname", item.name)
+        if name.endswith("_toolchain"):
+            item.add_marker(pytest.mark.toolchain)
+
+    if config.getoption("--toolchain"):
+        return
+    skip = pytest.mark.skip(reason="needs the toolchain, use --toolchain")
+    for item in items:
+        if "toolchain" in item.keywords:
+            item.add_marker(skip)
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    tiers = {"fast": [0, 0.0], "toolchain": [0, 0.0]}
+    for reports in terminalreporter.stats.values():
+        for report in reports:
+            if getattr(report, "when", None) != "call":
+                continue
+            tier = tiers["toolchain" if "toolchain" in report.keywords
+                         else "fast"]
+            tier[0] += 1
+            tier[1] += report.duration
+    terminalreporter.section("test tiers")
+    for name, (count, duration) in tiers.items():
+        if count:
+            terminalreporter.write_line(
+                f"{name}: {count} tests in {duration:.2f}s")
+        else:
+            terminalreporter.write_line(f"{name}: not run")